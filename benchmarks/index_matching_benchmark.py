@@ -0,0 +1,65 @@
+"""
+Scaling of the Index Matching engines on synthetic lanes.
+
+Each lane holds random UDI-like indexes (8, 10 and 12 bases) plus a few
+near-duplicates, so both engines have real collisions to report. The two
+engines must return the same pairs; the exhaustive one is skipped above
+--max-exhaustive samples.
+
+    python benchmarks/index_matching_benchmark.py --sizes 1000 2500 5000 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddlab.index_matching import filter_matching_pairs  # noqa: E402
+
+
+def synthetic_lane(n, seed=0, near_fraction=0.01):
+    rng = np.random.default_rng(seed)
+    lengths = rng.choice([8, 10, 12], size=n, p=[0.2, 0.4, 0.4])
+    indexes = ["".join(rng.choice(list("ACGT"), size=length)) for length in lengths]
+    # Near-duplicates: copies of earlier indexes with one substitution
+    for pos in rng.choice(np.arange(1, n), size=int(n * near_fraction), replace=False):
+        base = list(indexes[rng.integers(pos)])
+        base[rng.integers(len(base))] = rng.choice(list("ACGT"))
+        indexes[pos] = "".join(base)
+    return pd.DataFrame({
+        "Lane": 1,
+        "index7": indexes,
+        "CGF_ID": [f"CGF{i}" for i in range(n)],
+        "Sample_ID": [f"S{i}" for i in range(n)],
+    })
+
+
+def timed(df, engine):
+    start = time.perf_counter()
+    pairs = filter_matching_pairs(df, engine=engine)
+    return time.perf_counter() - start, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2500, 5000, 10000])
+    parser.add_argument("--max-exhaustive", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'samples':>8} {'pairs':>8} {'exhaustive s':>13} {'pigeonhole s':>13}")
+    for n in args.sizes:
+        df = synthetic_lane(n)
+        pigeon_time, pigeon = timed(df, "pigeonhole")
+        exhaustive_time = float("nan")
+        if n <= args.max_exhaustive:
+            exhaustive_time, exhaustive = timed(df, "exhaustive")
+            assert exhaustive.equals(pigeon), f"Engines disagree on {n} samples"
+        print(f"{n:>8} {len(pigeon):>8} {exhaustive_time:>13.2f} {pigeon_time:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Shared, Streamlit-free building blocks used by the DDLAB Tools pages.
+"""
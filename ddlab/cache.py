@@ -0,0 +1,105 @@
+"""
+Bounded least-recently-used cache for results derived from uploaded files.
+
+Keys are built from the SHA-256 of the uploaded bytes plus the settings that
+change the result, so a rerun of the page, or the same sheet uploaded again
+by someone else, finds the parsed sheet and the analysis already computed.
+With `max_bytes` the cache also keeps the (approximate, see `size_of`)
+memory of its values under a cap, dropping the least recently used first.
+"""
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def content_key(data, *settings):
+    """Cache key of some bytes plus the settings used to process them."""
+    return (hashlib.sha256(data).hexdigest(), *settings)
+
+
+def size_of(value):
+    """Approximate memory of a value: deep size of pandas objects and arrays, containers and attributes summed."""
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(size_of(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(size_of(k) + size_of(v) for k, v in value.items())
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + size_of(vars(value))
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Thread-safe mapping keeping at most `max_entries` items (and, with
+    `max_bytes`, at most that much memory), dropping the least recently used.
+    """
+
+    def __init__(self, max_entries=16, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._sizes = {}
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def _drop(self, key):
+        del self._items[key]
+        self.total_bytes -= self._sizes.pop(key, 0)
+
+    def put(self, key, value):
+        size = size_of(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # Larger than the whole cache: not kept
+            self._items[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            while len(self._items) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self._drop(next(iter(self._items)))
+
+    def get_or_compute(self, key, compute):
+        """Cached value of `key`, calling `compute()` (outside the lock) on a miss."""
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
@@ -0,0 +1,160 @@
+"""
+Rule-based data-quality checks of uploaded sample sheets.
+
+Each rule looks at whole columns with vectorised string operations and
+returns a boolean mask of the offending cells (same index as the sheet, one
+column per checked column). `run_rules` evaluates a list of rules in one pass
+over the sheet and combines the masks, which the Index Matching page uses to
+highlight the cells and the command line to report the rows.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# Characters not allowed in any cell of a sample sheet
+FORBIDDEN_CHARACTERS = " -"
+NUCLEOTIDES = "ACGTN"
+HIGHLIGHT = "background-color: #ffcccc"
+
+
+def _text(column):
+    """Cells as the text shown in the sheet (str(value)); missing cells stay missing."""
+    return column.astype(str).where(column.notna())
+
+
+class Rule:
+    """A named check; `mask(df)` returns the offending cells of the columns it checks."""
+
+    name = ""
+
+    def columns(self, df):
+        return []
+
+    def mask(self, df):
+        raise NotImplementedError
+
+
+class ForbiddenCharacters(Rule):
+    def __init__(self, characters=FORBIDDEN_CHARACTERS, columns=None, name="Spaces or hyphens"):
+        self.pattern = "[" + re.escape(characters) + "]"
+        self._columns = columns
+        self.name = name
+
+    def columns(self, df):
+        return [col for col in (self._columns or df.columns) if col in df.columns]
+
+    def mask(self, df):
+        return pd.DataFrame({
+            col: _text(df[col]).str.contains(self.pattern, regex=True).fillna(False).astype(bool)
+            for col in self.columns(df)
+        }, index=df.index)
+
+
+class Duplicates(Rule):
+    def __init__(self, column, name=None):
+        self.column = column
+        self.name = name or f"Duplicated {column}"
+
+    def columns(self, df):
+        return [self.column] if self.column in df.columns else []
+
+    def mask(self, df):
+        return pd.DataFrame({col: df[col].duplicated(keep=False) for col in self.columns(df)}, index=df.index)
+
+
+class IndexAlphabet(Rule):
+    """Index sequences with characters other than the nucleotides (missing cells are not checked)."""
+
+    def __init__(self, columns=("index7", "index5"), alphabet=NUCLEOTIDES, name="Invalid index characters"):
+        self.pattern = "[" + re.escape(alphabet) + "]+"
+        self._columns = list(columns)
+        self.name = name
+
+    def columns(self, df):
+        return [col for col in self._columns if col in df.columns]
+
+    def mask(self, df):
+        # Missing cells are not offending (fullmatch gives False for them on pandas 3, NaN before)
+        return pd.DataFrame({
+            col: df[col].notna() & ~_text(df[col]).str.fullmatch(self.pattern).fillna(False).astype(bool)
+            for col in self.columns(df)
+        }, index=df.index)
+
+
+class LaneIndexLength(Rule):
+    """Indexes whose length differs from the most common length of their lane."""
+
+    def __init__(self, columns=("index7", "index5"), lane_column="Lane", name="Index length differs in lane"):
+        self._columns = list(columns)
+        self.lane_column = lane_column
+        self.name = name
+
+    def columns(self, df):
+        if self.lane_column not in df.columns:
+            return []
+        return [col for col in self._columns if col in df.columns]
+
+    def mask(self, df):
+        masks = {}
+        lanes = df[self.lane_column]
+        for col in self.columns(df):
+            lengths = _text(df[col]).str.len()
+            counts = pd.DataFrame({"lane": lanes, "length": lengths}).dropna().value_counts()
+            # Most common length per lane (ties: the shortest)
+            modal = (counts.reset_index().sort_values(["lane", "count", "length"], ascending=[True, False, True])
+                     .drop_duplicates("lane").set_index("lane")["length"])
+            expected = lanes.map(modal)
+            masks[col] = (lengths.notna() & expected.notna() & (lengths != expected)).astype(bool)
+        return pd.DataFrame(masks, index=df.index)
+
+
+DEFAULT_RULES = [
+    ForbiddenCharacters(),
+    Duplicates("CGF_ID"),
+    Duplicates("Sample_ID"),
+    IndexAlphabet(),
+    LaneIndexLength(),
+]
+
+
+class QualityReport:
+    """Masks of the offending cells, per rule and combined."""
+
+    def __init__(self, df, masks):
+        self.df = df
+        self.masks = masks
+        cells = np.zeros(df.shape, dtype=bool)
+        for mask in masks.values():
+            positions = df.columns.get_indexer(mask.columns)
+            cells[:, positions] |= mask.to_numpy(dtype=bool)
+        self.cell_mask = pd.DataFrame(cells, index=df.index, columns=df.columns)
+
+    def cells(self, rule_name):
+        """Number of offending cells of a rule."""
+        return int(self.masks[rule_name].to_numpy().sum())
+
+    def rows(self, rule_name=None):
+        """Boolean Series of the rows with an issue (of one rule, or of any rule)."""
+        mask = self.cell_mask if rule_name is None else self.masks[rule_name]
+        return pd.Series(mask.to_numpy().any(axis=1), index=self.df.index)
+
+    def summary(self):
+        """One row per rule: cells and rows affected."""
+        return pd.DataFrame({
+            "Rule": list(self.masks),
+            "Cells": [self.cells(name) for name in self.masks],
+            "Rows": [int(self.rows(name).sum()) for name in self.masks],
+        })
+
+    def highlighted(self, rows=None):
+        """Styler of the sheet (or of the selected rows) with the offending cells highlighted."""
+        rows = self.rows() if rows is None else rows
+        cells = self.cell_mask[rows]
+        return self.df[rows].style.apply(lambda _: np.where(cells, HIGHLIGHT, ""), axis=None)
+
+
+def run_rules(df, rules=None):
+    """Evaluate the rules (default DEFAULT_RULES) on a sheet."""
+    rules = DEFAULT_RULES if rules is None else rules
+    return QualityReport(df, {rule.name: rule.mask(df) for rule in rules})
@@ -0,0 +1,83 @@
+"""
+Facet index for the cascading filter selectboxes of the database pages.
+
+Each filter field is converted to text and factorized once per data version:
+sorted distinct values plus an integer code per row. The rows holding a value
+are a cached boolean bitmap, so "distinct values of field B given the
+selections on A" is a bitmap intersection followed by a bincount of B's codes,
+without converting, sorting or copying the DataFrame on every rerun.
+"""
+import numpy as np
+import pandas as pd
+
+
+class FacetIndex:
+    """
+    Distinct values and per-value row bitmaps of the filter fields of a frame.
+    Fields are factorized on first use; the index is read-only afterwards and
+    can be shared by all sessions showing the same data version.
+    """
+
+    def __init__(self, df):
+        self._df = df
+        self.size = len(df)
+        self._fields = {}
+        self._bitmaps = {}
+
+    def _facet(self, field):
+        """(codes, sorted distinct values) of a field; missing cells get code -1."""
+        facet = self._fields.get(field)
+        if facet is None:
+            column = self._df[field]
+            categories = column.cat.categories if isinstance(column.dtype, pd.CategoricalDtype) else None
+            if categories is not None and all(isinstance(c, str) for c in categories):
+                # Typed tables (ddlab.schema): reuse the category codes, ranked by text
+                uniques = np.asarray(categories, dtype=object)
+                order = np.argsort(uniques)
+                rank = np.empty(len(order), dtype=np.intp)
+                rank[order] = np.arange(len(order))
+                codes = column.cat.codes.to_numpy().astype(np.intp)
+                if len(order):
+                    codes = np.where(codes >= 0, rank[codes], -1)
+                facet = (codes, uniques[order])
+            else:
+                # Same text the selectboxes compare against: df[field].dropna().astype(str)
+                text = column.astype(str).astype(object).where(column.notna(), None)
+                codes, uniques = pd.factorize(text, sort=True)
+                facet = (codes, np.asarray(uniques, dtype=object))
+            self._fields[field] = facet
+        return facet
+
+    def all_rows(self):
+        return np.ones(self.size, dtype=bool)
+
+    def values(self, field, rows=None):
+        """Sorted distinct values of `field` among the selected rows (all rows if None)."""
+        codes, uniques = self._facet(field)
+        if rows is not None:
+            codes = codes[rows]
+        present = np.bincount(codes[codes >= 0], minlength=len(uniques)) > 0
+        return uniques[present].tolist()
+
+    def bitmap(self, field, value):
+        """Boolean array of the rows whose `field` shows as `value`."""
+        key = (field, value)
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            codes, uniques = self._facet(field)
+            pos = np.searchsorted(uniques, value) if len(uniques) else 0
+            if pos < len(uniques) and uniques[pos] == value:
+                bitmap = codes == pos
+            else:
+                bitmap = np.zeros(self.size, dtype=bool)
+            bitmap.flags.writeable = False
+            self._bitmaps[key] = bitmap
+        return bitmap
+
+    def select(self, selections, any_value=None):
+        """Rows matching all the selections (field -> value); `any_value` means no filter."""
+        rows = self.all_rows()
+        for field, value in selections.items():
+            if value != any_value:
+                rows &= self.bitmap(field, value)
+        return rows
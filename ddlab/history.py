@@ -0,0 +1,213 @@
+"""
+NovaSeqX history: the recap workbook plus the runs added from the recap page.
+
+The workbook stays the base of the history (read through its Arrow sidecar).
+Each new run export is validated against the statistic columns and saved as
+one Arrow partition per flow cell in HISTORY_DIR/runs, so adding a run never
+touches the workbook nor parses it again. The Pool/Lane statistics of every
+library column are kept in HISTORY_DIR/stats, named after the version of the
+history they describe: an ingested run only recomputes the (Pool, Lane)
+groups it contains, anything else (edited workbook, partitions copied by
+hand) recomputes them in full on the next read.
+
+FlowCell, Pool and the library columns are always text in the history, also
+for a run export where they only hold numbers, so the frames and statistics
+of the workbook and of the runs can be concatenated and stored as Arrow.
+"""
+import hashlib
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from ddlab.recap import COLUMNS_MAP, LIBRARY_COLUMNS, STATS_COLUMNS, library_stats, load_recap
+from ddlab.sidecar import CACHE_DIR, _source_digest, file_digest, read_sidecar
+
+HISTORY_DIR = os.environ.get("DDLAB_NOVASEQX_HISTORY", "NovaSeqX_History")
+RUNS_DIR = "runs"
+STATS_DIR = "stats"
+RUN_COLUMNS = ["FlowCell", "Pool", "Lane"]
+GROUP_COLUMNS = ["Pool", "Lane"]
+TEXT_COLUMNS = ["FlowCell", "Pool"] + LIBRARY_COLUMNS
+
+_FLOWCELL = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+def _write_arrow(df, path):
+    feather.write_feather(df, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+
+
+def _as_text(df):
+    """`df` with the TEXT_COLUMNS as text (empty cells stay missing)."""
+    numeric = [col for col in TEXT_COLUMNS if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
+    if not numeric:
+        return df
+    df = df.copy()
+    for col in numeric:
+        values = df[col]
+        if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            values = values.astype("Int64")  # 7.0 -> "7", come scritto nel foglio
+        df[col] = values.astype("str").where(values.notna())
+    return df
+
+
+def _group_keys(df):
+    return pd.MultiIndex.from_frame(df[GROUP_COLUMNS].dropna())
+
+
+def run_problems(run):
+    """Reasons why a run export cannot be added (empty list = it can)."""
+    problems = []
+    missing = [col for col in RUN_COLUMNS + list(COLUMNS_MAP.values()) if col not in run.columns]
+    if missing:
+        problems.append(f"Missing columns: {', '.join(missing)}")
+    if not any(col in run.columns for col in LIBRARY_COLUMNS):
+        problems.append(f"None of the library columns {', '.join(LIBRARY_COLUMNS)} is in the file")
+    if run.empty:
+        problems.append("The file has no rows")
+    if "FlowCell" in run.columns:
+        flowcells = run["FlowCell"]
+        if flowcells.isna().any():
+            problems.append(f"{int(flowcells.isna().sum())} rows without FlowCell")
+        invalid = [fc for fc in flowcells.dropna().astype(str).unique() if not _FLOWCELL.match(fc)]
+        if invalid:
+            problems.append(f"Invalid FlowCell names: {', '.join(invalid)}")
+    return problems
+
+
+class RecapHistory:
+    """The recap workbook plus the run partitions of a history directory."""
+
+    def __init__(self, workbook, directory=None):
+        self.workbook = workbook
+        self.directory = directory or HISTORY_DIR
+        self.runs_dir = os.path.join(self.directory, RUNS_DIR)
+        self.stats_dir = os.path.join(self.directory, STATS_DIR)
+
+    def runs(self):
+        """Flow cells added to the history, in name order."""
+        if not os.path.isdir(self.runs_dir):
+            return []
+        return sorted(file[:-len(".arrow")] for file in os.listdir(self.runs_dir) if file.endswith(".arrow"))
+
+    def _run_path(self, flowcell):
+        return os.path.join(self.runs_dir, f"{flowcell}.arrow")
+
+    def version(self):
+        """Digest of the workbook and of the run partitions: changes with any of them."""
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            workbook_digest = _source_digest(self.workbook, CACHE_DIR)
+        except OSError:
+            workbook_digest = file_digest(self.workbook)
+        sha = hashlib.sha256(workbook_digest.encode())
+        for flowcell in self.runs():
+            stat = os.stat(self._run_path(flowcell))
+            sha.update(f"\0{flowcell}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+        return sha.hexdigest()[:16]
+
+    def frame(self, partitions=None):
+        """
+        Workbook rows followed by the rows of each added run. `partitions`
+        (flow cell -> rows) replaces or adds run partitions not written yet.
+        """
+        partitions = partitions or {}
+        flowcells = sorted(set(self.runs()) | set(partitions))
+        parts = [load_recap(self.workbook)] + [
+            partitions[fc] if fc in partitions else read_sidecar(self._run_path(fc)) for fc in flowcells
+        ]
+        parts = [_as_text(part) for part in parts]
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+    def _stats_path(self, library_col, version):
+        return os.path.join(self.stats_dir, f"{library_col}.{version}.arrow")
+
+    def _save_stats(self, library_col, version, stats):
+        os.makedirs(self.stats_dir, exist_ok=True)
+        path = self._stats_path(library_col, version)
+        _write_arrow(stats, path)
+        for file in os.listdir(self.stats_dir):
+            if file.startswith(library_col + ".") and file != os.path.basename(path):
+                os.remove(os.path.join(self.stats_dir, file))
+
+    def stats(self, library_col, frame=None):
+        """`library_stats` of the whole history, from the stats of this version when saved."""
+        version = self.version()
+        path = self._stats_path(library_col, version)
+        if os.path.exists(path):
+            return read_sidecar(path)
+        frame = self.frame() if frame is None else frame
+        stats = library_stats(frame, library_col) if library_col in frame.columns else pd.DataFrame(columns=STATS_COLUMNS)
+        self._save_stats(library_col, version, stats)
+        return stats
+
+    def add_run(self, run, replace=False):
+        """
+        Add a run export (typed like `read_recap`), one partition per flow cell.
+        Flow cells already in the history are refused, unless `replace` and they
+        are run partitions (the workbook is never changed). Returns the number
+        of (Pool, Lane) groups whose statistics were recomputed. If anything
+        fails, the history is left as it was.
+        """
+        problems = run_problems(run)
+        if problems:
+            raise ValueError("; ".join(problems))
+        run = _as_text(run)
+        flowcells = sorted(run["FlowCell"].unique())
+        frame = self.frame()
+        known = set(frame["FlowCell"].dropna()) if "FlowCell" in frame.columns else set()
+        added = set(self.runs())
+        clashes = [fc for fc in flowcells if fc in known and not (replace and fc in added)]
+        if clashes:
+            raise ValueError(f"FlowCell already in the history: {', '.join(clashes)}")
+
+        # Statistiche della versione corrente, prima di scrivere le partizioni
+        library_cols = [col for col in LIBRARY_COLUMNS if col in frame.columns or col in run.columns]
+        old_stats = {col: self.stats(col, frame) for col in library_cols}
+
+        # Gruppi toccati: quelli del run e, se sostituito, quelli della sua vecchia partizione
+        replaced = _group_keys(frame[frame["FlowCell"].isin(flowcells)]) if known else None
+        partitions = {fc: run[run["FlowCell"] == fc].reset_index(drop=True) for fc in flowcells}
+        frame = self.frame(partitions)
+        # Chiavi lette dallo storico, con Lane nel suo tipo (es. 1 -> 1.0)
+        affected = _group_keys(frame[frame["FlowCell"].isin(flowcells)])
+        if replaced is not None:
+            affected = affected.append(replaced).unique()
+        in_groups = pd.MultiIndex.from_frame(frame[GROUP_COLUMNS]).isin(affected)
+        new_stats = {}
+        for col in library_cols:
+            stats = old_stats[col]
+            kept = stats[~pd.MultiIndex.from_frame(stats[GROUP_COLUMNS]).isin(affected)] if len(stats) else stats
+            fresh = library_stats(frame[in_groups], col) if col in frame.columns else stats.iloc[:0]
+            new_stats[col] = (pd.concat([kept, fresh], ignore_index=True)
+                              .sort_values(["Pool", "Lane", "Library_Type"], kind="stable", ignore_index=True))
+
+        # Tutto convertito in Arrow prima di toccare lo storico: un errore non lascia partizioni a metà
+        tables = {fc: pa.Table.from_pandas(part, preserve_index=False) for fc, part in partitions.items()}
+        stats_tables = {col: pa.Table.from_pandas(stats, preserve_index=False) for col, stats in new_stats.items()}
+        os.makedirs(self.runs_dir, exist_ok=True)
+        backups = {}
+        try:
+            for flowcell, table in tables.items():
+                path = self._run_path(flowcell)
+                if os.path.exists(path):
+                    backups[path] = path + ".bak"
+                    os.replace(path, backups[path])
+                _write_arrow(table, path)
+            version = self.version()
+            for col, table in stats_tables.items():
+                self._save_stats(col, version, table)
+        except BaseException:
+            for flowcell in tables:
+                path = self._run_path(flowcell)
+                if path in backups:
+                    os.replace(backups[path], path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            raise
+        for backup in backups.values():
+            os.remove(backup)
+        return len(affected.unique())
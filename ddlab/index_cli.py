@@ -0,0 +1,156 @@
+"""
+Index Matching checks on a whole directory of sample sheets, without Streamlit.
+
+Every xlsx sheet gets <name>.matching_pairs.csv and <name>.report.json (lane
+report, data-quality checks and, with --barcode-mismatches, the recommended
+BarcodeMismatches settings) in the output directory, plus
+a summary.csv with one row per sheet. Sheets are processed in parallel.
+
+    python -m ddlab.index_cli /path/to/run_folder --output reports --recursive
+
+Exit status: 0 when every sheet was checked, 1 when some could not be
+(unreadable file, missing columns, invalid indexes...: the error is in the
+sheet's summary row and the other sheets are still checked); collisions are
+reported, not errors.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ddlab.index_kits import KitLibrary
+from ddlab.index_matching import ENGINES, I5_ORIENTATIONS, INDEX_WORKERS, STATUS_ERROR, STATUS_STRICT
+from ddlab.sample_sheet import check_sheet, read_sample_sheet
+
+
+def _json_value(value):
+    """numpy scalars and other cells of the sheet as JSON values."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def find_sheets(directory, recursive=False):
+    pattern = os.path.join(directory, "**", "*.xlsx") if recursive else os.path.join(directory, "*.xlsx")
+    # Skip the lock files Excel leaves next to open workbooks
+    return sorted(path for path in glob.glob(pattern, recursive=recursive)
+                  if not os.path.basename(path).startswith("~$"))
+
+
+def report_name(path, directory):
+    """File name prefix of a sheet's reports: its path below the input directory."""
+    relative = os.path.splitext(os.path.relpath(path, directory))[0]
+    return relative.replace(os.sep, "__")
+
+
+def check_file(path, directory, output, engine="auto", i5_orientation="forward", kits=None,
+               barcode_mismatches=False):
+    """Check one sheet and write its reports; returns its summary row (with the error if it failed)."""
+    summary = {"Sheet": os.path.relpath(path, directory)}
+    try:
+        return {**summary, **_check_file(path, directory, output, engine, i5_orientation, kits, barcode_mismatches)}
+    except Exception as e:  # Report it and go on with the other sheets
+        name = report_name(path, directory)
+        for suffix in ("matching_pairs.csv", "report.json"):
+            partial = os.path.join(output, f"{name}.{suffix}")
+            if os.path.exists(partial):
+                os.remove(partial)
+        return {**summary, "Error": str(e) or type(e).__name__}
+
+
+def _check_file(path, directory, output, engine, i5_orientation, kits, barcode_mismatches):
+    name = report_name(path, directory)
+    df = read_sample_sheet(path)
+
+    # One sheet per process already: lanes are analysed sequentially
+    lanes, pairs, quality, report = check_sheet(df, engine, i5_orientation, kits, workers=1,
+                                               barcode_mismatches=barcode_mismatches)
+    pairs.to_csv(os.path.join(output, f"{name}.matching_pairs.csv"), index=False)
+    statuses = [row["Status"] for row in report]
+    result = {
+        "sheet": os.path.relpath(path, directory),
+        "samples": len(df),
+        "matching_pairs": len(pairs),
+        "lanes": report,
+        "data_quality": {
+            "duplicated_cgf_id_rows": quality["duplicated_cgf"]["Excel_Row"].tolist(),
+            "duplicated_sample_id_rows": quality["duplicated_sample"]["Excel_Row"].tolist(),
+            "cells_with_space_or_hyphen": quality["total_format_issues"],
+            "rows_with_space_or_hyphen": quality["format_issues"]["Excel_Row"].tolist(),
+            "rules": {
+                name: {"cells": quality["report"].cells(name),
+                       "rows": df.loc[quality["report"].rows(name), "Excel_Row"].tolist()}
+                for name in quality["report"].masks
+            },
+        },
+    }
+    with open(os.path.join(output, f"{name}.report.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2, default=_json_value)
+
+    return {
+        "Samples": len(df),
+        "Lanes": len(lanes),
+        "Matching pairs": len(pairs),
+        "Lanes with errors": statuses.count(STATUS_ERROR),
+        "Lanes with 1-mismatch pairs": statuses.count(STATUS_STRICT),
+        "Duplicated CGF_ID": len(quality["duplicated_cgf"]),
+        "Duplicated Sample_ID": len(quality["duplicated_sample"]),
+        "Cells with space or hyphen": quality["total_format_issues"],
+        "Error": "",
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory", help="Directory with the sample sheets (xlsx)")
+    parser.add_argument("--output", help="Report directory (default: <directory>/index_matching_reports)")
+    parser.add_argument("--recursive", action="store_true", help="Also check sheets in subdirectories")
+    parser.add_argument("--engine", choices=ENGINES, default="auto")
+    parser.add_argument("--i5-orientation", choices=list(I5_ORIENTATIONS), default="forward")
+    parser.add_argument("--workers", type=int, default=INDEX_WORKERS, help="Sheets checked in parallel")
+    parser.add_argument("--barcode-mismatches", action="store_true",
+                        help="Recommend BarcodeMismatchesIndex1/Index2 per lane (compares every pair: slower)")
+    parser.add_argument("--kits", action="store_true",
+                        help="Use the index kit library (DDLAB_INDEX_KITS) for samples on known kit wells")
+    args = parser.parse_args(argv)
+
+    sheets = find_sheets(args.directory, args.recursive)
+    if not sheets:
+        print(f"No xlsx sample sheets in {args.directory}", file=sys.stderr)
+        return 1
+    output = args.output or os.path.join(args.directory, "index_matching_reports")
+    os.makedirs(output, exist_ok=True)
+
+    kits = None
+    if args.kits:
+        kits = KitLibrary()
+        kits.precompute()
+        kits = kits if kits.names else None
+
+    jobs = [(path, args.directory, output, args.engine, args.i5_orientation, kits, args.barcode_mismatches)
+            for path in sheets]
+    if args.workers > 1 and len(sheets) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(sheets))) as pool:
+            rows = list(pool.map(check_file, *zip(*jobs)))
+    else:
+        rows = [check_file(*job) for job in jobs]
+
+    summary = pd.DataFrame(rows).convert_dtypes()  # Counts stay integers next to failed sheets
+    summary.to_csv(os.path.join(output, "summary.csv"), index=False)
+    for row in rows:
+        if row["Error"]:
+            print(f"❌ {row['Sheet']}: {row['Error']}")
+        else:
+            print(f"{row['Sheet']}: {row['Matching pairs']} matching pairs, "
+                  f"{row['Lanes with errors']} lane(s) with identical indexes")
+    print(f"Reports written to {output}")
+    return 1 if summary["Error"].astype(bool).any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
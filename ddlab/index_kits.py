@@ -0,0 +1,271 @@
+"""
+Local library of index kits for the Index Matching tool.
+
+Most libraries are prepared with a few UDI plates, whose wells never change.
+A kit is a CSV file in the library directory (DDLAB_INDEX_KITS, default
+"Index_Kits") with one row per well: Well, index7 and, for dual-index kits,
+index5. The library starts empty; kits are added with `add_kit` (or from the
+Index Matching page) using the sequences provided by the manufacturer.
+
+For every kit and every pair of kits the pairwise comparisons are computed
+once and saved as .npy matrices next to the kits (MATRIX_DIR): i7 match counts
+and i5 distances for each orientation combination. They are opened memory
+mapped, so checking a sheet only reads the cells of the wells it uses.
+Samples of a sheet whose index7 (and index5) are exactly those of a kit well
+are compared by table lookup; only the other samples go through the live
+engine of `ddlab.index_matching`.
+"""
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from ddlab.index_matching import I5_ORIENTATIONS, encode_indexes, one_hot, reverse_complement, _relevant
+
+KITS_DIR = os.environ.get("DDLAB_INDEX_KITS", "Index_Kits")
+# Precomputed matrices, one file per (kit pair, matrix), named after the content of the kits
+MATRIX_DIR = ".matrices"
+KIT_COLUMNS = ["Well", "index7", "index5"]
+
+_KIT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]*$")
+_FORMS = ["forward", "reverse_complement"]
+
+
+def _matrix_names():
+    """i7 match counts plus one i5 distance matrix per (first, second) orientation."""
+    return ["i7"] + [f"i5_{first}_{second}" for first in _FORMS for second in _FORMS]
+
+
+def read_kit(source):
+    """
+    Kit table (Well, index7, index5 as text; index5 empty for single-index kits)
+    from an uploaded or local CSV/xlsx file. Raises ValueError when a column is missing.
+    """
+    name = getattr(source, "name", str(source))
+    table = pd.read_excel(source) if name.lower().endswith(".xlsx") else pd.read_csv(source, dtype=str)
+    return kit_table(table)
+
+
+def kit_table(table):
+    """Normalise a table with Well/index7/index5 columns to the kit format (see `read_kit`)."""
+    table = table.rename(columns=lambda col: str(col).strip())
+    missing = [col for col in KIT_COLUMNS[:2] if col not in table.columns]
+    if missing:
+        raise ValueError(f"Missing required columns in kit file: {', '.join(missing)}")
+    table = table.dropna(subset=["index7"])
+    if "index5" not in table.columns:
+        table = table.assign(index5=None)
+    kit = pd.DataFrame({
+        "Well": table["Well"].astype(object).map(lambda v: "" if pd.isna(v) else str(v).strip()),
+        # Sequences are compared as in the sample sheets: str(value), missing i5 = empty
+        "index7": table["index7"].astype(object).map(str),
+        "index5": table["index5"].astype(object).map(lambda v: "" if pd.isna(v) else str(v)),
+    })
+    if kit.empty:
+        raise ValueError("The kit file has no index7 sequences")
+    return kit.reset_index(drop=True)
+
+
+def add_kit(name, source, directory=None):
+    """Save a kit (file or table with Well/index7/index5) to the library; returns the kit table."""
+    directory = directory or KITS_DIR
+    if not _KIT_NAME.match(name) or "__" in name:
+        raise ValueError("Kit names may only use letters, digits, '-' and single '_'")
+    kit = kit_table(source) if isinstance(source, pd.DataFrame) else read_kit(source)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv")
+    kit[KIT_COLUMNS].to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return kit
+
+
+def remove_kit(name, directory=None):
+    directory = directory or KITS_DIR
+    os.remove(os.path.join(directory, f"{name}.csv"))
+    matrix_dir = os.path.join(directory, MATRIX_DIR)
+    if os.path.isdir(matrix_dir):
+        for file in os.listdir(matrix_dir):
+            if name in file.split(".", 1)[0].split("__"):
+                os.remove(os.path.join(matrix_dir, file))
+
+
+def library_signature(directory=None):
+    """(file, mtime) of the kits in the library: changes whenever a kit is added, edited or removed."""
+    directory = directory or KITS_DIR
+    if not os.path.isdir(directory):
+        return ()
+    return tuple(sorted(
+        (entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.endswith(".csv")
+    ))
+
+
+class KitLibrary:
+    """Kits of the library directory and their precomputed comparison matrices."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or KITS_DIR
+        self.names = [file[:-len(".csv")] for file, _ in library_signature(self.directory)]
+        self.kits = {name: read_kit(os.path.join(self.directory, f"{name}.csv")) for name in self.names}
+        self._digests = {}
+        self._matrices = {}
+
+    def __getstate__(self):
+        # Sent to worker processes without the open memory maps: they reopen the files
+        return {**self.__dict__, "_matrices": {}}
+
+    def summary(self):
+        """One row per kit: name, number of wells, single or dual index."""
+        return pd.DataFrame({
+            "Kit": self.names,
+            "Wells": [len(self.kits[name]) for name in self.names],
+            "Index": ["dual (i7+i5)" if (self.kits[name]["index5"] != "").any() else "single (i7)"
+                      for name in self.names],
+        })
+
+    def _digest(self, name):
+        digest = self._digests.get(name)
+        if digest is None:
+            with open(os.path.join(self.directory, f"{name}.csv"), "rb") as f:
+                digest = self._digests[name] = hashlib.sha256(f.read()).hexdigest()[:12]
+        return digest
+
+    def matrices(self, kit_a, kit_b):
+        """
+        Comparison matrices of two kits (wells of kit_a x wells of kit_b), memory
+        mapped from MATRIX_DIR and computed on first use. Pass kit_a <= kit_b.
+        """
+        key = (kit_a, kit_b)
+        if key not in self._matrices:
+            matrix_dir = os.path.join(self.directory, MATRIX_DIR)
+            stem = f"{kit_a}__{kit_b}.{self._digest(kit_a)}{self._digest(kit_b)}"
+            paths = {name: os.path.join(matrix_dir, f"{stem}.{name}.npy") for name in _matrix_names()}
+            if not all(os.path.exists(path) for path in paths.values()):
+                self._save_matrices(kit_a, kit_b, matrix_dir, stem, paths)
+            self._matrices[key] = {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+        return self._matrices[key]
+
+    def _save_matrices(self, kit_a, kit_b, matrix_dir, stem, paths):
+        a, b = self.kits[kit_a], self.kits[kit_b]
+        n = len(a)
+        matrices = {}
+        # Same definitions as the live engine: match counts over position, 0 = padding
+        codes7, _ = encode_indexes([*a["index7"], *b["index7"]])
+        hot = one_hot(codes7)
+        matrices["i7"] = hot[:n] @ hot[n:].T
+        i5 = {"forward": [*a["index5"], *b["index5"]]}
+        i5["reverse_complement"] = [reverse_complement(seq) for seq in i5["forward"]]
+        codes5, lengths5 = encode_indexes([*i5["forward"], *i5["reverse_complement"]])
+        hot5 = one_hot(codes5)
+        total = len(i5["forward"])
+        shorter = np.minimum(lengths5[:n][:, None], lengths5[n:total][None, :])
+        for first, offset_a in zip(_FORMS, (0, total)):
+            for second, offset_b in zip(_FORMS, (0, total)):
+                matches = hot5[offset_a:offset_a + n] @ hot5[offset_b + n:offset_b + total].T
+                matrices[f"i5_{first}_{second}"] = shorter - matches
+
+        os.makedirs(matrix_dir, exist_ok=True)
+        # Matrices of older versions of the same kits are stale
+        prefix = f"{kit_a}__{kit_b}."
+        for file in os.listdir(matrix_dir):
+            if file.startswith(prefix) and not file.startswith(stem + "."):
+                os.remove(os.path.join(matrix_dir, file))
+        for name, path in paths.items():
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, matrices[name].astype(np.uint8))
+            os.replace(path + ".tmp", path)
+
+    def precompute(self):
+        """Compute the matrices of every kit and kit pair not saved yet."""
+        for pos, kit_a in enumerate(self.names):
+            for kit_b in self.names[pos:]:
+                self.matrices(kit_a, kit_b)
+
+    def resolve(self, encoding):
+        """
+        KitAssignment of a sample sheet (`index_matching.SheetEncoding`): the
+        kit well of every sample whose index7 (and index5, when the sheet has
+        one) is exactly that of a well. The first kit by name wins.
+        """
+        n = len(encoding.index7)
+        kit = np.full(n, -1, dtype=np.int64)
+        well = np.zeros(n, dtype=np.int64)
+        if self.names and n:
+            keys = ["index7"] if encoding.index5 is None else ["index7", "index5"]
+            wells = pd.concat(
+                [self.kits[name][keys].assign(kit=pos, well=np.arange(len(self.kits[name])))
+                 for pos, name in enumerate(self.names)],
+                ignore_index=True,
+            ).drop_duplicates(subset=keys)
+            sheet = pd.DataFrame({"index7": encoding.index7})
+            if encoding.index5 is not None:
+                sheet["index5"] = encoding.index5
+            found = sheet.merge(wells, on=keys, how="left")
+            resolved = found["kit"].notna().to_numpy()
+            kit[resolved] = found["kit"].to_numpy()[resolved].astype(np.int64)
+            well[resolved] = found["well"].to_numpy()[resolved].astype(np.int64)
+        return KitAssignment(self, kit, well)
+
+
+class KitAssignment:
+    """Kit (position in library.names, -1 = unknown) and well of each sample of a sheet."""
+
+    def __init__(self, library, kit, well):
+        self.library = library
+        self.kit = kit
+        self.well = well
+
+    def subset(self, rows):
+        """Assignment of some samples only (e.g. one lane), in the given order."""
+        return KitAssignment(self.library, self.kit[rows], self.well[rows])
+
+    def known(self, rows):
+        return self.kit[rows] >= 0
+
+    def lane_pairs(self, rows, lengths, max_distance=None, i5_orientation=None):
+        """
+        Like `index_matching.lane_pairs`, for the pairs of a lane where both
+        samples are kit wells: (i, j, matches, distances5). `rows` are the
+        sheet positions of the lane and `lengths` its index7 lengths; i and j
+        are lane positions. distances5 (orientation combinations x pairs) is
+        None without `i5_orientation`.
+        """
+        kit, well = self.kit[rows], self.well[rows]
+        combinations = I5_ORIENTATIONS[i5_orientation] if i5_orientation else None
+        found_i, found_j, found_m, found_d = [], [], [], []
+        kits = np.unique(kit[kit >= 0])
+        for pos, ka in enumerate(kits):
+            rows_a = np.flatnonzero(kit == ka)
+            for kb in kits[pos:]:
+                rows_b = np.flatnonzero(kit == kb)
+                matrices = self.library.matrices(self.library.names[ka], self.library.names[kb])
+                wells = np.ix_(well[rows_a], well[rows_b])
+                matches = matrices["i7"][wells].astype(np.int64)
+                first = np.minimum(rows_a[:, None], rows_b[None, :])
+                second = np.maximum(rows_a[:, None], rows_b[None, :])
+                keep = _relevant(lengths[first], lengths[second], matches, max_distance)
+                if ka == kb:
+                    keep &= rows_a[:, None] < rows_b[None, :]
+                r, c = np.nonzero(keep)
+                found_i.append(first[r, c])
+                found_j.append(second[r, c])
+                found_m.append(matches[r, c])
+                if combinations is not None:
+                    # Matrices are (kit_a form, kit_b form): swap the forms when the kit_b sample comes first
+                    a_first = rows_a[r] < rows_b[c]
+                    found_d.append(np.stack([
+                        np.where(a_first,
+                                 matrices[f"i5_{form1}_{form2}"][well[rows_a][r], well[rows_b][c]],
+                                 matrices[f"i5_{form2}_{form1}"][well[rows_a][r], well[rows_b][c]])
+                        for form1, form2 in combinations
+                    ]).astype(np.int64))
+
+        if not found_i:
+            empty = np.empty(0, dtype=np.int64)
+            distances = np.empty((len(combinations), 0), dtype=np.int64) if combinations is not None else None
+            return empty, empty, empty, distances
+        i, j, matches = (np.concatenate(x).astype(np.int64) for x in (found_i, found_j, found_m))
+        distances = np.concatenate(found_d, axis=1) if combinations is not None else None
+        return i, j, matches, distances
@@ -0,0 +1,612 @@
+"""
+Index collision search for the Index Matching tool.
+
+Index sequences are encoded once into a uint8 matrix (one row per sample, one
+column per position, 0 = padding after the end of shorter indexes). The
+position-wise matches of all pairs of a lane are then a matrix product of the
+one-hot encoding with itself, computed in row blocks to bound the memory, so
+a lane with thousands of libraries takes seconds instead of a Python loop per
+pair.
+
+Very large lanes can use the "pigeonhole" engine instead, which never looks
+at most pairs: two indexes whose common prefix of length m has at most
+k = m - threshold(m) mismatches must agree exactly on at least one of k + 1
+blocks of that prefix. Only pairs sharing a block are compared. Prefix
+lengths whose blocks would be too short to be selective fall back to the
+exhaustive product, so both engines return the same pairs.
+
+With an index5 column the lane analysis is dual-index: pairs close on i7
+also get their i5 distance. On request (`barcode_mismatches=True`) the
+report derives from those the largest BarcodeMismatchesIndex1/Index2
+setting that the demultiplexer can use without a read matching two samples.
+That needs every pair within DUAL_RADIUS mismatches on i7, a sizeable share
+of all the pairs of 8-12 base indexes: no block lookup is selective at that
+radius, so those lanes are always compared exhaustively. Since i5 can be read in forward or
+reverse-complement orientation, both forms are encoded once per sample sheet
+and the i5 distance is the smallest over the requested orientation
+combinations (I5_ORIENTATIONS).
+
+Samples using wells of known index kits (ddlab.index_kits) can be compared
+by lookup in precomputed kit matrices; `partial_pairs` then compares only the
+remaining samples against the lane.
+
+Lanes are independent: on large sheets they are analysed in a pool of
+worker processes (INDEX_WORKERS) and merged back in lane order.
+
+`char_matches` is kept as the reference definition of a match count.
+"""
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Rows of the pairwise match matrix computed at once (BLOCK_ROWS x lane size)
+BLOCK_ROWS = 2048
+
+ENGINES = ["auto", "exhaustive", "pigeonhole"]
+# "auto" switches to the pigeonhole engine for lanes with at least this many samples
+PIGEONHOLE_MIN_SAMPLES = 2000
+# Shortest block (positions) for which the exact block lookup is selective enough
+MIN_BLOCK_WIDTH = 3
+
+# Worker processes for the lane analysis (1 = always sequential)
+INDEX_WORKERS = int(os.environ.get("DDLAB_INDEX_WORKERS", str(min(os.cpu_count() or 1, 16))))
+# Smaller sheets are analysed in this process: starting and feeding the workers would dominate
+PARALLEL_MIN_SAMPLES = 2000
+# Workers are not forked from the (multi-threaded) Streamlit server, which could deadlock them
+_WORKER_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if _WORKER_CONTEXT.get_start_method() == "forkserver":
+    # Il server importa numpy e questo modulo una volta sola per tutti i worker
+    _WORKER_CONTEXT.set_forkserver_preload([__name__])
+
+# Largest BarcodeMismatchesIndex1/Index2 value accepted by the demultiplexer
+MAX_BARCODE_MISMATCHES = 2
+# Pairs farther apart than this on i7 are safe whatever the setting (searched only for the recommendation)
+DUAL_RADIUS = 2 * MAX_BARCODE_MISMATCHES
+
+# i5 forms compared for each pair (first sample, second sample)
+I5_ORIENTATIONS = {
+    "forward": [("forward", "forward")],
+    "reverse_complement": [("reverse_complement", "reverse_complement")],
+    # Mixed kits in a lane: a collision in any combination counts
+    "mixed": [("forward", "forward"), ("forward", "reverse_complement"),
+              ("reverse_complement", "forward"), ("reverse_complement", "reverse_complement")],
+}
+_SHORT_FORM = {"forward": "fwd", "reverse_complement": "rc"}
+_COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+def char_matches(str1, str2):
+    if pd.isna(str1) or pd.isna(str2) or str1 == "" or str2 == "":
+        return 0
+    min_len = min(len(str1), len(str2))
+    return sum(str1[i] == str2[i] for i in range(min_len))
+
+
+def match_threshold(min_length):
+    """Matches needed to flag a pair, from the shorter index length (scalar or array)."""
+    min_length = np.asarray(min_length)
+    return np.select([min_length == 12, min_length == 10, min_length == 8], [11, 9, 7], default=5)
+
+
+def reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def encode_indexes(values):
+    """
+    Encode index strings as (codes, lengths): codes is a uint8 matrix with the
+    alphabet position (1..) of each character and 0 as padding.
+    Values are compared as text, like `str(value)` in the original tool.
+    """
+    text = [str(v) for v in values]
+    lengths = np.array([len(t) for t in text], dtype=np.int64)
+    width = int(lengths.max()) if len(text) else 0
+    if width == 0:
+        return np.zeros((len(text), 0), dtype=np.uint8), lengths
+    # Fixed-width unicode array viewed as code points: 0 after the end of each string
+    points = np.array(text, dtype=f"<U{width}").view(np.uint32).reshape(len(text), width)
+    alphabet, codes = np.unique(points, return_inverse=True)
+    codes = codes.reshape(points.shape)
+    if alphabet[0] != 0:
+        codes += 1  # No padding anywhere: keep 0 free for it
+    if len(alphabet) > 255:
+        raise ValueError("Index sequences use more than 255 distinct characters")
+    return codes.astype(np.uint8), lengths
+
+
+def one_hot(codes):
+    """float32 matrix (samples x positions*alphabet); padding positions are all zero."""
+    n, width = codes.shape
+    size = int(codes.max()) if codes.size else 0
+    hot = np.zeros((n, width, size), dtype=np.float32)
+    rows, cols = np.nonzero(codes)
+    hot[rows, cols, codes[rows, cols] - 1] = 1
+    return hot.reshape(n, width * size)
+
+
+def match_blocks(codes, block_rows=BLOCK_ROWS):
+    """
+    Yield (start, matches) where matches[i, j] is `char_matches` between index
+    start+i and index j, as int64. Blocks cover all rows in order.
+    """
+    hot = one_hot(codes)
+    for start in range(0, len(codes), block_rows):
+        # Exact: sums of at most a few dozen 0/1 products in float32
+        yield start, (hot[start:start + block_rows] @ hot.T).astype(np.int64)
+
+
+def pair_flags(len1, len2, matches):
+    """
+    (flagged, identical, one_mismatch) for pairs given the lengths of the
+    first and second index and their match count, with the demultiplexing
+    report's definitions: mismatches = len(index of the first sample) - matches.
+    """
+    flagged = matches >= match_threshold(np.minimum(len1, len2))
+    identical = (len1 == len2) & (matches == len1)
+    one_mismatch = (len1 - matches == 1) & ~identical
+    return flagged, identical, one_mismatch
+
+
+def _relevant(len1, len2, matches, max_distance=None):
+    flagged, identical, one_mismatch = pair_flags(len1, len2, matches)
+    relevant = flagged | identical | one_mismatch
+    if max_distance is not None:
+        relevant |= np.minimum(len1, len2) - matches <= max_distance
+    return relevant
+
+
+def lane_pairs(lengths, codes, engine="auto", block_rows=BLOCK_ROWS, max_distance=None):
+    """
+    Positions (i, j), i < j, and match counts of the pairs of one lane that
+    matter for the report: above the match threshold, identical, 1 mismatch,
+    or (with `max_distance`) at most that many mismatches over the shorter length.
+    """
+    if engine == "auto":
+        engine = "pigeonhole" if len(lengths) >= PIGEONHOLE_MIN_SAMPLES else "exhaustive"
+    # Without a selective length class the pigeonhole engine would only add overhead
+    if engine == "pigeonhole" and any(_block_selective(m, max_distance) for m in np.unique(lengths)):
+        return _pigeonhole_pairs(lengths, codes, block_rows, max_distance)
+    if engine == "pigeonhole":
+        engine = "exhaustive"
+    if engine != "exhaustive":
+        raise ValueError(f"Unknown engine '{engine}'. Choose one of: {', '.join(ENGINES)}")
+
+    pairs_i, pairs_j, pairs_m = [], [], []
+    for start, matches in match_blocks(codes, block_rows):
+        rows = np.arange(start, start + len(matches))
+        hits = _relevant(lengths[rows][:, None], lengths[None, :], matches, max_distance)
+        hits &= np.arange(len(lengths))[None, :] > rows[:, None]
+        i, j = np.nonzero(hits)
+        pairs_i.append(rows[i])
+        pairs_j.append(j)
+        pairs_m.append(matches[i, j])
+    if not pairs_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_m)
+
+
+def partial_pairs(lengths, codes, rows, block_rows=BLOCK_ROWS, max_distance=None):
+    """
+    `lane_pairs` restricted to the pairs with at least one sample in `rows`
+    (sorted positions), compared exhaustively against the whole lane.
+    """
+    hot = one_hot(codes)
+    selected = np.zeros(len(lengths), dtype=bool)
+    selected[rows] = True
+    cols = np.arange(len(lengths))
+    pairs_i, pairs_j, pairs_m = [], [], []
+    for start in range(0, len(rows), block_rows):
+        chunk = rows[start:start + block_rows]
+        matches = (hot[chunk] @ hot.T).astype(np.int64)
+        first = np.minimum(chunk[:, None], cols[None, :])
+        second = np.maximum(chunk[:, None], cols[None, :])
+        # Two selected samples appear on both sides: keep them once
+        keep = ~selected[None, :] | (chunk[:, None] < cols[None, :])
+        r, c = np.nonzero(keep & _relevant(lengths[first], lengths[second], matches, max_distance))
+        pairs_i.append(first[r, c])
+        pairs_j.append(second[r, c])
+        pairs_m.append(matches[r, c])
+    if not pairs_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_m)
+
+
+def _shared_block_pairs(codes, lengths, short, pool, m, k):
+    """
+    Pairs (a, b) with a in `short` (length m) and b in `pool` (length >= m)
+    agreeing on at least one of k + 1 blocks of the first m positions.
+    Each unordered pair is returned once.
+    """
+    bounds = np.linspace(0, m, k + 2).astype(np.int64)
+    rows = np.concatenate([short, pool])
+    found = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        _, keys = np.unique(codes[rows, lo:hi], axis=0, return_inverse=True)
+        keys = keys.ravel()
+        merged = pd.DataFrame({"key": keys[:len(short)], "a": short}).merge(
+            pd.DataFrame({"key": keys[len(short):], "b": pool}), on="key"
+        )
+        a, b = merged["a"].to_numpy(), merged["b"].to_numpy()
+        # Two indexes of length m appear on both sides: keep them once
+        keep = (lengths[b] > m) | (a < b)
+        found.append(np.minimum(a, b)[keep] * len(lengths) + np.maximum(a, b)[keep])
+    pair_ids = np.unique(np.concatenate(found))
+    return pair_ids // len(lengths), pair_ids % len(lengths)
+
+
+def _block_mismatches(m, max_distance=None):
+    """Mismatches k a relevant pair can have over its first m positions."""
+    return max(m - int(match_threshold(m)), 1, max_distance or 0)
+
+
+def _block_selective(m, max_distance=None):
+    """Whether the k + 1 blocks of length class m are long enough for the exact block lookup."""
+    return m // (_block_mismatches(m, max_distance) + 1) >= MIN_BLOCK_WIDTH
+
+
+def _pigeonhole_pairs(lengths, codes, block_rows=BLOCK_ROWS, max_distance=None):
+    """
+    Same result as the exhaustive engine, grouping the pairs by their shorter
+    length m. A relevant pair has at most k = max(m - threshold(m), 1,
+    max_distance) mismatches in its first m positions (identical and
+    1-mismatch pairs included).
+    """
+    found_i, found_j, found_m = [], [], []
+    hot = None
+    for m in np.unique(lengths):
+        short = np.flatnonzero(lengths == m)
+        pool = np.flatnonzero(lengths >= m)
+        if _block_selective(m, max_distance):
+            a, b = _shared_block_pairs(codes, lengths, short, pool, m, _block_mismatches(m, max_distance))
+            # Both indexes cover the first m positions: no padding to exclude
+            matches = (codes[a, :m] == codes[b, :m]).sum(axis=1)
+        else:
+            # Blocks too short to be selective: compare this length class exhaustively
+            hot = one_hot(codes) if hot is None else hot
+            a, b, matches = [], [], []
+            for start in range(0, len(short), block_rows):
+                rows = short[start:start + block_rows]
+                block = (hot[rows] @ hot[pool].T).astype(np.int64)
+                first = np.minimum(rows[:, None], pool[None, :])
+                second = np.maximum(rows[:, None], pool[None, :])
+                # Two indexes of length m appear on both sides: keep them once
+                keep = (lengths[pool][None, :] > m) | (rows[:, None] < pool[None, :])
+                r, c = np.nonzero(keep & _relevant(lengths[first], lengths[second], block, max_distance))
+                a.append(first[r, c])
+                b.append(second[r, c])
+                matches.append(block[r, c])
+            a, b, matches = np.concatenate(a), np.concatenate(b), np.concatenate(matches)
+
+        keep = _relevant(lengths[a], lengths[b], matches, max_distance)
+        found_i.append(a[keep])
+        found_j.append(b[keep])
+        found_m.append(matches[keep])
+
+    if not found_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    i, j, matches = (np.concatenate(x).astype(np.int64) for x in (found_i, found_j, found_m))
+    order = np.lexsort((j, i))
+    return i[order], j[order], matches[order]
+
+
+# -------------------------------
+# Lane analysis
+# -------------------------------
+STATUS_OK = "✅ Demultiplexing non stringente"
+STATUS_STRICT = "⚠️ Demultiplexing stringente"
+STATUS_ERROR = "❌ Errore: stessi indici presenti"
+
+
+def pair_distances(codes, lengths, i, j, codes_j=None):
+    """
+    Mismatches of the pairs (i, j) over the shorter of the two indexes.
+    `codes_j` encodes the second index of each pair in another form (same alphabet).
+    """
+    codes_j = codes if codes_j is None else codes_j
+    same = (codes[i] == codes_j[j]) & (codes[i] != 0)
+    return np.minimum(lengths[i], lengths[j]) - same.sum(axis=1)
+
+
+class SheetEncoding:
+    """
+    Index sequences of a whole sample sheet, encoded once: index7 as written
+    (compared as `str(value)`), index5 in forward and reverse-complement form
+    with a shared alphabet (missing i5 = empty sequence).
+    """
+
+    def __init__(self, df):
+        self.index7 = df["index7"].astype(object).map(str).to_numpy()
+        self.codes7, self.lengths7 = encode_indexes(self.index7)
+        self.index5 = None
+        self.codes5 = {}
+        self.lengths5 = None
+        if "index5" in df.columns:
+            self.index5 = df["index5"].astype(object).map(lambda v: "" if pd.isna(v) else str(v)).to_numpy()
+            forms = [*self.index5, *(reverse_complement(seq) for seq in self.index5)]
+            codes, lengths = encode_indexes(forms)
+            n = len(self.index5)
+            self.codes5 = {"forward": codes[:n], "reverse_complement": codes[n:]}
+            self.lengths5 = lengths[:n]
+
+
+def safe_barcode_mismatches(distance7, distance5=None):
+    """
+    Largest (Index1, Index2) BarcodeMismatches setting keeping every pair apart.
+    A read can be assigned to two samples only if it is within k1 mismatches
+    of both i7 and within k2 of both i5, i.e. d7 <= 2*k1 and d5 <= 2*k2.
+    Index2 is None for single-index lanes; returns None when no setting is safe.
+    """
+    settings = range(MAX_BARCODE_MISMATCHES, -1, -1)
+    best = None
+    for k1 in settings:
+        for k2 in (settings if distance5 is not None else [None]):
+            collide = distance7 <= 2 * k1
+            if k2 is not None:
+                collide &= distance5 <= 2 * k2
+            if not collide.any():
+                # Most total tolerance first, then the most on i7
+                score = (k1 + (k2 or 0), k1)
+                if best is None or score > best[0]:
+                    best = (score, (k1, k2))
+    return None if best is None else best[1]
+
+
+class LaneAnalysis:
+    """
+    Pairwise comparison of the index sequences of one lane, computed once and
+    shared by the matching-pairs table, the demultiplexing report and the
+    dual-index BarcodeMismatches recommendation.
+    """
+
+    def __init__(self, lane, lane_data, engine="auto", barcode_mismatches=False, i5_orientation="forward",
+                 encoding=None, rows=None, kits=None):
+        # `encoding` (of the whole sheet) and `rows` (positions of the lane) avoid re-encoding per lane;
+        # `kits` (ddlab.index_kits.KitAssignment of the same sheet) needs them
+        if encoding is None:
+            encoding, rows = SheetEncoding(lane_data), np.arange(len(lane_data))
+        self.lane = lane
+        self.data = lane_data
+        self.index7 = encoding.index7[rows]
+        codes, self.lengths = encoding.codes7[rows], encoding.lengths7[rows]
+        dual = "index5" in lane_data.columns and lane_data["index5"].notna().any()
+        combinations = I5_ORIENTATIONS[i5_orientation]
+        # Pairs up to DUAL_RADIUS mismatches on i7 are needed for the recommendation
+        self.recommend = barcode_mismatches
+        max_distance = DUAL_RADIUS if barcode_mismatches else None
+        known = kits.known(rows) if kits is not None else None
+        from_kit, kit_distances5 = None, None
+        if known is not None and known.any():
+            # Kit wells are compared by table lookup, the other samples live against the whole lane
+            kit_i, kit_j, kit_matches, kit_distances5 = kits.lane_pairs(
+                rows, self.lengths, max_distance, i5_orientation if dual else None
+            )
+            live_i, live_j, live_matches = partial_pairs(self.lengths, codes, np.flatnonzero(~known),
+                                                         max_distance=max_distance)
+            i, j = np.concatenate([kit_i, live_i]), np.concatenate([kit_j, live_j])
+            order = np.lexsort((j, i))
+            self.i, self.j = i[order], j[order]
+            self.matches = np.concatenate([kit_matches, live_matches])[order]
+            from_kit = order < len(kit_i)
+            if kit_distances5 is not None:
+                # Same order as the merged pairs
+                kit_distances5 = kit_distances5[:, order[from_kit]]
+        else:
+            self.i, self.j, self.matches = lane_pairs(self.lengths, codes, engine, max_distance=max_distance)
+        self.flagged, self.identical, self.one_mismatch = pair_flags(
+            self.lengths[self.i], self.lengths[self.j], self.matches
+        )
+        self.distance7 = np.minimum(self.lengths[self.i], self.lengths[self.j]) - self.matches
+
+        # Dual index: i5 distance of the same pairs (missing i5 = no separation),
+        # the smallest over the requested orientation combinations
+        self.index5 = None
+        self.distance5 = None
+        self.orientation5 = None
+        if dual:
+            self.index5 = encoding.index5[rows]
+            lengths5 = encoding.lengths5[rows]
+            live = np.ones(len(self.i), dtype=bool) if from_kit is None else ~from_kit
+            distances = np.empty((len(combinations), len(self.i)), dtype=np.int64)
+            for row, (first, second) in enumerate(combinations):
+                distances[row, live] = pair_distances(encoding.codes5[first][rows], lengths5,
+                                                      self.i[live], self.j[live], encoding.codes5[second][rows])
+            if from_kit is not None:
+                distances[:, from_kit] = kit_distances5
+            best = distances.argmin(axis=0)
+            self.distance5 = distances[best, np.arange(len(self.i))]
+            if len(combinations) > 1:
+                labels = np.array([f"{_SHORT_FORM[a]}/{_SHORT_FORM[b]}" for a, b in combinations], dtype=object)
+                self.orientation5 = labels[best]
+
+    def matching_pairs(self):
+        """Rows of the matching-pairs table for this lane (plus i5 columns for dual-index lanes)."""
+        i, j = self.i[self.flagged], self.j[self.flagged]
+        pairs = pd.DataFrame({
+            "lane": [self.lane] * len(i),
+            "GCF_ID_string1": self.data["CGF_ID"].to_numpy()[i],
+            "GCF_ID_string2": self.data["CGF_ID"].to_numpy()[j],
+            "Sample_ID_1": self.data["Sample_ID"].to_numpy()[i],
+            "Sample_ID_2": self.data["Sample_ID"].to_numpy()[j],
+            "index7_string1": self.index7[i],
+            "index7_string2": self.index7[j],
+            "length1": self.lengths[i],
+            "length2": self.lengths[j],
+            "matches": self.matches[self.flagged],
+        })
+        if self.index5 is not None:
+            pairs["index5_string1"] = self.index5[i]
+            pairs["index5_string2"] = self.index5[j]
+            pairs["i5_distance"] = self.distance5[self.flagged]
+            pairs["combined_distance"] = self.distance7[self.flagged] + self.distance5[self.flagged]
+            if self.orientation5 is not None:
+                pairs["i5_orientation"] = self.orientation5[self.flagged]
+        return pairs
+
+    def demux_status(self):
+        """
+        (status, notes) of the lane. Every pair with the same index is an error;
+        1-mismatch pairs are reported until the first identical pair is met
+        (pairs in file order).
+        """
+        before_error = np.cumsum(self.identical) == 0
+        strict = self.one_mismatch & before_error
+        sample_ids = self.data["Sample_ID"].to_numpy()
+        notes = []
+        for i, j, identical in zip(self.i[self.identical | strict], self.j[self.identical | strict],
+                                   self.identical[self.identical | strict]):
+            if identical:
+                notes.append(f"Samples {sample_ids[i]} and {sample_ids[j]} hanno lo stesso indice.")
+            else:
+                notes.append(f"Samples {sample_ids[i]} and {sample_ids[j]} hanno 1 mismatch.")
+        if self.identical.any():
+            return STATUS_ERROR, notes
+        if strict.any():
+            return STATUS_STRICT, notes
+        return STATUS_OK, notes
+
+    def barcode_mismatches(self):
+        """
+        Row of the dual-index summary: closest pairs and safe BarcodeMismatches per
+        read. None when the lane was analysed without `barcode_mismatches`.
+        """
+        if not self.recommend:
+            return None
+        close = self.distance7 <= DUAL_RADIUS
+        distance7 = self.distance7[close]
+        distance5 = self.distance5[close] if self.distance5 is not None else None
+        setting = safe_barcode_mismatches(distance7, distance5)
+
+        def closest(distances):
+            # Pairs beyond DUAL_RADIUS on i7 are not compared further
+            return str(int(distances.min())) if len(distances) and distances.min() <= DUAL_RADIUS else f"> {DUAL_RADIUS}"
+
+        return {
+            "Lane": self.lane,
+            "Samples": len(self.data),
+            "Index": "dual (i7+i5)" if distance5 is not None else "single (i7)",
+            "Min i7 distance": closest(distance7),
+            "Min i7+i5 distance": closest(distance7 + distance5) if distance5 is not None else "-",
+            "BarcodeMismatchesIndex1": str(setting[0]) if setting else "❌",
+            "BarcodeMismatchesIndex2": ("-" if setting[1] is None else str(setting[1])) if setting else "❌",
+        }
+
+
+# Process pools shared by all the analyses, one per worker count: a session choosing another
+# count never shuts down the pool of an analysis running in another session
+_pools = {}
+_pool_lock = threading.Lock()
+_WORKER_MAIN = types.ModuleType("__main__")
+
+
+def _submit(workers, fn, *args):
+    """
+    Submit `fn(*args)` to the pool with `workers` processes, created on first
+    use. Streamlit installs the page as __main__: the workers started here
+    would import it (and run it) again, so they are started without it.
+    """
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=_WORKER_CONTEXT)
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = _WORKER_MAIN
+        try:
+            return pool.submit(fn, *args)
+        finally:
+            sys.modules["__main__"] = main
+
+
+@atexit.register
+def _shutdown_pool():
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+def _analyze_lane(lane, lane_data, engine, barcode_mismatches, i5_orientation, kits):
+    """Worker side: analyse one lane on its own; the lane data is not sent back."""
+    analysis = LaneAnalysis(lane, lane_data, engine, barcode_mismatches, i5_orientation, kits=kits)
+    analysis.data = None
+    return analysis
+
+
+def iter_lanes(df, engine="auto", barcode_mismatches=False, i5_orientation="forward", kits=None, workers=None,
+               start=0):
+    """
+    Generator behind `analyze_lanes`: yields the LaneAnalysis of each lane, in
+    order of appearance, as soon as it is ready. `start` skips lanes already
+    analysed (e.g. to resume a cancelled run). Closing the generator early
+    cancels the lanes not started yet.
+    """
+    if i5_orientation not in I5_ORIENTATIONS:
+        raise ValueError(f"Unknown i5 orientation '{i5_orientation}'. Choose one of: {', '.join(I5_ORIENTATIONS)}")
+    workers = INDEX_WORKERS if workers is None else workers
+    encoding = SheetEncoding(df)
+    assignment = kits.resolve(encoding) if kits is not None else None
+    groups = df.groupby("Lane", sort=False).indices
+    empty = np.empty(0, dtype=np.int64)
+    lane_rows = [(lane, groups.get(lane, empty)) for lane in df["Lane"].unique()][start:]
+
+    if workers > 1 and len(lane_rows) > 1 and len(df) >= PARALLEL_MIN_SAMPLES:
+        # Each worker encodes its own lane; kit matrices are reopened (memory mapped) in the worker
+        lane_data = [df.iloc[rows].reset_index(drop=True) for _, rows in lane_rows]
+        futures = [
+            _submit(workers, _analyze_lane, lane, data, engine, barcode_mismatches, i5_orientation,
+                    assignment.subset(rows) if assignment is not None else None)
+            for (lane, rows), data in zip(lane_rows, lane_data)
+        ]
+        try:
+            for future, data in zip(futures, lane_data):
+                analysis = future.result()
+                analysis.data = data
+                yield analysis
+        finally:
+            for future in futures:
+                future.cancel()
+        return
+
+    for lane, rows in lane_rows:
+        yield LaneAnalysis(lane, df.iloc[rows].reset_index(drop=True), engine, barcode_mismatches,
+                           i5_orientation, encoding, rows, assignment)
+
+
+def analyze_lanes(df, engine="auto", barcode_mismatches=False, i5_orientation="forward", kits=None,
+                  workers=None):
+    """
+    One LaneAnalysis per lane, in order of appearance. The sheet is encoded
+    once and split into lanes in a single pass. With `kits` (a
+    ddlab.index_kits.KitLibrary) samples using known kit wells are compared
+    by lookup in the precomputed kit matrices.
+
+    With `workers` > 1 (default INDEX_WORKERS) the lanes of sheets with at
+    least PARALLEL_MIN_SAMPLES samples are analysed in worker processes.
+    `barcode_mismatches` also collects the pairs needed by
+    `LaneAnalysis.barcode_mismatches` (an exhaustive search of every lane).
+    """
+    return list(iter_lanes(df, engine, barcode_mismatches, i5_orientation, kits, workers))
+
+
+def filter_matching_pairs(df, engine="auto", lanes=None):
+    """
+    Pairs of samples of the same lane whose index7 sequences match at least
+    `match_threshold` positions. Same rows and order as comparing every pair
+    of each lane in file order, whatever the engine. Pass `lanes` (from
+    `analyze_lanes`) to reuse an analysis already computed.
+    """
+    lanes = analyze_lanes(df, engine, barcode_mismatches=False) if lanes is None else lanes
+    result = [pairs for pairs in (lane.matching_pairs() for lane in lanes) if not pairs.empty]
+    if not result:
+        return pd.DataFrame()
+    return pd.concat(result, ignore_index=True)
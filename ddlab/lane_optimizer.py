@@ -0,0 +1,290 @@
+"""
+Lane assignment of capture pools without index collisions.
+
+Samples of a capture pool (Pool_Cattura) are sequenced together, so pools are
+the units placed on lanes. Two pools conflict when any of their samples would
+be reported by the Index Matching tool if they shared a lane (match threshold,
+identical index or 1 mismatch on index7). The conflict graph is built with one
+run of the collision engine over the whole sheet, as if it were a single lane.
+
+Pools are then placed DSatur-style: the next pool is the one whose
+conflicting neighbours already occupy the most lanes (then most conflicts,
+then largest), and it goes to the lane with the most free capacity among
+those holding none of its neighbours, or else to the lane with room and the
+fewest collisions; those pools are retried once all pools are placed.
+Spreading pools over the lanes can leave no lane with room for a later
+pool: the placement is then redone best-fit decreasing (largest pools first,
+each on the lane with room, the fewest collisions and the least space left),
+and pools of overfull lanes are then moved or swapped with smaller pools
+until every lane fits. Last, colliding pools are swapped between lanes while
+that lowers the colliding pairs within the capacities. Lanes still over capacity after that (the pools
+cannot be packed) are reported by the plan.
+Collisions between samples of the same pool cannot be fixed by moving pools
+and are reported as they are.
+"""
+import numpy as np
+import pandas as pd
+
+from ddlab.index_matching import SheetEncoding, lane_pairs
+
+OPTIMIZER_COLUMNS = ["index7", "CGF_ID", "Sample_ID", "Pool_Cattura", "CGF_Pool_ID"]
+
+
+class ConflictGraph:
+    """Colliding sample pairs of a sheet and the pools they belong to."""
+
+    def __init__(self, df, engine="auto", pool_column="Pool_Cattura"):
+        self.df = df
+        encoding = SheetEncoding(df)
+        self.i, self.j, self.matches = lane_pairs(encoding.lengths7, encoding.codes7, engine)
+        self.index7, self.lengths = encoding.index7, encoding.lengths7
+
+        # Samples without a pool are units of their own
+        pools, self.pool_names = pd.factorize(df[pool_column])
+        missing = np.flatnonzero(pools < 0)
+        pools[missing] = len(self.pool_names) + np.arange(len(missing))
+        self.pool_names = np.concatenate([np.asarray(self.pool_names, dtype=object),
+                                          np.full(len(missing), None, dtype=object)])
+        self.pool = pools
+        self.sizes = np.bincount(pools, minlength=len(self.pool_names))
+
+        a, b = pools[self.i], pools[self.j]
+        self.within_pool = a == b
+        # Edges between different pools, weighted by the colliding sample pairs
+        edge_ids, weights = np.unique(np.minimum(a, b)[~self.within_pool] * len(self.pool_names)
+                                      + np.maximum(a, b)[~self.within_pool], return_counts=True)
+        first, second = edge_ids // len(self.pool_names), edge_ids % len(self.pool_names)
+        # Adjacency in CSR form, both directions
+        src = np.concatenate([first, second])
+        dst = np.concatenate([second, first])
+        order = np.argsort(src, kind="stable")
+        self.neighbours = dst[order]
+        self.weights = np.concatenate([weights, weights])[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(self.pool_names)))])
+
+    @property
+    def n_pools(self):
+        return len(self.pool_names)
+
+    def adjacent(self, pool):
+        lo, hi = self.offsets[pool], self.offsets[pool + 1]
+        return self.neighbours[lo:hi], self.weights[lo:hi]
+
+
+def assign_lanes(graph, capacities):
+    """
+    Lane (0-based) of every pool of `graph` given the sample capacity of each lane.
+    Raises ValueError when the pools cannot fit the lanes at all; pools that
+    cannot be packed within the capacities overfill a lane (see `LanePlan.summary`).
+    """
+    capacities = np.asarray(capacities, dtype=np.int64)
+    sizes = graph.sizes
+    if sizes.sum() > capacities.sum():
+        raise ValueError(f"The lanes hold {capacities.sum()} samples, the sheet has {sizes.sum()}")
+    if len(sizes) and sizes.max() > capacities.max():
+        raise ValueError(f"A capture pool has {sizes.max()} samples, more than the largest lane capacity")
+
+    n_lanes = len(capacities)
+    lane_of = np.full(graph.n_pools, -1, dtype=np.int64)
+    load = np.zeros(n_lanes, dtype=np.int64)
+    # Colliding sample pairs between each pool and the pools already on each lane
+    conflicts = np.zeros((graph.n_pools, n_lanes), dtype=np.int64)
+    # Lanes holding at least one conflicting neighbour (DSatur saturation)
+    saturation = np.zeros(graph.n_pools, dtype=np.int64)
+    degree = np.diff(graph.offsets)
+    # Selection key: saturation, then degree, then size (all bounded by the scale below)
+    scale = int(max(degree.max(initial=0), sizes.max(initial=0))) + 1
+    static_key = degree * scale + sizes
+    unplaced = np.ones(graph.n_pools, dtype=bool)
+
+    def move(pool, lane, sign):
+        # Neighbours are distinct: plain fancy indexing is enough
+        neighbours, weights = graph.adjacent(pool)
+        before = conflicts[neighbours, lane] > 0
+        conflicts[neighbours, lane] += sign * weights
+        saturation[neighbours] += (conflicts[neighbours, lane] > 0).astype(np.int64) - before
+        load[lane] += sign * sizes[pool]
+        lane_of[pool] = lane if sign > 0 else -1
+
+    def best_lane(pool):
+        """Lane with room for the pool: most free capacity without neighbours, else fewest collisions."""
+        fits = load + sizes[pool] <= capacities
+        free = fits & (conflicts[pool] == 0)
+        if free.any():
+            return int(np.argmax(np.where(free, capacities - load, -1)))
+        if fits.any():
+            return int(np.argmin(np.where(fits, conflicts[pool], np.iinfo(np.int64).max)))
+        return None
+
+    def tightest_lane(pool):
+        """Lane with room for the pool: fewest collisions, then least space left (best fit)."""
+        room = capacities - load - sizes[pool]
+        if not (room >= 0).any():
+            return int(np.argmax(capacities - load))  # Over capacity, reported by the plan
+        big = int(capacities.max()) + 1
+        return int(np.argmin(np.where(room >= 0, conflicts[pool] * big + room, np.iinfo(np.int64).max)))
+
+    def repair_capacity():
+        """
+        Move pools out of overfull lanes, or swap them with smaller pools of other
+        lanes, fewest new collisions first. Each step lowers the total overflow.
+        """
+        while True:
+            over = np.flatnonzero(load > capacities)
+            if not len(over):
+                return
+            best = None  # (collisions, pool, other pool or -1, lane)
+            for lane in over:
+                for pool in np.flatnonzero(lane_of == lane):
+                    room = capacities - load
+                    for target in np.flatnonzero((room >= sizes[pool]) & (np.arange(n_lanes) != lane)):
+                        cost = conflicts[pool, target]
+                        if best is None or cost < best[0]:
+                            best = (cost, pool, -1, target)
+                    # Swap with a smaller pool that the overfull lane can take back
+                    for other in np.flatnonzero((lane_of != lane) & (lane_of >= 0) & (sizes < sizes[pool])):
+                        target = lane_of[other]
+                        if load[target] - sizes[other] + sizes[pool] > capacities[target]:
+                            continue
+                        cost = conflicts[pool, target] + conflicts[other, lane]
+                        if best is None or cost < best[0]:
+                            best = (cost, pool, other, target)
+            if best is None:
+                return  # Over capacity, reported by the plan
+            _, pool, other, target = best
+            lane = lane_of[pool]
+            move(pool, lane, -1)
+            if other >= 0:
+                move(other, target, -1)
+                move(other, lane, 1)
+            move(pool, target, 1)
+
+    deferred = []
+    for _ in range(graph.n_pools):
+        key = np.where(unplaced, saturation * scale * scale + static_key, -1)
+        pool = int(np.argmax(key))
+        unplaced[pool] = False
+        lane = best_lane(pool)
+        if lane is None:
+            break
+        if conflicts[pool, lane]:
+            deferred.append(pool)
+        move(pool, lane, 1)
+
+    if (lane_of < 0).any():
+        # Capacity first: start again best-fit decreasing, largest pools (then most conflicts) first
+        for pool in np.flatnonzero(lane_of >= 0):
+            move(pool, lane_of[pool], -1)
+        deferred = []
+        for pool in np.lexsort((-degree, -sizes)):
+            lane = tightest_lane(pool)
+            if conflicts[pool, lane]:
+                deferred.append(pool)
+            move(pool, lane, 1)
+        repair_capacity()
+        deferred = [pool for pool in range(graph.n_pools) if conflicts[pool, lane_of[pool]]]
+
+    # Second chance for the pools placed on a colliding lane, now that all lanes are filled
+    for pool in deferred:
+        lane = lane_of[pool]
+        if conflicts[pool, lane] == 0:
+            continue
+        move(pool, lane, -1)
+        better = best_lane(pool)
+        move(pool, lane if better is None else better, 1)
+
+    # Full lanes leave no room to move a colliding pool: swap it with a pool of another lane
+    improved = True
+    while improved:
+        improved = False
+        for pool in range(graph.n_pools):
+            lane = lane_of[pool]
+            if conflicts[pool, lane] == 0:
+                continue
+            others = lane_of
+            # Neither lane may end up over its capacity (or more over it than now)
+            load_here = load[lane] - sizes[pool] + sizes
+            load_there = load[others] - sizes + sizes[pool]
+            fits = ((load_here <= np.maximum(capacities[lane], load[lane]))
+                    & (load_there <= np.maximum(capacities[others], load[others])) & (others != lane))
+            # Colliding pairs removed minus added; the pair (pool, other) itself stays apart
+            between = np.zeros(graph.n_pools, dtype=np.int64)
+            neighbours, weights = graph.adjacent(pool)
+            between[neighbours] = weights
+            gain = (conflicts[pool, lane] + conflicts[np.arange(graph.n_pools), others]
+                    - (conflicts[pool, others] - between) - (conflicts[:, lane] - between))
+            gain = np.where(fits, gain, 0)
+            other = int(np.argmax(gain))
+            if gain[other] > 0:
+                there = lane_of[other]
+                move(pool, lane, -1)
+                move(other, there, -1)
+                move(pool, there, 1)
+                move(other, lane, 1)
+                improved = True
+    return lane_of
+
+
+class LanePlan:
+    """Proposed lane of every sample and the collisions left in each lane."""
+
+    def __init__(self, df, capacities, engine="auto", lane_labels=None):
+        self.graph = ConflictGraph(df, engine)
+        self.capacities = list(capacities)
+        self.lane_labels = list(lane_labels) if lane_labels is not None else list(range(1, len(self.capacities) + 1))
+        self.pool_lane = assign_lanes(self.graph, self.capacities)
+        self.sample_lane = self.pool_lane[self.graph.pool]
+        self.df = df
+
+    def collisions(self):
+        """Colliding pairs that end up in the same lane (Within pool = cannot be fixed by the plan)."""
+        g = self.graph
+        same = self.sample_lane[g.i] == self.sample_lane[g.j]
+        i, j = g.i[same], g.j[same]
+        labels = np.asarray(self.lane_labels, dtype=object)
+        return pd.DataFrame({
+            "Lane": labels[self.sample_lane[i]],
+            "Sample_ID_1": self.df["Sample_ID"].to_numpy()[i],
+            "Sample_ID_2": self.df["Sample_ID"].to_numpy()[j],
+            "Pool_1": g.pool_names[g.pool[i]],
+            "Pool_2": g.pool_names[g.pool[j]],
+            "index7_string1": g.index7[i],
+            "index7_string2": g.index7[j],
+            "matches": g.matches[same],
+            "Within pool": g.within_pool[same],
+        })
+
+    def lane_samples(self):
+        return np.bincount(self.sample_lane, minlength=len(self.capacities))
+
+    def over_capacity(self):
+        """Labels of the lanes holding more samples than their capacity (pools that could not be packed)."""
+        over = self.lane_samples() > np.asarray(self.capacities)
+        return [label for label, flag in zip(self.lane_labels, over) if flag]
+
+    def summary(self):
+        """One row per lane: capacity, samples, samples over capacity, pools and colliding pairs."""
+        collisions = self.collisions()
+        labels = np.asarray(self.lane_labels, dtype=object)
+        pools_per_lane = [
+            ", ".join(str(name) for name in self.graph.pool_names[self.pool_lane == lane] if name is not None)
+            for lane in range(len(self.capacities))
+        ]
+        return pd.DataFrame({
+            "Lane": labels,
+            "Capacity": self.capacities,
+            "Samples": self.lane_samples(),
+            "Over capacity": np.maximum(self.lane_samples() - np.asarray(self.capacities), 0),
+            "Pools": pools_per_lane,
+            "Colliding pairs": [int((collisions["Lane"] == label).sum()) for label in labels],
+        })
+
+    def assigned_sheet(self):
+        """The sample sheet with the proposed Lane column (added first if the sheet had none)."""
+        lanes = np.asarray(self.lane_labels, dtype=object)[self.sample_lane]
+        sheet = self.df.copy()
+        if "Lane" in sheet.columns:
+            sheet["Lane"] = lanes
+        else:
+            sheet.insert(0, "Lane", lanes)
+        return sheet
@@ -0,0 +1,173 @@
+"""
+Pool/Lane statistics of the NovaSeqX Recap page.
+
+The statistic columns are converted to numbers once; medians and fragment
+sums per (Pool, Lane, library type) come from a single groupby, and the
+"other library types in the same lane" summary from a self-join of those
+medians on (Pool, Lane). Same rows, order and values as grouping each
+(Pool, Lane) and each library type in a Python loop.
+
+`StatsCube` holds those statistics for one version of the data with the rows
+of every library type already sorted by each key the page offers, so
+choosing a library or a sort order is a lookup.
+"""
+import numpy as np
+import pandas as pd
+
+from ddlab.sidecar import cached_frame
+
+# Colonne statistiche del riassunto NovaSeqX
+COLUMNS_MAP = {
+    'RT/Tape': 'RT/Tape_Ratio',
+    'RT/Qubit': 'RT/Qubit_Ratio',
+    'Conc 1x': 'Conc_caricamento_1x (pM)',
+    '% Library Lane': '%_Library_Lane',
+    'Fragments Produced': '#fragments Produced sample',
+    'Fragments Assigned': '#fragments Assigned_sample'
+}
+LIBRARY_COLUMNS = ['Type', 'Library_Kit']
+
+PCT_MEDIAN = "%_Library_Lane (median)"
+CONC_MEDIAN = "Conc_caricamento_1x (pM)"
+OTHER_TYPES = "Altri tipi nella stessa Lane (%_Library_Lane)"
+PRODUCTION = "% Production"
+STATS_COLUMNS = ["Pool", "Lane", "Library_Type", PCT_MEDIAN, CONC_MEDIAN, OTHER_TYPES, PRODUCTION]
+
+# Ordinamenti offerti dalla pagina -> colonna delle statistiche (None = numero del Pool)
+SORT_KEYS = {
+    "Pool": "Pool",
+    "Pool (numerico)": None,
+    "Lane": "Lane",
+    "Conc_caricamento_1x (pM) (median)": CONC_MEDIAN,
+}
+
+
+# Versione del loader tipizzato: cambiarla invalida i sidecar già scritti
+RECAP_LOADER_VERSION = "recap2"
+
+
+def typed_recap(df):
+    """
+    Recap sheet with clean column names and one type per column: columns mixing
+    numbers and text become text (the statistics coerce them with to_numeric anyway),
+    so the frame can be stored as Arrow. Empty cells stay missing.
+    """
+    df = df.copy()
+    df.columns = df.columns.str.strip()
+    for col in df.columns[df.dtypes == object]:
+        # Prima di pandas 3 astype("str") scrive 'nan' nelle celle vuote
+        df[col] = df[col].astype("str").where(df[col].notna())
+    return df
+
+
+def read_recap(source):
+    """Typed recap frame of a workbook (path or uploaded file)."""
+    return typed_recap(pd.read_excel(source))
+
+
+def load_recap(path):
+    """`read_recap` of a workbook on disk, through the Arrow sidecar cache."""
+    return cached_frame(path, read_recap, tag=RECAP_LOADER_VERSION)
+
+
+def missing_stat_columns(df):
+    """Labels of COLUMNS_MAP whose column is not in the sheet."""
+    return [label for label, col in COLUMNS_MAP.items() if col not in df.columns]
+
+
+def _numeric(df, label):
+    col = COLUMNS_MAP[label]
+    if col not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return pd.to_numeric(df[col], errors='coerce')
+
+
+def library_stats(df, library_col):
+    """
+    One row per (Pool, Lane, library type) with the medians of %_Library_Lane
+    and of the 1x loading concentration, the median %_Library_Lane of the
+    other types in the same lane and % Production (produced / assigned fragments).
+    """
+    data = pd.DataFrame({
+        "Pool": df["Pool"],
+        "Lane": df["Lane"],
+        "Library_Type": df[library_col],
+        "pct": _numeric(df, '% Library Lane'),
+        "conc": _numeric(df, 'Conc 1x'),
+        "produced": _numeric(df, 'Fragments Produced'),
+        "assigned": _numeric(df, 'Fragments Assigned'),
+    }).dropna(subset=["Pool", "Lane", "Library_Type"])
+    if data.empty:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+
+    stats = data.groupby(["Pool", "Lane", "Library_Type"], sort=True).agg(
+        pct=("pct", "median"), conc=("conc", "median"), produced=("produced", "sum"), assigned=("assigned", "sum"),
+    ).reset_index()
+
+    # Altri tipi nella stessa Lane: self-join delle mediane su (Pool, Lane)
+    if COLUMNS_MAP['% Library Lane'] in df.columns:
+        pairs = stats[["Pool", "Lane", "Library_Type"]].merge(
+            stats[["Pool", "Lane", "Library_Type", "pct"]].rename(columns={"Library_Type": "other"}),
+            on=["Pool", "Lane"],
+        )
+        pairs = pairs[pairs["Library_Type"] != pairs["other"]].sort_values(
+            ["Pool", "Lane", "Library_Type", "other"], kind="stable"
+        )
+        pairs["summary"] = pairs["other"].astype(str) + ": " + pairs["pct"].map("{:.2f}".format).astype(str) + "%"
+        others = pairs.groupby(["Pool", "Lane", "Library_Type"], sort=False)["summary"].agg("; ".join).reset_index()
+        other_types = stats[["Pool", "Lane", "Library_Type"]].merge(
+            others, on=["Pool", "Lane", "Library_Type"], how="left"
+        )["summary"].fillna("").to_numpy()
+    else:
+        other_types = ""
+
+    if {COLUMNS_MAP['Fragments Produced'], COLUMNS_MAP['Fragments Assigned']} <= set(df.columns):
+        production = stats["produced"] / stats["assigned"].where(stats["assigned"] > 0) * 100.0
+    else:
+        production = np.nan
+
+    return pd.DataFrame({
+        "Pool": stats["Pool"],
+        "Lane": stats["Lane"],
+        "Library_Type": stats["Library_Type"],
+        PCT_MEDIAN: stats["pct"],
+        CONC_MEDIAN: stats["conc"],
+        OTHER_TYPES: other_types,
+        PRODUCTION: production,
+    })
+
+
+def pool_number(pools):
+    """First number in each Pool name (X12+X13 -> 12.0), NaN without digits."""
+    return pools.astype(str).str.extract(r'(\d+)', expand=False).astype(float)
+
+
+class StatsCube:
+    """
+    `library_stats` of one data version with every (library type, sort) view
+    precomputed: `view` is a positional take, no filtering or sorting per call.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats.reset_index(drop=True)
+        self.libraries = sorted(self.stats["Library_Type"].dropna().unique().tolist())
+        keys = pd.DataFrame({
+            "Library_Type": self.stats["Library_Type"],
+            **{sort_by: pool_number(self.stats["Pool"]) if col is None else self.stats[col]
+               for sort_by, col in SORT_KEYS.items()},
+        })
+        # Posizioni delle righe per (ordinamento, verso) e tipo di libreria; NaN sempre in fondo
+        self._views = {}
+        for sort_by in SORT_KEYS:
+            for ascending in (True, False):
+                order = keys.sort_values(["Library_Type", sort_by], ascending=[True, ascending],
+                                         kind="stable", na_position="last")
+                self._views[sort_by, ascending] = {
+                    library: order.index.to_numpy()[positions]
+                    for library, positions in order.groupby("Library_Type", sort=False).indices.items()
+                }
+
+    def view(self, library, sort_by="Pool", ascending=True):
+        """Statistics of one library type sorted by one of SORT_KEYS."""
+        positions = self._views[sort_by, ascending].get(library, np.empty(0, dtype=np.intp))
+        return self.stats.take(positions)
@@ -0,0 +1,229 @@
+"""
+Sample ID lookup for the Freezer database.
+
+The "Samples_ID_In_Batch" column holds either a single ID ('M2401', 'AA12',
+'123') or a range ('M2400-M2450', 'AA1-AA50', '100-200'). `id_in_range` is
+the reference rule for a single cell; `SampleIdIndex` parses the whole column
+once and answers the same question for every row with binary searches, for
+one ID or for a whole list of IDs at once (`locate_samples`).
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+_ID_RE = re.compile(r"([A-Z]*)(\d+)")
+
+# Numbers with more digits do not fit in int64: those cells use id_in_range
+_MAX_DIGITS = 18
+
+# Columns returned by the bulk lookup
+LOCATION_COLUMNS = ["Freezer Name", "Freezer Location", "Cassetto", "Box_Number_If_Available",
+                    "Project", "Type_Of_Sample", "Sample Batch", "Samples_ID_In_Batch"]
+
+
+def id_in_range(id_value, range_value):
+    """
+    Verifica se un ID (es. 'M2423', 'AA10', '1023') rientra in un range come 'M2400-M2450', 'AA1-AA50', '100-200', ecc.
+    Gestisce ID con 0, 1 o più lettere di prefisso.
+    """
+    if not isinstance(range_value, str) or pd.isna(range_value) or not str(range_value).strip():
+        return False
+
+    id_value = str(id_value).strip().upper()
+    range_value = range_value.strip().upper()
+
+    # Estrai prefisso (lettere) e numero (cifre) dell'ID cercato
+    match_id = _ID_RE.match(id_value)
+    if not match_id:
+        return False
+    id_prefix, id_num = match_id.groups()
+    id_num = int(id_num)
+
+    # Caso: range (es. "M2400-M2450" oppure "AA1-AA50" oppure "100-200")
+    if "-" in range_value:
+        parts = range_value.split("-")
+        if len(parts) != 2:
+            return False
+        start, end = parts[0].strip(), parts[1].strip()
+
+        match_start = _ID_RE.match(start)
+        match_end = _ID_RE.match(end)
+        if not match_start or not match_end:
+            return False
+
+        prefix_start, num_start = match_start.groups()
+        prefix_end, num_end = match_end.groups()
+
+        num_start, num_end = int(num_start), int(num_end)
+
+        # Se entrambi hanno prefisso → confronta prefissi e range numerico
+        if prefix_start or prefix_end:
+            if prefix_start != prefix_end or prefix_start != id_prefix:
+                return False
+        # Se nessuno ha prefisso → confronta solo i numeri
+        elif id_prefix:
+            return False  # L'ID cercato ha lettere ma il range no
+
+        return num_start <= id_num <= num_end
+
+    else:
+        # Caso: singolo ID (es. "M2401", "AA12", "123")
+        return id_value == range_value
+
+
+class SampleIdIndex:
+    """
+    Parsed "Samples_ID_In_Batch" column.
+
+    Ranges are grouped by prefix and sorted by start, together with the running
+    maximum of their ends: the rows containing a number are found with two
+    binary searches (O(log n) plus the few overlapping candidates).
+    Single IDs are kept in a dictionary. Rows are referred to by position.
+    """
+
+    def __init__(self, values):
+        values = pd.Series(values, dtype=object).reset_index(drop=True)
+        self.size = len(values)
+        # Non-text cells never match (same as id_in_range)
+        text = values.where(values.map(lambda v: isinstance(v, str))).astype(object)
+        text = text.str.strip().str.upper() if text.notna().any() else text
+        usable = text.notna() & (text != "")
+        has_dash = usable & text.str.contains("-", regex=False)
+
+        # Single IDs: exact text -> row positions
+        singles = text[usable & ~has_dash]
+        self._singles = {key: singles.index.to_numpy()[pos] for key, pos in singles.groupby(singles).indices.items()}
+
+        # Ranges: exactly two parts, both starting with <letters><digits>
+        parts = text[has_dash].str.split("-")
+        parts = parts[parts.str.len() == 2]
+        start = parts.str[0].str.strip().str.extract(r"^([A-Z]*)(\d+)")
+        end = parts.str[1].str.strip().str.extract(r"^([A-Z]*)(\d+)")
+        valid = start[1].notna() & end[1].notna() & (start[0] == end[0])
+        start, end = start[valid], end[valid]
+
+        too_long = (start[1].str.len() > _MAX_DIGITS) | (end[1].str.len() > _MAX_DIGITS)
+        self._fallback = {pos: values[pos] for pos in start.index[too_long]}
+        start, end = start[~too_long], end[~too_long]
+
+        ranges = pd.DataFrame({
+            "prefix": start[0],
+            "start": start[1].astype(np.int64),
+            "end": end[1].astype(np.int64),
+            "row": start.index.to_numpy(),
+        }).sort_values(["prefix", "start"], kind="stable")
+
+        self._intervals = {}
+        for prefix, grp in ranges.groupby("prefix", sort=False):
+            ends = grp["end"].to_numpy()
+            self._intervals[prefix] = (
+                grp["start"].to_numpy(),
+                ends,
+                np.maximum.accumulate(ends),
+                grp["row"].to_numpy(),
+            )
+
+    def lookup(self, id_value):
+        """Sorted positions of the rows whose cell contains the given ID."""
+        id_text = str(id_value).strip().upper()
+        match_id = _ID_RE.match(id_text)
+        if not match_id:
+            return np.empty(0, dtype=np.int64)
+        id_prefix, id_digits = match_id.groups()
+
+        hits = [self._singles.get(id_text, np.empty(0, dtype=np.int64))]
+        group = self._intervals.get(id_prefix)
+        if group is not None and len(id_digits) <= _MAX_DIGITS:
+            starts, ends, max_ends, rows = group
+            id_num = int(id_digits)
+            # Candidates: start <= id_num, and not before the first range reaching id_num
+            hi = np.searchsorted(starts, id_num, side="right")
+            lo = np.searchsorted(max_ends, id_num, side="left")
+            if lo < hi:
+                hits.append(rows[lo:hi][ends[lo:hi] >= id_num])
+        hits.append(np.array([pos for pos, cell in self._fallback.items() if id_in_range(id_text, cell)], dtype=np.int64))
+        return np.unique(np.concatenate(hits))
+
+    def mask(self, id_value):
+        """Boolean array (one entry per row) of the rows containing the given ID."""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.lookup(id_value)] = True
+        return mask
+
+    def lookup_many(self, id_values):
+        """
+        Resolve many IDs in one batched pass.
+        Returns a DataFrame with the position of each ID in `id_values` ("query")
+        and of each row containing it ("row"), sorted by query then row.
+        """
+        ids = pd.Series(list(id_values), dtype=object).astype(str).str.strip().str.upper()
+        parsed = ids.str.extract(r"^([A-Z]*)(\d+)")
+        parsed = parsed[parsed[1].notna()]
+        queries, rows = [], []
+
+        # Single IDs: exact text match
+        singles = [(text, pos) for text, positions in self._singles.items() for pos in positions]
+        if singles:
+            matched = pd.DataFrame({"text": ids[parsed.index], "query": parsed.index}).merge(
+                pd.DataFrame(singles, columns=["text", "row"]), on="text"
+            )
+            queries.append(matched["query"].to_numpy())
+            rows.append(matched["row"].to_numpy())
+
+        # Ranges: the same binary searches as `lookup`, vectorised per prefix
+        short = parsed[parsed[1].str.len() <= _MAX_DIGITS]
+        for prefix, grp in short.groupby(0, sort=False):
+            if prefix not in self._intervals:
+                continue
+            starts, ends, max_ends, interval_rows = self._intervals[prefix]
+            nums = grp[1].astype(np.int64).to_numpy()
+            hi = np.searchsorted(starts, nums, side="right")
+            lo = np.searchsorted(max_ends, nums, side="left")
+            counts = np.maximum(hi - lo, 0)
+            # Expand every query into its candidate intervals lo..hi-1
+            cand_query = np.repeat(grp.index.to_numpy(), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            cand = np.repeat(lo, counts) + offsets
+            keep = ends[cand] >= np.repeat(nums, counts)
+            queries.append(cand_query[keep])
+            rows.append(interval_rows[cand][keep])
+
+        for pos, cell in self._fallback.items():
+            hit = [q for q in parsed.index if id_in_range(ids[q], cell)]
+            queries.append(np.array(hit, dtype=np.int64))
+            rows.append(np.full(len(hit), pos, dtype=np.int64))
+
+        result = pd.DataFrame({
+            "query": np.concatenate(queries).astype(np.int64) if queries else np.empty(0, dtype=np.int64),
+            "row": np.concatenate(rows).astype(np.int64) if rows else np.empty(0, dtype=np.int64),
+        })
+        return result.drop_duplicates().sort_values(["query", "row"], ignore_index=True)
+
+
+def parse_id_list(text):
+    """Split pasted IDs (one per line, or separated by commas, semicolons or spaces)."""
+    return [part for part in re.split(r"[\s,;]+", text) if part]
+
+
+def locate_samples(df, index, id_values, columns=LOCATION_COLUMNS):
+    """
+    Where each ID is stored: one row per (ID, matching freezer row), in the
+    order of `id_values`. IDs found nowhere get a single row with Found = False.
+    Location columns are returned as text (the workbook mixes numbers and text).
+    """
+    id_values = [str(v).strip() for v in id_values]
+    columns = [c for c in columns if c in df.columns]
+    hits = index.lookup_many(id_values)
+
+    found = df[columns].iloc[hits["row"].to_numpy()].reset_index(drop=True)
+    found = found.apply(lambda col: col.map(lambda v: None if pd.isna(v) else str(v)).astype("string"))
+    found.insert(0, "Sample ID", [id_values[q] for q in hits["query"]])
+    found.insert(1, "Found", True)
+    found["_order"] = hits["query"].to_numpy()
+
+    missing = np.setdiff1d(np.arange(len(id_values)), hits["query"].to_numpy())
+    not_found = pd.DataFrame({"Sample ID": [id_values[q] for q in missing], "Found": False, "_order": missing})
+
+    result = pd.concat([found, not_found], ignore_index=True)
+    return result.sort_values("_order", kind="stable").drop(columns="_order").reset_index(drop=True)
@@ -0,0 +1,87 @@
+"""
+Sample sheet checks of the Index Matching tool, shared by the page and the
+command line (`python -m ddlab.index_cli`): required columns, data-quality
+checks and the per-lane demultiplexing report.
+"""
+import pandas as pd
+
+from ddlab.data_quality import run_rules
+from ddlab.index_matching import analyze_lanes, filter_matching_pairs
+
+REQUIRED_COLUMNS = ["Lane", "index7", "CGF_ID", "Sample_ID", "Pool_Cattura", "CGF_Pool_ID"]
+
+
+def missing_columns(df):
+    return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+
+
+def prepare_sheet(df):
+    """Strip the column names and add Excel_Row and string_length, as shown in the tool."""
+    df = df.copy()
+    # Rimuove spazi extra dai nomi delle colonne
+    df.columns = df.columns.str.strip()
+    df["Excel_Row"] = df.index + 2
+    df["string_length"] = df["index7"].astype(str).str.len() if "index7" in df.columns else 0
+    return df
+
+
+def read_sample_sheet(source):
+    """Prepared sample sheet from an xlsx file; raises ValueError when required columns are missing."""
+    df = prepare_sheet(pd.read_excel(source))
+    missing = missing_columns(df)
+    if missing:
+        raise ValueError(f"Missing required columns in file: {', '.join(missing)}")
+    return df
+
+
+def quality_checks(df):
+    """
+    Rows with duplicated CGF_ID / Sample_ID and rows with cells holding spaces
+    or hyphens, plus the `data_quality.QualityReport` of all the default rules ("report").
+    """
+    report = run_rules(df)
+    return {
+        "duplicated_cgf": df[report.rows("Duplicated CGF_ID")],
+        "duplicated_sample": df[report.rows("Duplicated Sample_ID")],
+        "total_format_issues": report.cells("Spaces or hyphens"),
+        "format_issues": df[report.rows("Spaces or hyphens")],
+        "report": report,
+    }
+
+
+def length_summary(lane_data):
+    """Index lengths of a lane, e.g. "2x8, 1x10" (2x = also used by index5)."""
+    index7_lengths = lane_data["index7"].astype(str).str.len()
+    index5_lengths = lane_data["index5"].astype(str).str.len() if "index5" in lane_data.columns else pd.Series(dtype=int)
+
+    length_summary_dict = {}
+    for length in sorted(set(index7_lengths.tolist() + index5_lengths.tolist())):
+        in_index5 = sum(index5_lengths == length)
+        length_summary_dict[length] = f"2x{length}" if in_index5 > 0 else f"1x{length}"
+    return ", ".join(length_summary_dict.values())
+
+
+def lane_report(lanes):
+    """
+    One row per lane (from `analyze_lanes`): status, index lengths, notes and,
+    for lanes analysed with `barcode_mismatches`, the BarcodeMismatches recommendation.
+    """
+    rows = []
+    for lane_analysis in lanes:
+        status, notes = lane_analysis.demux_status()
+        recommendation = lane_analysis.barcode_mismatches() or {}
+        rows.append({
+            "Lane": lane_analysis.lane,
+            "Status": status,
+            "Index lengths": length_summary(lane_analysis.data),
+            "Notes": notes,
+            **{k: v for k, v in recommendation.items() if k != "Lane"},
+        })
+    return rows
+
+
+def check_sheet(df, engine="auto", i5_orientation="forward", kits=None, workers=None, barcode_mismatches=False):
+    """All the checks of a prepared sheet: (lanes, matching pairs, quality checks, lane report)."""
+    lanes = analyze_lanes(df, engine=engine, barcode_mismatches=barcode_mismatches, i5_orientation=i5_orientation,
+                          kits=kits, workers=workers)
+    return lanes, filter_matching_pairs(df, lanes=lanes), quality_checks(df), lane_report(lanes)
@@ -0,0 +1,135 @@
+"""
+Column types of the inventory tables as kept in memory by `SharedTable`.
+
+The backends store whatever the workbooks and the forms contain; the shared
+DataFrame is typed on load instead:
+
+- low-cardinality columns (freezer, location, supplier, ...) are categoricals
+  with text categories, kept sorted so their codes follow the selectbox order;
+- date columns are datetime64.
+
+Values coming from the forms go through the same conversion before they are
+written, so the typed representation survives inserts and edits.
+"""
+import datetime
+import re
+
+import pandas as pd
+
+from ddlab.storage import apply_change
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}")
+# Date formats accepted from the forms besides ISO (YYYY-MM-DD)
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y"]
+_BLANK = {"", "nan", "nat", "none"}
+
+
+def parse_date(value):
+    """
+    Convert a cell or form value to a Timestamp (NaT when blank).
+    Raises ValueError for text that is not a date.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return pd.NaT
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return pd.Timestamp(value)
+    if not isinstance(value, str):
+        raise ValueError(f"'{value}' is not a date")
+    text = value.strip()
+    if text.lower() in _BLANK:
+        return pd.NaT
+    if _ISO_DATE.match(text):
+        return pd.Timestamp(text)
+    for fmt in DATE_FORMATS:
+        try:
+            return pd.Timestamp(datetime.datetime.strptime(text, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"'{value}' is not a date")
+
+
+def date_text(value):
+    """Show a date cell in a form field as YYYY-MM-DD (empty when missing)."""
+    if value is None or pd.isna(value):
+        return ""
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def _category_text(value):
+    return None if value is None or pd.isna(value) else str(value)
+
+
+class Schema:
+    """Categorical and date columns of one database."""
+
+    def __init__(self, categorical=(), dates=()):
+        self.categorical = list(categorical)
+        self.dates = list(dates)
+
+    def apply(self, df):
+        """Return the table with typed columns; columns already typed are left as they are."""
+        typed = {}
+        for col in self.categorical:
+            if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                text = df[col].map(_category_text).astype(object)
+                typed[col] = text.astype(pd.CategoricalDtype(sorted(text.dropna().unique())))
+        for col in self.dates:
+            if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+                try:
+                    parsed = {v: parse_date(v) for v in df[col].dropna().unique()}
+                except ValueError:
+                    continue  # Free text in the column: keep it as it is rather than losing it
+                typed[col] = pd.to_datetime(df[col].map(parsed))
+        return df.assign(**typed) if typed else df
+
+    def invalid_dates(self, values):
+        """Date fields of a form whose text is not a date."""
+        invalid = []
+        for col in self.dates:
+            if col in values:
+                try:
+                    parse_date(values[col])
+                except ValueError:
+                    invalid.append(col)
+        return invalid
+
+    def coerce(self, values):
+        """Convert form values to the column types (raises ValueError for invalid dates)."""
+        values = dict(values)
+        for col in self.categorical:
+            if col in values:
+                values[col] = _category_text(values[col])
+        for col in self.dates:
+            if col in values:
+                values[col] = parse_date(values[col])
+        return values
+
+    def apply_change(self, df, entry):
+        """`storage.apply_change` on a typed table: new values become categories first."""
+        values = entry.get("row") or entry.get("values") or {}
+        added = {}
+        for col in self.categorical:
+            value = _category_text(values.get(col))
+            if col in df.columns and value is not None and value not in df[col].cat.categories:
+                categories = sorted([*df[col].cat.categories, value])
+                added[col] = df[col].cat.set_categories(categories)
+        if added:
+            df = df.assign(**added)
+        return self.apply(apply_change(df, entry))
+
+
+SCHEMAS = {
+    "freezer": Schema(
+        categorical=["Freezer Name", "Freezer Location", "Cassetto", "Type_Of_Sample"],
+        dates=["Throw_Away_Date_If_Available"],
+    ),
+    "reagents": Schema(
+        categorical=["Reagent Type", "Supplier", "Storage Location"],
+        dates=["Expiry Date"],
+    ),
+    "plastics": Schema(
+        categorical=["Plastic Type", "Supplier", "Box Location"],
+    ),
+}
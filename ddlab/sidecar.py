@@ -0,0 +1,111 @@
+"""
+Columnar sidecars of workbooks that are slow to parse.
+
+The first load of a workbook converts it with the given loader and writes the
+DataFrame as an uncompressed Arrow IPC file in CACHE_DIR, named after the
+SHA-256 of the workbook. Later loads (also after a restart, or from another
+replica sharing the directory) memory-map the sidecar instead of parsing the
+xlsx again. The hash is only recomputed when the workbook's mtime or size
+changes; a changed workbook (or a new loader version) gets a new sidecar and
+the workbook's previous sidecars, of any loader version, are removed.
+
+Without pyarrow the loader is simply called every time.
+"""
+import hashlib
+import json
+import os
+import re
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # Sidecars disabled
+    pa = None
+
+CACHE_DIR = os.environ.get("DDLAB_CACHE_DIR", ".ddlab_cache")
+
+# What follows "<workbook>." in a sidecar name: optional loader tag, digest
+_SIDECAR = re.compile(r"^(?:[^.]+\.)?[0-9a-f]{16}\.arrow$")
+# Sidecars already checked for stale siblings by this process
+_cleaned = set()
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _source_digest(path, cache_dir):
+    """SHA-256 of the workbook, reused from the index while its mtime and size are unchanged."""
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, os.path.basename(path) + ".json")
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index["mtime_ns"] == stat.st_mtime_ns and index["size"] == stat.st_size:
+            return index["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+    digest = file_digest(path)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest}, f)
+    os.replace(index_path + ".tmp", index_path)
+    return digest
+
+
+def read_sidecar(path):
+    """DataFrame of an Arrow IPC sidecar, memory mapped."""
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def _remove_stale(cache_dir, workbook, sidecar):
+    """Remove the sidecars of `workbook` other than `sidecar` (older versions or loader tags)."""
+    try:
+        for file in os.listdir(cache_dir):
+            if (file.startswith(workbook + ".") and _SIDECAR.match(file[len(workbook) + 1:])
+                    and file != os.path.basename(sidecar)):
+                os.remove(os.path.join(cache_dir, file))
+    except OSError:
+        return  # Removed meanwhile by another process, or a read-only cache: try again next time
+    _cleaned.add(sidecar)
+
+
+def cached_frame(path, loader, tag="", cache_dir=None):
+    """
+    `loader(path)` through the sidecar cache. `tag` names the loader version:
+    change it when the loader's output changes for the same workbook. A
+    workbook keeps one sidecar: the one of the last tag it was loaded with.
+    """
+    if pa is None:
+        return loader(path)
+    cache_dir = cache_dir or CACHE_DIR
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        digest = _source_digest(path, cache_dir)
+    except OSError:  # Cache directory not writable: no sidecar
+        return loader(path)
+    workbook = os.path.basename(path)
+    name = workbook + (f".{tag}" if tag else "")
+    sidecar = os.path.join(cache_dir, f"{name}.{digest[:16]}.arrow")
+    if os.path.exists(sidecar):
+        try:
+            df = read_sidecar(sidecar)
+            if sidecar not in _cleaned:
+                # e.g. sidecars of the previous loader version, written before this one
+                _remove_stale(cache_dir, workbook, sidecar)
+            return df
+        except (OSError, pa.ArrowException):
+            pass  # Truncated or stale format: convert again
+
+    df = loader(path)
+    try:
+        feather.write_feather(df, sidecar + ".tmp", compression="uncompressed")
+        os.replace(sidecar + ".tmp", sidecar)
+        _remove_stale(cache_dir, workbook, sidecar)
+    except OSError:
+        pass  # The frame is still good; it will be converted again next time
+    return df
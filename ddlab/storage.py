@@ -0,0 +1,683 @@
+"""
+Storage backends for the inventory databases (Freezer, Reagents, Plastics).
+
+The pages never write the workbooks directly anymore: they ask `open_storage`
+for the configured backend and call `load`, `insert`, `update` and `delete`.
+
+- "sqlite": embedded SQLite file, every change is a single-row statement in
+  its own transaction. The Excel workbooks are only used to seed the tables
+  the first time and as import/export format.
+- "journal": the workbook stays the source of truth, but changes are appended
+  to a small journal and folded into the workbook in the background.
+- "excel": legacy behaviour, the whole workbook is rewritten on every change.
+
+The backend is chosen with the DDLAB_STORAGE_BACKEND environment variable.
+
+Every row carries a stable row id (the DataFrame index) and a revision
+counter (REVISION column) increased by each update. Writes are serialised by
+an exclusive lock and updates carry the revision they were based on, so a
+stale edit raises ConflictError instead of silently overwriting someone else's.
+The legacy "excel" backend cannot store either: its row ids are row positions
+and the revision of a row is a hash of its values, so an edit or delete based
+on a row that changed, or that another row replaced at that position, raises
+ConflictError as well.
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+SQLITE_PATH = os.environ.get("DDLAB_SQLITE_PATH", "DDLAB_Databases.sqlite")
+STORAGE_BACKEND = os.environ.get("DDLAB_STORAGE_BACKEND", "sqlite")
+
+logger = logging.getLogger(__name__)
+
+# Journal backend: compact after this many pending changes, or after this many idle seconds
+JOURNAL_BATCH = int(os.environ.get("DDLAB_JOURNAL_BATCH", "50"))
+JOURNAL_IDLE_SECONDS = float(os.environ.get("DDLAB_JOURNAL_IDLE_SECONDS", "5"))
+
+# Name used for the DataFrame index: a stable identifier of each row
+ROW_ID = "row_id"
+# Column holding the revision counter of each row (hidden in the pages)
+REVISION = "_rev"
+
+DATABASES = {
+    "freezer": {
+        "xlsx": "Freezer_Database.xlsx",
+        "sheet_name": 0,
+        "columns": ["Freezer Name", "Freezer Location", "Cassetto", "Project", "Box_Number_If_Available",
+                    "Type_Of_Sample", "Sample Batch", "Samples_ID_In_Batch", "Throw_Away_Date_If_Available"],
+    },
+    "reagents": {
+        "xlsx": "Reagents_Database.xlsx",
+        "sheet_name": "Template",
+        "columns": ["Reagent Type", "Supplier", "Reagent Name", "Lot Number", "Expiry Date", "Storage Location"],
+    },
+    "plastics": {
+        "xlsx": "Plastics_Database.xlsx",
+        "sheet_name": "Template",
+        "columns": ["Plastic Type", "Size", "Catalog Number", "Supplier", "Quantità", "Box 96", "Box Location"],
+    },
+}
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def _quote(identifier):
+    """Quote a table/column name for SQLite (column names contain spaces)."""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def _plain_value(value):
+    """Convert a pandas/numpy cell to a plain Python value (None for missing)."""
+    if value is None:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return None if pd.isna(value) else str(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is pd.NaT or value is pd.NA:
+        return None
+    return value
+
+
+def _sheet_title(sheet_name):
+    # Integer sheet positions are only valid for reading
+    return sheet_name if isinstance(sheet_name, str) else "Sheet1"
+
+
+def read_workbook(path, sheet_name, columns):
+    """Read a database workbook, or return an empty table with the default columns."""
+    if os.path.exists(path):
+        return pd.read_excel(path, sheet_name=sheet_name)
+    return pd.DataFrame(columns=columns)
+
+
+def write_workbook(df, path, sheet_name):
+    """Write a table to a workbook (path or binary buffer) without row ids and revisions."""
+    df = df.drop(columns=REVISION, errors="ignore")
+    df.to_excel(path, sheet_name=_sheet_title(sheet_name), index=False)
+
+
+class ConflictError(Exception):
+    """Raised when a change is based on a row that someone else changed or deleted."""
+
+
+class FileLock:
+    """
+    Exclusive lock held on a `.lock` file, shared by threads and processes.
+    Re-entrant for the thread holding it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # LK_LOCK gives up after ~10 seconds
+                        continue
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+
+# -------------------------------
+# Backends
+# -------------------------------
+class Storage:
+    """
+    Common interface of the storage backends.
+
+    `load` returns the table as a DataFrame whose index holds the row ids;
+    those ids are the ones to pass back to `update` and `delete`.
+    `lock` must be held around a read-check-write sequence.
+    """
+
+    # True when `load` returns a table already kept in memory by the backend
+    in_memory = False
+    # False when row ids are row positions: a row changed meanwhile may be another row
+    stable_row_ids = True
+
+    def __init__(self, name, xlsx, sheet_name, columns):
+        self.name = name
+        self.xlsx = xlsx
+        self.sheet_name = sheet_name
+        self.default_columns = columns
+        self.lock = FileLock(self._lock_path())
+
+    def _lock_path(self):
+        return self.xlsx + ".lock"
+
+    def load(self):
+        raise NotImplementedError
+
+    def data_version(self):
+        """
+        Cheap token that changes whenever the stored data changes, also when
+        the change comes from another process. Backends that count changes
+        return an integer increased by exactly 1 per change.
+        """
+        raise NotImplementedError
+
+    def insert(self, row):
+        """Add a row (dict column -> value) and return its row id."""
+        raise NotImplementedError
+
+    def update(self, row_id, values, expected_rev=None):
+        """
+        Overwrite the given columns of one row and increase its revision.
+        With `expected_rev`, raise ConflictError if the row is not at that revision.
+        """
+        raise NotImplementedError
+
+    def delete(self, row_ids, expected_revs=None):
+        """
+        Remove the given rows. `expected_revs` (row id -> revision) makes the
+        delete fail with ConflictError if one of the rows changed meanwhile.
+        """
+        raise NotImplementedError
+
+    def import_excel(self, source):
+        """Replace the whole table with the content of a workbook (path or buffer)."""
+        raise NotImplementedError
+
+    def export_excel(self, target):
+        """Write the current table to a workbook (path or buffer)."""
+        write_workbook(self.load(), target, self.sheet_name)
+
+
+class ExcelStorage(Storage):
+    """
+    Legacy backend: the workbook is the live store and is rewritten on every change.
+    Row ids are row positions and revisions are hashes of the row values.
+    """
+
+    stable_row_ids = False
+
+    def _read(self):
+        """The workbook rows, all at revision 0."""
+        if not os.path.exists(self.xlsx):
+            write_workbook(pd.DataFrame(columns=self.default_columns), self.xlsx, self.sheet_name)
+        df = pd.read_excel(self.xlsx, sheet_name=self.sheet_name)
+        df.index.name = ROW_ID
+        df[REVISION] = 0
+        return df
+
+    def load(self):
+        df = self._read()
+        # The workbook cannot store revisions: the hash of the values tells whether the
+        # row at a position is still the one a change was based on
+        df[REVISION] = pd.util.hash_pandas_object(df.drop(columns=REVISION), index=False).to_numpy().view(np.int64)
+        return df
+
+    @staticmethod
+    def _check_revisions(df, expected_revs):
+        for row_id, rev in expected_revs.items():
+            if row_id in df.index and df.at[row_id, REVISION] != rev:
+                raise ConflictError(f"Row {row_id} was changed by someone else.")
+
+    def data_version(self):
+        return os.stat(self.xlsx).st_mtime_ns if os.path.exists(self.xlsx) else 0
+
+    def _save(self, df):
+        write_workbook(df, self.xlsx, self.sheet_name)
+
+    def insert(self, row):
+        with self.lock:
+            df = self.load()
+            new_df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
+            self._save(new_df)
+            return new_df.index[-1]
+
+    def update(self, row_id, values, expected_rev=None):
+        with self.lock:
+            df = self.load()
+            if row_id not in df.index:
+                raise ConflictError(f"Row {row_id} was deleted by someone else.")
+            if expected_rev is not None:
+                self._check_revisions(df, {row_id: expected_rev})
+            for key, value in values.items():
+                _set_cell(df, row_id, key, value)
+            self._save(df)
+
+    def delete(self, row_ids, expected_revs=None):
+        with self.lock:
+            df = self.load()
+            if expected_revs is not None:
+                self._check_revisions(df, dict(expected_revs))
+            self._save(df.drop(index=list(row_ids), errors="ignore"))
+
+    def import_excel(self, source):
+        with self.lock:
+            self._save(pd.read_excel(source, sheet_name=self.sheet_name))
+
+
+def _set_cell(df, row_id, key, value):
+    """`df.at[row_id, key] = value`, also when the value does not fit the column's dtype."""
+    # Colonne lette come numeri o testo: il nuovo valore può essere di un altro tipo
+    if key in df.columns and df[key].dtype != object:
+        df[key] = df[key].astype(object)
+    df.at[row_id, key] = value
+
+
+def apply_change(df, entry):
+    """
+    Apply one change (journal entry) to a table and return the new table.
+    The input DataFrame is never modified, so it can be shared safely.
+    """
+    op = entry["op"]
+    if op == "insert":
+        new_row = pd.DataFrame([entry["row"]], index=pd.Index([entry["row_id"]], name=ROW_ID))
+        if REVISION in df.columns:
+            new_row[REVISION] = 0
+        df = pd.concat([df, new_row])
+    elif op == "update":
+        df = df.copy()
+        for key, value in entry["values"].items():
+            _set_cell(df, entry["row_id"], key, value)
+        if REVISION in df.columns:
+            df.at[entry["row_id"], REVISION] += 1
+    elif op == "delete":
+        df = df.drop(index=entry["row_ids"], errors="ignore")
+    elif op == "ids" and len(entry["row_ids"]) == len(df):
+        # Header written at compaction: row ids of the workbook rows, in order
+        df = df.set_axis(pd.Index(entry["row_ids"], name=ROW_ID))
+    df.index.name = ROW_ID
+    return df
+
+
+class JournalExcelStorage(ExcelStorage):
+    """
+    Excel backend with an append-only change journal.
+
+    Every change is appended to `<workbook>.journal.jsonl` and applied to the
+    in-memory table right away, so a submit never waits for the workbook to
+    be written. A background thread folds the journal into the workbook once
+    JOURNAL_BATCH changes are pending, or after JOURNAL_IDLE_SECONDS without
+    new changes. Entries not compacted yet (e.g. after a crash) are replayed
+    by `load`; a compaction interrupted by a crash is completed (or undone)
+    first, so no entry is applied twice.
+
+    Several processes can share the same workbook: every write holds the file
+    lock and first reloads the table if the workbook or the journal changed on
+    disk (size, mtime or inode), so row ids and revisions are always checked
+    against the latest data and compactions include everyone's changes.
+    """
+
+    in_memory = True
+    stable_row_ids = True
+
+    def __init__(self, name, xlsx, sheet_name, columns):
+        super().__init__(name, xlsx, sheet_name, columns)
+        self.journal = xlsx + ".journal.jsonl"
+        self._lock = threading.RLock()
+        self._df = None
+        self._next_id = 0
+        self._pending = 0
+        self._changes = 0
+        # Workbook and journal state the in-memory table corresponds to
+        self._synced = None
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._compact_loop, name=f"journal-{name}", daemon=True).start()
+        atexit.register(self.compact)
+
+    def _disk_state(self):
+        state = []
+        for path in (self.xlsx, self.journal):
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _refresh(self):
+        """Load the table, again if another process changed the workbook or the journal."""
+        if self._df is not None and self._disk_state() == self._synced:
+            return
+        # Riletto sotto il file lock: nessuno scrive (o compatta) a metà lettura
+        with self.lock, self._lock:
+            if self._df is not None and self._disk_state() == self._synced:
+                return
+            self._recover()
+            self._pending = 0
+            self._df = self._replay(self._read())
+            self._synced = self._disk_state()
+            self._changes += 1
+
+    def load(self):
+        self._refresh()
+        return self._df
+
+    def data_version(self):
+        self._refresh()
+        return self._changes
+
+    def _replay(self, df):
+        next_id = int(df.index.max()) + 1 if len(df) else 0
+        if os.path.exists(self.journal):
+            with open(self.journal, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Last line cut by a crash while appending
+                    df = apply_change(df, entry)
+                    if entry["op"] == "ids":
+                        next_id = max(next_id, entry.get("next_id", 0))
+                    else:
+                        self._pending += 1
+                        if entry["op"] == "insert":
+                            next_id = max(next_id, entry["row_id"] + 1)
+        self._next_id = next_id
+        if self._pending:
+            self._wakeup.set()
+        return df
+
+    def _append(self, entry):
+        with self._lock:
+            # Applicata prima di scriverla: una modifica che fallisce non finisce nel journal
+            new_df = apply_change(self.load(), entry)
+            with open(self.journal, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._df = new_df
+            self._synced = self._disk_state()
+            self._pending += 1
+            self._changes += 1
+        self._wakeup.set()
+
+    def insert(self, row):
+        with self.lock, self._lock:
+            self.load()
+            row_id = self._next_id
+            self._next_id += 1
+            self._append({"op": "insert", "row_id": row_id,
+                          "row": {k: _plain_value(v) for k, v in row.items()}})
+        return row_id
+
+    def update(self, row_id, values, expected_rev=None):
+        with self.lock, self._lock:
+            if row_id not in self.load().index:
+                raise ConflictError(f"Row {row_id} was deleted by someone else.")
+            if expected_rev is not None:
+                self._check_revisions(self.load(), {row_id: expected_rev})
+            self._append({"op": "update", "row_id": int(row_id),
+                          "values": {k: _plain_value(v) for k, v in values.items()}})
+
+    def delete(self, row_ids, expected_revs=None):
+        with self.lock, self._lock:
+            if expected_revs:
+                self._check_revisions(self.load(), expected_revs)
+            self._append({"op": "delete", "row_ids": [int(r) for r in row_ids]})
+
+    def import_excel(self, source):
+        with self.lock, self._lock:
+            df = pd.read_excel(source, sheet_name=self.sheet_name)
+            self._commit(df, {"op": "ids", "row_ids": list(range(len(df))), "next_id": len(df)})
+            df.index.name = ROW_ID
+            df[REVISION] = 0
+            self._df, self._next_id, self._pending = df, len(df), 0
+            self._synced = self._disk_state()
+            self._changes += 1
+
+    def _compact_loop(self):
+        while True:
+            self._wakeup.wait()
+            # Let a burst of submits accumulate before paying for a workbook write
+            while self._pending < JOURNAL_BATCH:
+                self._wakeup.clear()
+                if not self._wakeup.wait(JOURNAL_IDLE_SECONDS):
+                    break
+            try:
+                self.compact()
+            except Exception:  # Keep the worker alive, the journal is still on disk
+                logger.exception("Journal compaction of %s failed", self.xlsx)
+
+    def _tmp_paths(self):
+        return self.xlsx + ".tmp.xlsx", self.journal + ".tmp"
+
+    def _commit(self, df, header):
+        """
+        Replace the workbook with `df` and the journal with its `header` entry.
+        Both are written aside first; if the process dies between the two
+        replaces, `_recover` completes the switch on the next load.
+        """
+        tmp_xlsx, tmp_journal = self._tmp_paths()
+        write_workbook(df, tmp_xlsx, self.sheet_name)
+        with open(tmp_journal, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_xlsx, self.xlsx)
+        os.replace(tmp_journal, self.journal)
+
+    def _recover(self):
+        """
+        Finish or undo a `_commit` interrupted by a crash (call with the file
+        lock held). Once the workbook was replaced its old journal must not be
+        replayed, since its entries are already in the workbook.
+        """
+        tmp_xlsx, tmp_journal = self._tmp_paths()
+        if os.path.exists(tmp_journal) and not os.path.exists(tmp_xlsx):
+            logger.warning("Completing the interrupted compaction of %s", self.xlsx)
+            os.replace(tmp_journal, self.journal)
+        for path in (tmp_xlsx, tmp_journal):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def compact(self):
+        """Fold the pending journal entries into the workbook."""
+        with self.lock, self._lock:
+            self._refresh()
+            if not self._pending:
+                return
+            df = self._df
+            # The new journal only records the row ids of the compacted workbook and
+            # the next id, so ids handed out to the pages are never reused after a replay
+            self._commit(df, {"op": "ids", "row_ids": [int(r) for r in df.index], "next_id": self._next_id})
+            self._pending = 0
+            self._synced = self._disk_state()
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded SQLite backend.
+
+    Each database is one table of the SQLite file; the row id is the table's
+    INTEGER PRIMARY KEY, so it never changes when other rows are added or removed.
+    When the table does not exist yet it is seeded from the Excel workbook.
+    Revisions are checked inside the write transaction (BEGIN IMMEDIATE), which
+    also holds SQLite's exclusive write lock.
+    """
+
+    def __init__(self, name, xlsx, sheet_name, columns, db_path=SQLITE_PATH):
+        self.db_path = db_path
+        super().__init__(name, xlsx, sheet_name, columns)
+        self.table = _quote(name)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # One change counter per database, increased by every write transaction
+            conn.execute("CREATE TABLE IF NOT EXISTS ddlab_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO ddlab_versions (name, version) VALUES (?, 0)", (name,))
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+            ).fetchone()
+        if not exists:
+            self._replace(read_workbook(xlsx, sheet_name, columns))
+        else:
+            with self._transaction() as conn:
+                if REVISION not in [col[1] for col in conn.execute(f"PRAGMA table_info({self.table})")]:
+                    conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {REVISION} INTEGER NOT NULL DEFAULT 0")
+
+    def _lock_path(self):
+        return self.db_path + ".lock"
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Connection with an open write transaction, committed on success."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("UPDATE ddlab_versions SET version = version + 1 WHERE name = ?", (self.name,))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def data_version(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT version FROM ddlab_versions WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def _columns(self, conn):
+        info = conn.execute(f"PRAGMA table_info({self.table})").fetchall()
+        return [col[1] for col in info if col[1] not in (ROW_ID, REVISION)]
+
+    def _replace(self, df):
+        """Drop and recreate the table with the given content, in one transaction."""
+        df = df.drop(columns=REVISION, errors="ignore")
+        columns = [str(col) for col in df.columns]
+        col_defs = ", ".join(_quote(col) for col in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        rows = [[_plain_value(v) for v in row] for row in df.itertuples(index=False, name=None)]
+        with self._transaction() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+            # Columns are left untyped so numbers and text keep the type they were saved with
+            conn.execute(
+                f"CREATE TABLE {self.table} ({ROW_ID} INTEGER PRIMARY KEY AUTOINCREMENT, {col_defs}, "
+                f"{REVISION} INTEGER NOT NULL DEFAULT 0)"
+            )
+            if rows:
+                conn.executemany(
+                    f"INSERT INTO {self.table} ({col_defs}) VALUES ({placeholders})", rows
+                )
+
+    def _add_missing_columns(self, conn, keys):
+        existing = set(self._columns(conn))
+        for key in keys:
+            if key not in existing:
+                conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {_quote(key)}")
+
+    def load(self):
+        with self._connect() as conn:
+            return pd.read_sql_query(f"SELECT * FROM {self.table}", conn, index_col=ROW_ID)
+
+    def insert(self, row):
+        keys = list(row)
+        cols = ", ".join(_quote(k) for k in keys)
+        placeholders = ", ".join("?" for _ in keys)
+        with self._transaction() as conn:
+            self._add_missing_columns(conn, keys)
+            cursor = conn.execute(
+                f"INSERT INTO {self.table} ({cols}) VALUES ({placeholders})",
+                [_plain_value(row[k]) for k in keys],
+            )
+            return cursor.lastrowid
+
+    def update(self, row_id, values, expected_rev=None):
+        keys = list(values)
+        assignments = "".join(f"{_quote(k)} = ?, " for k in keys)
+        sql = f"UPDATE {self.table} SET {assignments}{REVISION} = {REVISION} + 1 WHERE {ROW_ID} = ?"
+        params = [_plain_value(values[k]) for k in keys] + [int(row_id)]
+        if expected_rev is not None:
+            sql += f" AND {REVISION} = ?"
+            params.append(int(expected_rev))
+        with self._transaction() as conn:
+            self._add_missing_columns(conn, keys)
+            if conn.execute(sql, params).rowcount == 0:
+                raise ConflictError(f"Row {row_id} was changed or deleted by someone else.")
+
+    def delete(self, row_ids, expected_revs=None):
+        expected_revs = {int(k): v for k, v in (expected_revs or {}).items()}
+        with self._transaction() as conn:
+            for row_id in row_ids:
+                row_id = int(row_id)
+                if row_id in expected_revs:
+                    deleted = conn.execute(
+                        f"DELETE FROM {self.table} WHERE {ROW_ID} = ? AND {REVISION} = ?",
+                        (row_id, int(expected_revs[row_id])),
+                    ).rowcount
+                    if not deleted and conn.execute(
+                        f"SELECT 1 FROM {self.table} WHERE {ROW_ID} = ?", (row_id,)
+                    ).fetchone():
+                        raise ConflictError(f"Row {row_id} was changed by someone else.")
+                else:
+                    conn.execute(f"DELETE FROM {self.table} WHERE {ROW_ID} = ?", (row_id,))
+
+    def import_excel(self, source):
+        self._replace(pd.read_excel(source, sheet_name=self.sheet_name))
+
+
+BACKENDS = {
+    "sqlite": SQLiteStorage,
+    "journal": JournalExcelStorage,
+    "excel": ExcelStorage,
+}
+
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def open_storage(name, backend=None):
+    """Return the (process-wide) storage object of a database."""
+    backend = backend or STORAGE_BACKEND
+    key = (name, backend)
+    with _opened_lock:
+        if key in _opened:
+            return _opened[key]
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown storage backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+        _opened[key] = BACKENDS[backend](name, **DATABASES[name])
+        return _opened[key]
@@ -0,0 +1,146 @@
+"""
+Process-wide shared tables for the inventory databases.
+
+All browser sessions read the same in-memory DataFrame of a database instead
+of keeping their own copy in `st.session_state`. The DataFrame is never
+modified in place: every change builds a new frame (copy-on-write) and bumps
+the table version, so a session only needs to remember the version it last
+displayed to know whether it is stale.
+
+Edits are checked against the row the user started from: changes to other
+fields made meanwhile are merged, overlapping ones raise ConflictError.
+
+The shared frame is typed by the database schema (categoricals and dates, see
+`ddlab.schema`); values written through the table are converted the same way.
+"""
+import threading
+
+import pandas as pd
+
+from ddlab.schema import SCHEMAS, Schema
+from ddlab.storage import REVISION, ConflictError, open_storage, write_workbook
+
+
+def _same(a, b):
+    """Compare two cell values the way the edit forms show them (as text)."""
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return str(a) == str(b)
+
+
+class SharedTable:
+    """Versioned, copy-on-write view of one database, shared by all sessions."""
+
+    def __init__(self, storage, schema=None):
+        self.storage = storage
+        self.schema = schema or Schema()
+        self.version = 0
+        self._lock = threading.RLock()
+        self._df = None
+        self._stored_version = None
+
+    def snapshot(self):
+        """
+        Return (version, DataFrame) of the current data.
+        Changes written by other processes are picked up by comparing the
+        backend's data version, which is much cheaper than re-reading the table.
+        """
+        with self._lock:
+            stored_version = self.storage.data_version()
+            if self._df is None or stored_version != self._stored_version:
+                self._df = self.schema.apply(self.storage.load())
+                self._stored_version = stored_version
+                self.version += 1
+            return self.version, self._df
+
+    def _mutate(self, write, change):
+        """Run a backend write, then bring the shared frame up to date."""
+        with self._lock, self.storage.lock:
+            self.snapshot()
+            before = self._stored_version
+            result = write()
+            after = self.storage.data_version()
+            if not self.storage.in_memory and isinstance(before, int) and after == before + 1:
+                # Nobody else wrote in the meantime: apply the change in memory
+                self._df = self.schema.apply_change(self._df, change(result))
+            else:
+                self._df = self.schema.apply(self.storage.load())
+            self._stored_version = after
+            self.version += 1
+            return result
+
+    def insert(self, row):
+        """Add a row and return its row id. Raises ValueError for an invalid date."""
+        row = self.schema.coerce(row)
+        return self._mutate(
+            lambda: self.storage.insert(row),
+            lambda row_id: {"op": "insert", "row_id": row_id, "row": row},
+        )
+
+    def update(self, row_id, values, base=None):
+        """
+        Update one row. `base` is the row as the user saw it when starting the
+        edit: only the fields that differ from it are written. If someone else
+        changed the row in the meantime, the edit is merged when it touches
+        other fields and rejected with ConflictError when the same field was
+        changed to a different value (any change, for a backend whose row ids
+        are row positions). Raises ValueError for an invalid date.
+        """
+        values = self.schema.coerce(values)
+        with self._lock, self.storage.lock:
+            _, df = self.snapshot()
+            if row_id not in df.index:
+                raise ConflictError(f"Row {row_id} was deleted by someone else.")
+            current = df.loc[row_id]
+            if base is not None:
+                if not self.storage.stable_row_ids and current.get(REVISION) != base.get(REVISION):
+                    # The row at this position may be another one: nothing to merge with
+                    raise ConflictError(f"Row {row_id} was changed by someone else meanwhile.")
+                values = {k: v for k, v in values.items() if not _same(v, base.get(k))}
+                clashing = [k for k, v in values.items()
+                            if not _same(current.get(k), base.get(k)) and not _same(v, current.get(k))]
+                if clashing:
+                    raise ConflictError(
+                        f"Row {row_id} was changed by someone else meanwhile ({', '.join(clashing)})."
+                    )
+            if not values:
+                return
+            self._mutate(
+                lambda: self.storage.update(row_id, values, expected_rev=current.get(REVISION)),
+                lambda _: {"op": "update", "row_id": row_id, "values": values},
+            )
+
+    def delete(self, row_ids, revisions=None):
+        """
+        Delete rows. `revisions` (row id -> revision the user saw) rejects the
+        delete with ConflictError if one of the rows was changed meanwhile.
+        """
+        row_ids = list(row_ids)
+        revisions = dict(revisions) if revisions is not None else None
+        self._mutate(
+            lambda: self.storage.delete(row_ids, expected_revs=revisions),
+            lambda _: {"op": "delete", "row_ids": row_ids},
+        )
+
+    def import_excel(self, source):
+        with self._lock:
+            self.storage.import_excel(source)
+            self._df = None
+            self.snapshot()
+
+    def export_excel(self, target):
+        _, df = self.snapshot()
+        write_workbook(df, target, self.storage.sheet_name)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def open_table(name, backend=None):
+    """Return the shared table of a database (one per process and backend)."""
+    storage = open_storage(name, backend)
+    with _tables_lock:
+        if storage not in _tables:
+            _tables[storage] = SharedTable(storage, SCHEMAS.get(name))
+        return _tables[storage]
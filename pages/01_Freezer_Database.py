@@ -1,38 +1,47 @@
 import streamlit as st
 import pandas as pd
-import os
+import io
+
+from ddlab.facets import FacetIndex
+from ddlab.sample_ids import SampleIdIndex, locate_samples, parse_id_list
+from ddlab.schema import date_text
+from ddlab.storage import REVISION, ConflictError
+from ddlab.tables import open_table
 
 # Set app layout on wide
 st.set_page_config(layout="wide")
 
-# File path
+# Database served by the configured storage backend (SQLite by default);
+# the workbook is only used for import/export
+DATABASE = "freezer"
 file_path = "Freezer_Database.xlsx"
+table = open_table(DATABASE)
 
-# --- CACHE FUNCTION FOR DATA LOADING ---
-@st.cache_data(show_spinner="Loading database...")
-def load_data(path):
+# --- SHARED DATA LOAD ---
+def load_data(name):
     """
-    Loads the DataFrame from the Excel file. 
-    Streamlit uses the file's modification time (mtime) 
-    to automatically bust the cache when the file is saved.
+    Returns (version, DataFrame) of the process-wide shared table.
+    Every session reads the same DataFrame; the session only keeps the version
+    it displayed, to notice changes made by other users.
     """
-    if os.path.exists(path):
-        return pd.read_excel(path)
-    else:
-        # Create an empty DataFrame if the file doesn't exist
-        columns = ["Freezer Name", "Freezer Location", "Cassetto", "Project", "Box_Number_If_Available", "Type_Of_Sample", "Sample Batch", "Samples_ID_In_Batch", "Throw_Away_Date_If_Available"]
-        df_new = pd.DataFrame(columns=columns)
-        df_new.to_excel(path, index=False)
-        return df_new
+    return open_table(name).snapshot()
+
+with st.spinner("Loading database..."):
+    version, df = load_data(DATABASE)
 
-# --- INITIAL DATA LOAD & SESSION STATE SETUP ---
-if 'data_df' not in st.session_state:
-    # Use the cached function to load the data.
-    # The file's modification time is used as an implicit hash parameter by Streamlit.
-    st.session_state['data_df'] = load_data(file_path)
+if st.session_state.get('data_df_version', version) != version:
+    st.toast("🔄 Database updated by another user, showing the latest data.")
+st.session_state['data_df_version'] = version
 
-# Always reference the live DataFrame from session state
-df = st.session_state['data_df']
+# Row revisions are internal: never shown in the tables
+VISIBLE_COLUMNS = [c for c in df.columns if c != REVISION]
+
+# Valori distinti e bitmap dei campi di filtro: costruiti una volta per versione dei dati, condivisi tra le sessioni
+@st.cache_resource(max_entries=4)
+def load_facet_index(name, version, _df):
+    return FacetIndex(_df)
+
+facets = load_facet_index(DATABASE, version, df)
 
 st.title("DDLAB Freezer Database Management Tool")
 
@@ -52,7 +61,7 @@ st.write("### Choose a combination of criteria to filter by:")
 cols = st.columns(len(SEARCH_FIELDS))
 
 for i, field in enumerate(SEARCH_FIELDS):
-    unique_values = ['-- All Samples --'] + sorted(df[field].dropna().astype(str).unique().tolist())
+    unique_values = ['-- All Samples --'] + facets.values(field)
     with cols[i]:
         selected_value = st.selectbox(
             f"Select {field}:",
@@ -62,72 +71,22 @@ for i, field in enumerate(SEARCH_FIELDS):
         selected_search_criteria[field] = selected_value
 
 # 🔍 Campo aggiuntivo per la ricerca per Sample ID anche dentro range
-import re
-
 sample_id_search = st.text_input(
     "🔎 Search by Sample ID (within ranges):",
     placeholder="e.g. M2423"
 )
 
-def id_in_range(id_value, range_value):
-    """
-    Verifica se un ID (es. 'M2423', 'AA10', '1023') rientra in un range come 'M2400-M2450', 'AA1-AA50', '100-200', ecc.
-    Gestisce ID con 0, 1 o più lettere di prefisso.
-    """
-    if not isinstance(range_value, str) or pd.isna(range_value) or not str(range_value).strip():
-        return False
-
-    id_value = str(id_value).strip().upper()
-    range_value = range_value.strip().upper()
-
-    # Estrai prefisso (lettere) e numero (cifre) dell'ID cercato
-    match_id = re.match(r"([A-Z]*)(\d+)", id_value)
-    if not match_id:
-        return False
-    id_prefix, id_num = match_id.groups()
-    id_num = int(id_num)
-
-    # Caso: range (es. "M2400-M2450" oppure "AA1-AA50" oppure "100-200")
-    if "-" in range_value:
-        parts = range_value.split("-")
-        if len(parts) != 2:
-            return False
-        start, end = parts[0].strip(), parts[1].strip()
-
-        match_start = re.match(r"([A-Z]*)(\d+)", start)
-        match_end = re.match(r"([A-Z]*)(\d+)", end)
-        if not match_start or not match_end:
-            return False
-
-        prefix_start, num_start = match_start.groups()
-        prefix_end, num_end = match_end.groups()
-
-        num_start, num_end = int(num_start), int(num_end)
-
-        # Se entrambi hanno prefisso → confronta prefissi e range numerico
-        if prefix_start or prefix_end:
-            if prefix_start != prefix_end or prefix_start != id_prefix:
-                return False
-        # Se nessuno ha prefisso → confronta solo i numeri
-        elif id_prefix:
-            return False  # L'ID cercato ha lettere ma il range no
-
-        return num_start <= id_num <= num_end
-
-    else:
-        # Caso: singolo ID (es. "M2401", "AA12", "123")
-        return id_value == range_value
+# Indice dei range di Sample ID: costruito una volta per versione dei dati, condiviso tra le sessioni
+@st.cache_resource(max_entries=4)
+def load_sample_id_index(name, version, _df):
+    return SampleIdIndex(_df["Samples_ID_In_Batch"])
 
 
 # --- FILTRAGGIO DINAMICO ---
-combined_search_filter = pd.Series([True] * len(df))
-
-for field, value in selected_search_criteria.items():
-    if value != '-- All Samples --':
-        combined_search_filter &= (df[field].astype(str) == value)
+combined_search_filter = facets.select(selected_search_criteria, any_value='-- All Samples --')
 
 if sample_id_search.strip():
-    combined_search_filter &= df["Samples_ID_In_Batch"].apply(lambda x: id_in_range(sample_id_search, x))
+    combined_search_filter &= load_sample_id_index(DATABASE, version, df).mask(sample_id_search)
 
 search_results = df[combined_search_filter]
 
@@ -138,7 +97,48 @@ if search_results.empty:
     st.warning("⚠️ No samples matched the selected criteria.")
 else:
     st.success(f"🔍 Found **{len(search_results)}** matching sample(s):")
-    st.dataframe(search_results, use_container_width=True)
+    st.dataframe(search_results, column_order=VISIBLE_COLUMNS, use_container_width=True)
+
+# ======================================================================
+# --- BULK SAMPLE ID LOOKUP ---
+# ======================================================================
+st.header("Bulk Sample ID Lookup")
+
+def cell_to_id(value):
+    # Gli ID numerici letti da Excel arrivano come float (es. 7500.0)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+with st.expander("Locate a list of Sample IDs"):
+    pasted_ids = st.text_area(
+        "Paste Sample IDs (one per line, or separated by commas/spaces):",
+        placeholder="M2423\nM2424\nAA12"
+    )
+    id_file = st.file_uploader("...or upload a file with the IDs", type=["xlsx", "csv"], key="bulk_ids_file")
+
+    bulk_ids = parse_id_list(pasted_ids)
+    if id_file is not None:
+        ids_df = pd.read_csv(id_file) if id_file.name.lower().endswith(".csv") else pd.read_excel(id_file)
+        id_column = st.selectbox("Column containing the Sample IDs:", ids_df.columns.tolist(), key="bulk_ids_column")
+        bulk_ids += [cell_to_id(v) for v in ids_df[id_column].dropna() if cell_to_id(v)]
+
+    if st.button("Locate Samples", disabled=not bulk_ids):
+        located = locate_samples(df, load_sample_id_index(DATABASE, version, df), bulk_ids)
+        unresolved = located.loc[~located["Found"], "Sample ID"]
+
+        st.success(f"📍 Located **{len(bulk_ids) - len(unresolved)}** of {len(bulk_ids)} Sample ID(s).")
+        if len(unresolved):
+            st.warning(f"⚠️ {len(unresolved)} Sample ID(s) not found: {', '.join(unresolved.head(20))}"
+                       + (" ..." if len(unresolved) > 20 else ""))
+        st.dataframe(located, use_container_width=True, hide_index=True)
+
+        st.download_button(
+            label="⬇️ Download locations (CSV)",
+            data=located.to_csv(index=False).encode('utf-8'),
+            file_name="sample_locations.csv",
+            mime="text/csv"
+        )
 
 
 # ----------------------------------------------------------------------
@@ -240,14 +240,16 @@ with st.form("add_form"):
                    "Sample Batch": new_batch,
                    "Samples_ID_In_Batch": new_id,
                    "Throw_Away_Date_If_Available": new_date}
-                   
-        # Update and save logic (assuming session state/caching is correctly set up)
-        new_df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        st.session_state['data_df'] = new_df 
 
-        new_df.to_excel(file_path, index=False)
-        
-        # load_data.clear() # Uncomment if using the cached function
+        invalid_dates = table.schema.invalid_dates(new_row)
+        if invalid_dates:
+            st.error(f"⚠️ Invalid date in {', '.join(invalid_dates)}: please use YYYY-MM-DD or DD/MM/YYYY.")
+            st.stop()
+
+        # Single-row insert into the shared table
+        table.insert(new_row)
+        st.session_state['data_df_version'] = table.version
+
         st.success("✅ Sample added! Refreshing database...")
         st.rerun()
 
@@ -263,7 +265,7 @@ st.write("### Choose the combination of criteria for deletion:")
 cols = st.columns(len(DEL_FIELDS))
 
 for i, field in enumerate(DEL_FIELDS):
-    unique_values = ['-- All Samples --'] + sorted(df[field].dropna().astype(str).unique().tolist())
+    unique_values = ['-- All Samples --'] + facets.values(field)
     with cols[i]:
         selected_value = st.selectbox(
             f"Select {field}:",
@@ -273,11 +275,8 @@ for i, field in enumerate(DEL_FIELDS):
         selected_criteria[field] = selected_value
 
 # Apply filter to determine rows to delete
-combined_filter = pd.Series([True] * len(df))
-for field, value in selected_criteria.items():
-    if value != '-- All Samples --':
-        combined_filter &= (df[field].astype(str) == value) 
-        
+combined_filter = facets.select(selected_criteria, any_value='-- All Samples --')
+
 rows_to_delete = df[combined_filter]
 num_rows_to_delete = len(rows_to_delete)
 
@@ -295,7 +294,7 @@ with st.form("precise_delete_form"):
         
     else:
         st.warning(f"⚠️ **{num_rows_to_delete} row(s)** will be deleted based on the criteria below:")
-        st.dataframe(rows_to_delete)
+        st.dataframe(rows_to_delete, column_order=VISIBLE_COLUMNS)
         
         # --- CONFIRMATION LOGIC ---
         
@@ -315,14 +314,17 @@ with st.form("precise_delete_form"):
             
             if final_confirm:
                 # Execution of delete
-                new_df = df[~combined_filter]
-                st.session_state['data_df'] = new_df
-                new_df.to_excel(file_path, index=False)
+                try:
+                    # Rejected if one of the rows was changed by someone else meanwhile
+                    table.delete(rows_to_delete.index, revisions=rows_to_delete[REVISION])
+                except ConflictError as exc:
+                    st.error(f"⚠️ {exc} Please review the selection and try again.")
+                    st.stop()
                 
                 # Clear state and cache, then rerun
                 st.session_state['delete_confirmation_needed'] = False
                 st.session_state['last_delete_count'] = 0
-                load_data.clear()
+                st.session_state['data_df_version'] = table.version
                 st.success(f"✅ Successfully deleted {num_rows_to_delete} sample(s)! Refreshing database...")
                 st.rerun()
 
@@ -356,11 +358,11 @@ edit_cols = st.columns(len(EDIT_FIELDS))
 
 st.write("### 1. Select the single sample you wish to edit:")
 
-filtered_df = df.copy()  # DataFrame dinamico che si restringe a ogni selezione
+edit_rows = facets.all_rows()  # Righe candidate, si restringono a ogni selezione
 
 for i, field in enumerate(EDIT_FIELDS):
     # Calcola i valori validi per questo campo in base alle scelte precedenti
-    possible_values = sorted(filtered_df[field].dropna().astype(str).unique().tolist())
+    possible_values = facets.values(field, edit_rows)
     possible_values = ['-- Select a Value --'] + possible_values
 
     with edit_cols[i]:
@@ -373,12 +375,17 @@ for i, field in enumerate(EDIT_FIELDS):
 
     # Applica il filtro per restringere i valori per i campi successivi
     if selected_value != '-- Select a Value --':
-        filtered_df = filtered_df[filtered_df[field].astype(str) == selected_value]
+        edit_rows = edit_rows & facets.bitmap(field, selected_value)
 
 # Alla fine, le righe candidate da modificare sono quelle del DataFrame filtrato
-rows_to_edit = filtered_df
+rows_to_edit = df[edit_rows]
+
 
 
+def reset_edit_form():
+    """Forget the pinned base row; the form widgets get new keys, so they show the row again."""
+    st.session_state.pop('freezer_edit_base', None)
+    st.session_state['freezer_edit_form'] = st.session_state.get('freezer_edit_form', 0) + 1
 
 # Check if a single row is selected
 if len(rows_to_edit) == 1:
@@ -389,6 +396,16 @@ if len(rows_to_edit) == 1:
     
     # Get the existing data for pre-population
     existing_row = rows_to_edit.iloc[0]
+
+    # Row as it was when the user selected it, i.e. what the form started from: pinned
+    # until a successful update or another row is selected, and used to merge or reject
+    # the edit if someone else changed the row meanwhile
+    edit_base = st.session_state.get('freezer_edit_base')
+    if edit_base is None or edit_base.name != edit_index:
+        reset_edit_form()
+        edit_base = existing_row
+        st.session_state['freezer_edit_base'] = edit_base
+    edit_form_id = st.session_state['freezer_edit_form']
     
     st.write("### 2. Edit the fields below:")
 
@@ -403,9 +420,9 @@ if len(rows_to_edit) == 1:
 
         edit_selected_freezer = st.selectbox("Freezer Name:", edit_freezer_options, 
                                              index=edit_freezer_options.index(default_freezer) if default_freezer in edit_freezer_options else 0,
-                                             key="edit_select_freezer")
+                                             key=f"edit_select_freezer_{edit_form_id}")
         edit_new_freezer_input = st.text_input("Enter New Freezer Name:", disabled=(edit_selected_freezer != "-- Add New Freezer Name --"), 
-                                                key="edit_new_freezer_input")
+                                                key=f"edit_new_freezer_input_{edit_form_id}")
         final_edit_freezer = edit_new_freezer_input if edit_selected_freezer == "-- Add New Freezer Name --" and edit_new_freezer_input else edit_selected_freezer
 
         # --- FREEZER LOCATION (PRE-POPULATED) ---
@@ -416,9 +433,9 @@ if len(rows_to_edit) == 1:
 
         edit_selected_location = st.selectbox("Freezer Location:", edit_location_options,
                                               index=edit_location_options.index(default_location) if default_location in edit_location_options else 0,
-                                              key="edit_select_location")
+                                              key=f"edit_select_location_{edit_form_id}")
         edit_new_location_input = st.text_input("Enter New Freezer Location:", disabled=(edit_selected_location != "-- Add New Freezer Location --"), 
-                                                key="edit_new_location_input")
+                                                key=f"edit_new_location_input_{edit_form_id}")
         final_edit_location = edit_new_location_input if edit_selected_location == "-- Add New Freezer Location --" and edit_new_location_input else edit_selected_location
 
         # --- CASSETTO (PRE-POPULATED) ---
@@ -429,9 +446,9 @@ if len(rows_to_edit) == 1:
              
         edit_selected_cassetto = st.selectbox("Cassetto:", edit_cassetto_options,
                                               index=edit_cassetto_options.index(default_cassetto) if default_cassetto in edit_cassetto_options else 0,
-                                              key="edit_select_cassetto")
+                                              key=f"edit_select_cassetto_{edit_form_id}")
         edit_new_cassetto_input = st.text_input("Enter New Cassetto:", disabled=(edit_selected_cassetto != "-- Add New Cassetto --"), 
-                                                key="edit_new_cassetto_input")
+                                                key=f"edit_new_cassetto_input_{edit_form_id}")
         final_edit_cassetto = edit_new_cassetto_input if edit_selected_cassetto == "-- Add New Cassetto --" and edit_new_cassetto_input else edit_selected_cassetto
 
         # --- TYPE OF SAMPLE (PRE-POPULATED) ---
@@ -442,18 +459,18 @@ if len(rows_to_edit) == 1:
         
         edit_selected_type = st.selectbox("Type_Of_Sample:", edit_type_options,
                                           index=edit_type_options.index(default_type) if default_type in edit_type_options else 0,
-                                          key="edit_select_type")
+                                          key=f"edit_select_type_{edit_form_id}")
         edit_new_type_input = st.text_input("Enter New Sample Type:", disabled=(edit_selected_type != "-- Add New Type --"), 
-                                            key="edit_new_type_input")
+                                            key=f"edit_new_type_input_{edit_form_id}")
         final_edit_type = edit_new_type_input if edit_selected_type == "-- Add New Type --" and edit_new_type_input else edit_selected_type
 
 
         # --- REST OF THE FIELDS (PRE-POPULATED TEXT INPUTS) ---
-        edit_project = st.text_input("Project", value=str(existing_row['Project']), key="edit_project_text") 
-        edit_box = st.text_input("Box_Number_If_Available", value=str(existing_row['Box_Number_If_Available']), key="edit_box_text")
-        edit_batch = st.text_input("Sample Batch", value=str(existing_row['Sample Batch']), key="edit_batch_text")
-        edit_id = st.text_input("Samples_ID_In_Batch", value=str(existing_row['Samples_ID_In_Batch']), key="edit_id_text")
-        edit_date = st.text_input("Throw_Away_Date_If_Available", value=str(existing_row['Throw_Away_Date_If_Available']), key="edit_date_text")
+        edit_project = st.text_input("Project", value=str(existing_row['Project']), key=f"edit_project_text_{edit_form_id}") 
+        edit_box = st.text_input("Box_Number_If_Available", value=str(existing_row['Box_Number_If_Available']), key=f"edit_box_text_{edit_form_id}")
+        edit_batch = st.text_input("Sample Batch", value=str(existing_row['Sample Batch']), key=f"edit_batch_text_{edit_form_id}")
+        edit_id = st.text_input("Samples_ID_In_Batch", value=str(existing_row['Samples_ID_In_Batch']), key=f"edit_id_text_{edit_form_id}")
+        edit_date = st.text_input("Throw_Away_Date_If_Available", value=date_text(existing_row['Throw_Away_Date_If_Available']), key=f"edit_date_text_{edit_form_id}")
 
         edit_submitted = st.form_submit_button("Update Sample")
 
@@ -477,15 +494,23 @@ if len(rows_to_edit) == 1:
                 "Samples_ID_In_Batch": edit_id,
                 "Throw_Away_Date_If_Available": edit_date
             }
-            
-            # Update the DataFrame in session state directly at the found index
-            for key, value in updated_row.items():
-                st.session_state['data_df'].at[edit_index, key] = value
-                
-            # Save the updated DataFrame to the Excel file
-            st.session_state['data_df'].to_excel(file_path, index=False)
-            
-            load_data.clear()
+
+            invalid_dates = table.schema.invalid_dates(updated_row)
+            if invalid_dates:
+                st.error(f"⚠️ Invalid date in {', '.join(invalid_dates)}: please use YYYY-MM-DD or DD/MM/YYYY.")
+                st.stop()
+
+            # Update only the selected row (edit_index is its row id)
+            try:
+                table.update(edit_index, updated_row, base=edit_base)
+            except ConflictError as exc:
+                # Next run the form starts again from the latest values of the row
+                reset_edit_form()
+                st.error(f"⚠️ {exc} Please review the latest values and try again.")
+                st.stop()
+
+            reset_edit_form()
+            st.session_state['data_df_version'] = table.version
             st.success(f"✅ Sample **{edit_index}** updated successfully! Refreshing database...")
             st.rerun()
 
@@ -496,23 +521,23 @@ else:
 
 # ----------------------------------------------------------------------
 
+# --- IMPORT / EXPORT EXCEL ---
+st.header("Import / Export Excel")
+
+with st.expander("Excel import/export"):
+    if st.button("Prepare Excel export"):
+        buffer = io.BytesIO()
+        table.export_excel(buffer)
+        st.download_button(
+            label="⬇️ Download Freezer Database (xlsx)",
+            data=buffer.getvalue(),
+            file_name=file_path,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    import_file = st.file_uploader("Replace the database with a workbook", type=["xlsx"], key="import_xlsx")
+    if import_file and st.button("Import workbook (replaces all samples)"):
+        table.import_excel(import_file)
+        st.session_state['data_df_version'] = table.version
+        st.success("✅ Workbook imported! Refreshing database...")
+        st.rerun()
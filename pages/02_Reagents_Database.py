@@ -1,30 +1,44 @@
 import streamlit as st
-import pandas as pd
-import os
+import io
+
+from ddlab.facets import FacetIndex
+from ddlab.schema import date_text
+from ddlab.storage import REVISION, ConflictError
+from ddlab.tables import open_table
 
 # Set app layout on wide
 st.set_page_config(layout="wide")
 
-# File path
+# Database served by the configured storage backend (SQLite by default)
+DATABASE = "reagents"
 file_path = "Reagents_Database.xlsx"
+table = open_table(DATABASE)
 
-# --- CACHE FUNCTION FOR DATA LOADING ---
-@st.cache_data(show_spinner="Loading database...")
-def load_data(path):
-    if os.path.exists(path):
-        return pd.read_excel(path, sheet_name="Template")
-    else:
-        # Create an empty DataFrame if the file doesn't exist
-        columns = ["Reagent Type", "Supplier", "Reagent Name", "Lot Number", "Expiry Date", "Storage Location"]
-        df_new = pd.DataFrame(columns=columns)
-        df_new.to_excel(path, sheet_name="Template", index=False)
-        return df_new
+# --- SHARED DATA LOAD ---
+def load_data(name):
+    """
+    Returns (version, DataFrame) of the process-wide shared table.
+    Every session reads the same DataFrame; the session only keeps the version
+    it displayed, to notice changes made by other users.
+    """
+    return open_table(name).snapshot()
+
+with st.spinner("Loading database..."):
+    version, df = load_data(DATABASE)
+
+if st.session_state.get('reagents_df_version', version) != version:
+    st.toast("🔄 Database updated by another user, showing the latest data.")
+st.session_state['reagents_df_version'] = version
 
-# --- INITIAL DATA LOAD & SESSION STATE SETUP ---
-if 'reagents_df' not in st.session_state:
-    st.session_state['reagents_df'] = load_data(file_path)
+# Row revisions are internal: never shown in the tables
+VISIBLE_COLUMNS = [c for c in df.columns if c != REVISION]
 
-df = st.session_state['reagents_df']
+# Valori distinti e bitmap dei campi di filtro: costruiti una volta per versione dei dati, condivisi tra le sessioni
+@st.cache_resource(max_entries=4)
+def load_facet_index(name, version, _df):
+    return FacetIndex(_df)
+
+facets = load_facet_index(DATABASE, version, df)
 
 st.title("DDLAB Reagents Database Management Tool")
 
@@ -39,12 +53,12 @@ selected_search_criteria = {}
 st.write("### Choose a combination of criteria to filter by:")
 cols = st.columns(len(SEARCH_FIELDS))
 
-filtered_search_df = df.copy()  # DataFrame che si restringe dinamicamente
+search_rows = facets.all_rows()  # Righe che si restringono dinamicamente
 selected_search_criteria = {}
 
 for i, field in enumerate(SEARCH_FIELDS):
     # Calcola i valori possibili in base alle scelte precedenti
-    possible_values = sorted(filtered_search_df[field].dropna().astype(str).unique().tolist())
+    possible_values = facets.values(field, search_rows)
     possible_values = ['-- All Samples --'] + possible_values
     
     with cols[i]:
@@ -57,17 +71,17 @@ for i, field in enumerate(SEARCH_FIELDS):
     
     # Restringi i valori per i campi successivi
     if selected_value != '-- All Samples --':
-        filtered_search_df = filtered_search_df[filtered_search_df[field].astype(str) == selected_value]
+        search_rows = search_rows & facets.bitmap(field, selected_value)
 
-# Dopo il ciclo, i risultati corrispondono al DataFrame filtrato
-search_results = filtered_search_df
+# Dopo il ciclo, i risultati corrispondono alle righe filtrate
+search_results = df[search_rows]
 
 if st.button("Apply Search Filters"):
     if search_results.empty:
         st.warning("⚠️ No reagents matched the selected criteria.")
     else:
         st.success(f"🔍 Found **{len(search_results)}** matching reagent(s):")
-        st.dataframe(search_results)
+        st.dataframe(search_results, column_order=VISIBLE_COLUMNS)
 
 # ======================================================================
 # --- ADD NEW ENTRY ---
@@ -92,9 +106,13 @@ with st.form("add_form"):
                    "Expiry Date": new_expiry,
                    "Storage Location": new_location}
 
-        new_df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        st.session_state['reagents_df'] = new_df
-        new_df.to_excel(file_path, sheet_name="Template", index=False)
+        invalid_dates = table.schema.invalid_dates(new_row)
+        if invalid_dates:
+            st.error(f"⚠️ Invalid date in {', '.join(invalid_dates)}: please use YYYY-MM-DD or DD/MM/YYYY.")
+            st.stop()
+
+        table.insert(new_row)
+        st.session_state['reagents_df_version'] = table.version
 
         st.success("✅ Reagent added! Refreshing database...")
         st.rerun()
@@ -109,15 +127,12 @@ selected_criteria = {}
 cols = st.columns(len(DEL_FIELDS))
 
 for i, field in enumerate(DEL_FIELDS):
-    unique_values = ['-- All --'] + sorted(df[field].dropna().astype(str).unique().tolist())
+    unique_values = ['-- All --'] + facets.values(field)
     with cols[i]:
         selected_value = st.selectbox(f"Select {field}:", unique_values, key=f"delete_{field}")
         selected_criteria[field] = selected_value
 
-combined_filter = pd.Series([True] * len(df))
-for field, value in selected_criteria.items():
-    if value != '-- All --':
-        combined_filter &= (df[field].astype(str) == value)
+combined_filter = facets.select(selected_criteria, any_value='-- All --')
 
 rows_to_delete = df[combined_filter]
 num_rows_to_delete = len(rows_to_delete)
@@ -126,12 +141,16 @@ if num_rows_to_delete == 0:
     st.info("No records match the selected criteria.")
 else:
     st.warning(f"⚠️ {num_rows_to_delete} record(s) will be deleted:")
-    st.dataframe(rows_to_delete)
+    st.dataframe(rows_to_delete, column_order=VISIBLE_COLUMNS)
 
     if st.button("Confirm Deletion 🗑️"):
-        new_df = df[~combined_filter]
-        st.session_state['reagents_df'] = new_df
-        new_df.to_excel(file_path, sheet_name="Template", index=False)
+        try:
+            # Rejected if one of the rows was changed by someone else meanwhile
+            table.delete(rows_to_delete.index, revisions=rows_to_delete[REVISION])
+        except ConflictError as exc:
+            st.error(f"⚠️ {exc} Please review the selection and try again.")
+            st.stop()
+        st.session_state['reagents_df_version'] = table.version
         st.success(f"✅ Deleted {num_rows_to_delete} record(s). Refreshing database...")
         st.rerun()
 
@@ -146,11 +165,11 @@ edit_cols = st.columns(len(EDIT_FIELDS))
 
 st.write("### 1. Select the single sample you wish to edit:")
 
-filtered_df = df.copy()  # DataFrame dinamico che si restringe a ogni selezione
+edit_rows = facets.all_rows()  # Righe candidate, si restringono a ogni selezione
 
 for i, field in enumerate(EDIT_FIELDS):
     # Calcola i valori validi per questo campo in base alle scelte precedenti
-    possible_values = sorted(filtered_df[field].dropna().astype(str).unique().tolist())
+    possible_values = facets.values(field, edit_rows)
     possible_values = ['-- Select a Value --'] + possible_values
 
     with edit_cols[i]:
@@ -163,10 +182,16 @@ for i, field in enumerate(EDIT_FIELDS):
 
     # Applica il filtro per restringere i valori per i campi successivi
     if selected_value != '-- Select a Value --':
-        filtered_df = filtered_df[filtered_df[field].astype(str) == selected_value]
+        edit_rows = edit_rows & facets.bitmap(field, selected_value)
 
 # Alla fine, le righe candidate da modificare sono quelle del DataFrame filtrato
-rows_to_edit = filtered_df
+rows_to_edit = df[edit_rows]
+
+
+def reset_edit_form():
+    """Forget the pinned base row; the form widgets get new keys, so they show the row again."""
+    st.session_state.pop('reagents_edit_base', None)
+    st.session_state['reagents_edit_form'] = st.session_state.get('reagents_edit_form', 0) + 1
 
 
 if len(rows_to_edit) == 1:
@@ -174,13 +199,23 @@ if len(rows_to_edit) == 1:
     edit_index = rows_to_edit.index[0]
     existing_row = rows_to_edit.iloc[0]
 
+    # Row as it was when the user selected it, i.e. what the form started from: pinned
+    # until a successful update or another row is selected, and used to merge or reject
+    # the edit if someone else changed the row meanwhile
+    edit_base = st.session_state.get('reagents_edit_base')
+    if edit_base is None or edit_base.name != edit_index:
+        reset_edit_form()
+        edit_base = existing_row
+        st.session_state['reagents_edit_base'] = edit_base
+    edit_form_id = st.session_state['reagents_edit_form']
+
     with st.form("edit_form"):
-        edit_type = st.text_input("Reagent Type", value=str(existing_row['Reagent Type']))
-        edit_supplier = st.text_input("Supplier", value=str(existing_row['Supplier']))
-        edit_name = st.text_input("Reagent Name", value=str(existing_row['Reagent Name']))
-        edit_lot = st.text_input("Lot Number", value=str(existing_row['Lot Number']))
-        edit_expiry = st.text_input("Expiry Date", value=str(existing_row['Expiry Date']))
-        edit_location = st.text_input("Storage Location", value=str(existing_row['Storage Location']))
+        edit_type = st.text_input("Reagent Type", value=str(existing_row['Reagent Type']), key=f"edit_type_text_{edit_form_id}")
+        edit_supplier = st.text_input("Supplier", value=str(existing_row['Supplier']), key=f"edit_supplier_text_{edit_form_id}")
+        edit_name = st.text_input("Reagent Name", value=str(existing_row['Reagent Name']), key=f"edit_name_text_{edit_form_id}")
+        edit_lot = st.text_input("Lot Number", value=str(existing_row['Lot Number']), key=f"edit_lot_text_{edit_form_id}")
+        edit_expiry = st.text_input("Expiry Date", value=date_text(existing_row['Expiry Date']), key=f"edit_expiry_text_{edit_form_id}")
+        edit_location = st.text_input("Storage Location", value=str(existing_row['Storage Location']), key=f"edit_location_text_{edit_form_id}")
 
         submitted = st.form_submit_button("Update Reagent")
         if submitted:
@@ -191,10 +226,20 @@ if len(rows_to_edit) == 1:
                            "Expiry Date": edit_expiry,
                            "Storage Location": edit_location}
 
-            for key, value in updated_row.items():
-                st.session_state['reagents_df'].at[edit_index, key] = value
-
-            st.session_state['reagents_df'].to_excel(file_path, sheet_name="Template", index=False)
+            invalid_dates = table.schema.invalid_dates(updated_row)
+            if invalid_dates:
+                st.error(f"⚠️ Invalid date in {', '.join(invalid_dates)}: please use YYYY-MM-DD or DD/MM/YYYY.")
+                st.stop()
+
+            try:
+                table.update(edit_index, updated_row, base=edit_base)
+            except ConflictError as exc:
+                # Next run the form starts again from the latest values of the row
+                reset_edit_form()
+                st.error(f"⚠️ {exc} Please review the latest values and try again.")
+                st.stop()
+            reset_edit_form()
+            st.session_state['reagents_df_version'] = table.version
             st.success("✅ Record updated! Refreshing database...")
             st.rerun()
 
@@ -203,3 +248,25 @@ elif len(rows_to_edit) == 0:
 else:
     st.warning(f"⚠️ {len(rows_to_edit)} records match the criteria. Please refine to exactly one.")
 
+# ======================================================================
+# --- IMPORT / EXPORT EXCEL ---
+# ======================================================================
+st.header("Import / Export Excel")
+
+with st.expander("Excel import/export"):
+    if st.button("Prepare Excel export"):
+        buffer = io.BytesIO()
+        table.export_excel(buffer)
+        st.download_button(
+            label="⬇️ Download Reagents Database (xlsx)",
+            data=buffer.getvalue(),
+            file_name=file_path,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+    import_file = st.file_uploader("Replace the database with a workbook", type=["xlsx"], key="import_xlsx")
+    if import_file and st.button("Import workbook (replaces all records)"):
+        table.import_excel(import_file)
+        st.session_state['reagents_df_version'] = table.version
+        st.success("✅ Workbook imported! Refreshing database...")
+        st.rerun()
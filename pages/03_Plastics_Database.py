@@ -1,29 +1,43 @@
 import streamlit as st
-import pandas as pd
-import os
+import io
+
+from ddlab.facets import FacetIndex
+from ddlab.storage import REVISION, ConflictError
+from ddlab.tables import open_table
 
 # Set app layout on wide
 st.set_page_config(layout="wide")
 
-# File path
+# Database served by the configured storage backend (SQLite by default)
+DATABASE = "plastics"
 file_path = "Plastics_Database.xlsx"
+table = open_table(DATABASE)
 
-# --- CACHE FUNCTION FOR DATA LOADING ---
-@st.cache_data(show_spinner="Loading database...")
-def load_data(path):
-    if os.path.exists(path):
-        return pd.read_excel(path, sheet_name="Template")
-    else:
-        columns = ["Plastic Type", "Size", "Catalog Number", "Supplier", "Quantità", "Box 96", "Box Location"]
-        df_new = pd.DataFrame(columns=columns)
-        df_new.to_excel(path, sheet_name="Template", index=False)
-        return df_new
+# --- SHARED DATA LOAD ---
+def load_data(name):
+    """
+    Returns (version, DataFrame) of the process-wide shared table.
+    Every session reads the same DataFrame; the session only keeps the version
+    it displayed, to notice changes made by other users.
+    """
+    return open_table(name).snapshot()
+
+with st.spinner("Loading database..."):
+    version, df = load_data(DATABASE)
+
+if st.session_state.get('plastics_df_version', version) != version:
+    st.toast("🔄 Database updated by another user, showing the latest data.")
+st.session_state['plastics_df_version'] = version
 
-# --- INITIAL DATA LOAD ---
-if 'plastics_df' not in st.session_state:
-    st.session_state['plastics_df'] = load_data(file_path)
+# Row revisions are internal: never shown in the tables
+VISIBLE_COLUMNS = [c for c in df.columns if c != REVISION]
 
-df = st.session_state['plastics_df']
+# Valori distinti e bitmap dei campi di filtro: costruiti una volta per versione dei dati, condivisi tra le sessioni
+@st.cache_resource(max_entries=4)
+def load_facet_index(name, version, _df):
+    return FacetIndex(_df)
+
+facets = load_facet_index(DATABASE, version, df)
 
 st.title("DDLAB Plastics Database Management Tool")
 
@@ -37,11 +51,11 @@ SEARCH_FIELDS = ["Plastic Type", "Size", "Catalog Number", "Supplier", "Box Loca
 st.write("### Choose a combination of criteria to filter by:")
 cols = st.columns(len(SEARCH_FIELDS))
 
-filtered_search_df = df.copy()
+search_rows = facets.all_rows()
 selected_search_criteria = {}
 
 for i, field in enumerate(SEARCH_FIELDS):
-    possible_values = sorted(filtered_search_df[field].dropna().astype(str).unique().tolist())
+    possible_values = facets.values(field, search_rows)
     possible_values = ['-- All Samples --'] + possible_values
     
     with cols[i]:
@@ -53,16 +67,16 @@ for i, field in enumerate(SEARCH_FIELDS):
         selected_search_criteria[field] = selected_value
     
     if selected_value != '-- All Samples --':
-        filtered_search_df = filtered_search_df[filtered_search_df[field].astype(str) == selected_value]
+        search_rows = search_rows & facets.bitmap(field, selected_value)
 
-search_results = filtered_search_df
+search_results = df[search_rows]
 
 if st.button("Apply Search Filters"):
     if search_results.empty:
         st.warning("⚠️ No plastics matched the selected criteria.")
     else:
         st.success(f"🔍 Found **{len(search_results)}** matching record(s):")
-        st.dataframe(search_results)
+        st.dataframe(search_results, column_order=VISIBLE_COLUMNS)
 
 # ======================================================================
 # --- ADD NEW ENTRY ---
@@ -91,12 +105,10 @@ with st.form("add_form"):
             "Box Location": new_location
         }
 
-        new_df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        new_df.to_excel(file_path, sheet_name="Template", index=False)
+        table.insert(new_row)
 
-        # 🔁 Refresh data cache and session
-        load_data.clear()
-        st.session_state['plastics_df'] = load_data(file_path)
+        # 🔁 Remember the version this session has written
+        st.session_state['plastics_df_version'] = table.version
 
         st.success("✅ Plastic item added! Refreshing database...")
         st.rerun()
@@ -111,15 +123,12 @@ selected_criteria = {}
 cols = st.columns(len(DEL_FIELDS))
 
 for i, field in enumerate(DEL_FIELDS):
-    unique_values = ['-- All --'] + sorted(df[field].dropna().astype(str).unique().tolist())
+    unique_values = ['-- All --'] + facets.values(field)
     with cols[i]:
         selected_value = st.selectbox(f"Select {field}:", unique_values, key=f"delete_{field}")
         selected_criteria[field] = selected_value
 
-combined_filter = pd.Series([True] * len(df))
-for field, value in selected_criteria.items():
-    if value != '-- All --':
-        combined_filter &= (df[field].astype(str) == value)
+combined_filter = facets.select(selected_criteria, any_value='-- All --')
 
 rows_to_delete = df[combined_filter]
 num_rows_to_delete = len(rows_to_delete)
@@ -128,15 +137,18 @@ if num_rows_to_delete == 0:
     st.info("No records match the selected criteria.")
 else:
     st.warning(f"⚠️ {num_rows_to_delete} record(s) will be deleted:")
-    st.dataframe(rows_to_delete)
+    st.dataframe(rows_to_delete, column_order=VISIBLE_COLUMNS)
 
     if st.button("Confirm Deletion 🗑️"):
-        new_df = df[~combined_filter]
-        new_df.to_excel(file_path, sheet_name="Template", index=False)
+        try:
+            # Rejected if one of the rows was changed by someone else meanwhile
+            table.delete(rows_to_delete.index, revisions=rows_to_delete[REVISION])
+        except ConflictError as exc:
+            st.error(f"⚠️ {exc} Please review the selection and try again.")
+            st.stop()
 
-        # 🔁 Refresh data cache and session
-        load_data.clear()
-        st.session_state['plastics_df'] = load_data(file_path)
+        # 🔁 Remember the version this session has written
+        st.session_state['plastics_df_version'] = table.version
 
         st.success(f"✅ Deleted {num_rows_to_delete} record(s). Refreshing database...")
         st.rerun()
@@ -152,10 +164,10 @@ edit_cols = st.columns(len(EDIT_FIELDS))
 
 st.write("### 1. Select the single sample you wish to edit:")
 
-filtered_df = df.copy()
+edit_rows = facets.all_rows()
 
 for i, field in enumerate(EDIT_FIELDS):
-    possible_values = sorted(filtered_df[field].dropna().astype(str).unique().tolist())
+    possible_values = facets.values(field, edit_rows)
     possible_values = ['-- Select a Value --'] + possible_values
 
     with edit_cols[i]:
@@ -167,23 +179,39 @@ for i, field in enumerate(EDIT_FIELDS):
         selected_edit_criteria[field] = selected_value
 
     if selected_value != '-- Select a Value --':
-        filtered_df = filtered_df[filtered_df[field].astype(str) == selected_value]
+        edit_rows = edit_rows & facets.bitmap(field, selected_value)
+
+rows_to_edit = df[edit_rows]
+
+def reset_edit_form():
+    """Forget the pinned base row; the form widgets get new keys, so they show the row again."""
+    st.session_state.pop('plastics_edit_base', None)
+    st.session_state['plastics_edit_form'] = st.session_state.get('plastics_edit_form', 0) + 1
 
-rows_to_edit = filtered_df
 
 if len(rows_to_edit) == 1:
     st.success("✅ One record selected for editing.")
     edit_index = rows_to_edit.index[0]
     existing_row = rows_to_edit.iloc[0]
 
+    # Row as it was when the user selected it, i.e. what the form started from: pinned
+    # until a successful update or another row is selected, and used to merge or reject
+    # the edit if someone else changed the row meanwhile
+    edit_base = st.session_state.get('plastics_edit_base')
+    if edit_base is None or edit_base.name != edit_index:
+        reset_edit_form()
+        edit_base = existing_row
+        st.session_state['plastics_edit_base'] = edit_base
+    edit_form_id = st.session_state['plastics_edit_form']
+
     with st.form("edit_form"):
-        edit_type = st.text_input("Plastic Type", value=str(existing_row['Plastic Type']))
-        edit_size = st.text_input("Size", value=str(existing_row['Size']))
-        edit_catalog = st.text_input("Catalog Number", value=str(existing_row['Catalog Number']))
-        edit_supplier = st.text_input("Supplier", value=str(existing_row['Supplier']))
-        edit_qty = st.text_input("Quantità", value=str(existing_row['Quantità']))
-        edit_box = st.text_input("Box 96", value=str(existing_row['Box 96']))
-        edit_location = st.text_input("Box Location", value=str(existing_row['Box Location']))
+        edit_type = st.text_input("Plastic Type", value=str(existing_row['Plastic Type']), key=f"edit_type_text_{edit_form_id}")
+        edit_size = st.text_input("Size", value=str(existing_row['Size']), key=f"edit_size_text_{edit_form_id}")
+        edit_catalog = st.text_input("Catalog Number", value=str(existing_row['Catalog Number']), key=f"edit_catalog_text_{edit_form_id}")
+        edit_supplier = st.text_input("Supplier", value=str(existing_row['Supplier']), key=f"edit_supplier_text_{edit_form_id}")
+        edit_qty = st.text_input("Quantità", value=str(existing_row['Quantità']), key=f"edit_qty_text_{edit_form_id}")
+        edit_box = st.text_input("Box 96", value=str(existing_row['Box 96']), key=f"edit_box_text_{edit_form_id}")
+        edit_location = st.text_input("Box Location", value=str(existing_row['Box Location']), key=f"edit_location_text_{edit_form_id}")
 
         submitted = st.form_submit_button("Update Plastic")
         if submitted:
@@ -197,14 +225,17 @@ if len(rows_to_edit) == 1:
                 "Box Location": edit_location
             }
 
-            for key, value in updated_row.items():
-                df.at[edit_index, key] = value
-
-            df.to_excel(file_path, sheet_name="Template", index=False)
+            try:
+                table.update(edit_index, updated_row, base=edit_base)
+            except ConflictError as exc:
+                # Next run the form starts again from the latest values of the row
+                reset_edit_form()
+                st.error(f"⚠️ {exc} Please review the latest values and try again.")
+                st.stop()
 
-            # 🔁 Refresh data cache and session
-            load_data.clear()
-            st.session_state['plastics_df'] = load_data(file_path)
+            reset_edit_form()
+            # 🔁 Remember the version this session has written
+            st.session_state['plastics_df_version'] = table.version
 
             st.success("✅ Record updated! Refreshing database...")
             st.rerun()
@@ -214,3 +245,25 @@ elif len(rows_to_edit) == 0:
 else:
     st.warning(f"⚠️ {len(rows_to_edit)} records match the criteria. Please refine to exactly one.")
 
+# ======================================================================
+# --- IMPORT / EXPORT EXCEL ---
+# ======================================================================
+st.header("Import / Export Excel")
+
+with st.expander("Excel import/export"):
+    if st.button("Prepare Excel export"):
+        buffer = io.BytesIO()
+        table.export_excel(buffer)
+        st.download_button(
+            label="⬇️ Download Plastics Database (xlsx)",
+            data=buffer.getvalue(),
+            file_name=file_path,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+    import_file = st.file_uploader("Replace the database with a workbook", type=["xlsx"], key="import_xlsx")
+    if import_file and st.button("Import workbook (replaces all records)"):
+        table.import_excel(import_file)
+        st.session_state['plastics_df_version'] = table.version
+        st.success("✅ Workbook imported! Refreshing database...")
+        st.rerun()
@@ -1,91 +1,135 @@
+import io
+from contextlib import closing
+
 import streamlit as st
 import pandas as pd
 
-# -------------------------------
-# Utility check function
-# -------------------------------
-def has_space_or_hyphen(value):
-    if pd.isna(value):
-        return False
-    return (" " in str(value)) or ("-" in str(value))
+from ddlab.cache import LRUCache, content_key
+from ddlab.data_quality import NUCLEOTIDES
+from ddlab.index_kits import KitLibrary, add_kit, library_signature
+from ddlab.index_matching import ENGINES, I5_ORIENTATIONS, INDEX_WORKERS, filter_matching_pairs, iter_lanes
+from ddlab.lane_optimizer import OPTIMIZER_COLUMNS, LanePlan
+from ddlab.sample_sheet import length_summary, missing_columns, prepare_sheet, quality_checks
 
-# -------------------------------
-# Character match function
-# -------------------------------
-def char_matches(str1, str2):
-    if pd.isna(str1) or pd.isna(str2) or str1 == "" or str2 == "":
-        return 0
-    min_len = min(len(str1), len(str2))
-    return sum(str1[i] == str2[i] for i in range(min_len))
+# Righe mostrate con le celle evidenziate nei controlli di qualità
+MAX_HIGHLIGHTED_ROWS = 1000
 
-# -------------------------------
-# Filter matching pairs function
-# -------------------------------
-def filter_matching_pairs(df):
-    result = []
-
-    for lane in df["Lane"].unique():
-        lane_data = df[df["Lane"] == lane].reset_index(drop=True)
-
-        for i in range(len(lane_data)):
-            for j in range(i + 1, len(lane_data)):
-                str1 = str(lane_data.loc[i, "index7"])
-                str2 = str(lane_data.loc[j, "index7"])
-                len1 = len(str1)
-                len2 = len(str2)
-
-                matches = char_matches(str1, str2)
-                min_length = min(len1, len2)
-
-                if min_length == 12:
-                    match_threshold = 11
-                elif min_length == 10:
-                    match_threshold = 9
-                elif min_length == 8:
-                    match_threshold = 7
-                else:
-                    match_threshold = 5
-
-                if matches >= match_threshold:
-                    result.append({
-                        "lane": lane,
-                        "GCF_ID_string1": lane_data.loc[i, "CGF_ID"],
-                        "GCF_ID_string2": lane_data.loc[j, "CGF_ID"],
-                        "Sample_ID_1": lane_data.loc[i, "Sample_ID"],
-                        "Sample_ID_2": lane_data.loc[j, "Sample_ID"],
-                        "index7_string1": str1,
-                        "index7_string2": str2,
-                        "length1": len1,
-                        "length2": len2,
-                        "matches": matches
-                    })
-
-    return pd.DataFrame(result)
+# Fogli letti e analisi già fatte, per hash del file caricato + impostazioni
+RESULTS_CACHE_ENTRIES = 32
+
+# Libreria dei kit di indici: ricaricata solo quando cambia un file dei kit
+@st.cache_resource(max_entries=4)
+def load_kit_library(signature):
+    return KitLibrary()
+
+# Cache condivisa tra le sessioni: rerun e ricaricamenti dello stesso file non rifanno l'analisi
+@st.cache_resource
+def load_results_cache():
+    return LRUCache(max_entries=RESULTS_CACHE_ENTRIES)
+
+def read_raw_sheet(file_bytes):
+    df = pd.read_excel(io.BytesIO(file_bytes))
+    df.columns = df.columns.str.strip()
+    return df
 
 # -------------------------------
 # Streamlit app
 # -------------------------------
 st.title("🔍 Index Matching Tool")
 
+kit_library = load_kit_library(library_signature())
+results_cache = load_results_cache()
+
+with st.expander("🧰 Index Kit Library"):
+    st.caption("Known index plates (Well, index7, index5). Samples using a kit well are checked by lookup "
+               "in precomputed distance matrices; only custom indexes are compared live.")
+    if kit_library.names:
+        st.dataframe(kit_library.summary(), hide_index=True)
+    else:
+        st.info("No kits in the library yet.")
+    kit_file = st.file_uploader("Add kit (CSV/XLSX with Well, index7, index5 columns)", type=["csv", "xlsx"])
+    kit_name = st.text_input("Kit name")
+    if st.button("➕ Add Kit"):
+        if kit_file is None or not kit_name.strip():
+            st.error("⚠️ Please upload a kit file and enter a kit name.")
+        else:
+            try:
+                add_kit(kit_name.strip(), kit_file)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+                st.stop()
+            load_kit_library(library_signature()).precompute()
+            st.success(f"✅ Kit {kit_name.strip()} added to the library.")
+            st.rerun()
+
+mode = st.radio("Mode:", ["Check sample sheet", "Optimize lane assignment"], horizontal=True)
+
 uploaded_file = st.file_uploader("📂 Upload Sequencing Sample List", type=["xlsx"])
 
+# -------------------------------
+# Lane assignment optimizer
+# -------------------------------
 if uploaded_file:
-    df = pd.read_excel(uploaded_file)
+    file_bytes = uploaded_file.getvalue()
 
-    # Rimuove spazi extra dai nomi delle colonne
-    df.columns = df.columns.str.strip()
+if uploaded_file and mode == "Optimize lane assignment":
+    df = results_cache.get_or_compute(content_key(file_bytes, "raw sheet"), lambda: read_raw_sheet(file_bytes))
+    missing_cols = [col for col in OPTIMIZER_COLUMNS if col not in df.columns]
+    if missing_cols:
+        st.error(f"❌ Missing required columns in file: {', '.join(missing_cols)}")
+        st.stop()
+
+    st.subheader("🧮 Lane Assignment by Capture Pool")
+    st.caption("Capture pools (Pool_Cattura) are placed on lanes so that no lane holds two samples "
+               "reported by the Index Matching checks, within the lane capacities.")
+    col1, col2 = st.columns(2)
+    n_lanes = col1.number_input("Lanes:", min_value=1, max_value=16, value=8, step=1)
+    capacity = col2.number_input("Max samples per lane:", min_value=1,
+                                 value=max(1, -(-len(df) // int(n_lanes))), step=1)
+
+    try:
+        plan = results_cache.get_or_compute(content_key(file_bytes, "lane plan", int(n_lanes), int(capacity)),
+                                            lambda: LanePlan(df, [int(capacity)] * int(n_lanes)))
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        st.stop()
+
+    collisions = plan.collisions()
+    st.dataframe(plan.summary(), hide_index=True)
+    over_capacity = plan.over_capacity()
+    if over_capacity:
+        st.error(f"❌ The capture pools cannot be packed within {int(capacity)} samples per lane: "
+                 f"lane(s) {', '.join(str(lane) for lane in over_capacity)} are over capacity. "
+                 "Increase the capacity or the number of lanes.")
+    if collisions.empty:
+        st.success("✅ No index collisions in the proposed lanes.")
+    else:
+        within = int(collisions["Within pool"].sum())
+        st.warning(f"⚠️ {len(collisions)} colliding pairs left in the proposed lanes "
+                   f"({within} inside a single capture pool, which no lane assignment can separate).")
+        st.dataframe(collisions, hide_index=True)
+
+    buffer = io.BytesIO()
+    plan.assigned_sheet().to_excel(buffer, index=False)
+    st.download_button(
+        label="⬇️ Download Sample List with proposed lanes (xlsx)",
+        data=buffer.getvalue(),
+        file_name="sample_list_lanes.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    st.stop()
+
+if uploaded_file:
+    # Nomi delle colonne ripuliti, Excel_Row e string_length (stessi controlli della riga di comando)
+    df = results_cache.get_or_compute(content_key(file_bytes, "sheet"),
+                                      lambda: prepare_sheet(pd.read_excel(io.BytesIO(file_bytes))))
 
     # Controllo colonne richieste
-    required_columns = ["Lane", "index7", "CGF_ID", "Sample_ID", "Pool_Cattura", "CGF_Pool_ID"]
-    missing_cols = [col for col in required_columns if col not in df.columns]
+    missing_cols = missing_columns(df)
     if missing_cols:
         st.error(f"❌ Missing required columns in file: {', '.join(missing_cols)}")
         st.stop()
 
-    # Aggiunge info utili
-    df["Excel_Row"] = df.index + 2  
-    df["string_length"] = df["index7"].astype(str).str.len()
-
     # Preview input
     st.subheader("📊 Input Data Preview")
     st.dataframe(df.head())
@@ -94,7 +138,84 @@ if uploaded_file:
     # Matching Pairs
     # -------------------------------
     st.subheader("🔗 Matching Pairs")
-    matching_pairs_df = filter_matching_pairs(df)
+    engine = st.selectbox(
+        "Collision search engine:",
+        ENGINES,
+        help="'pigeonhole' only compares pairs that can reach the threshold (faster on very large lanes); "
+             "'auto' uses it for lanes with thousands of samples. All engines give the same pairs. "
+             "With the BarcodeMismatches recommendation every pair is compared, whatever the engine."
+    )
+    i5_orientation = st.selectbox(
+        "i5 orientation:",
+        list(I5_ORIENTATIONS),
+        format_func=lambda o: {"forward": "Forward (as in the sheet)",
+                               "reverse_complement": "Reverse complement",
+                               "mixed": "Mixed kits (forward and reverse complement)"}[o],
+        help="How i5 is read on the instrument. 'Mixed kits' flags i5 collisions in any orientation combination."
+    )
+
+    recommend_mismatches = st.checkbox(
+        "Recommend BarcodeMismatches settings",
+        help="Also finds every pair within 4 mismatches on i7, needed to pick the largest safe "
+             "BarcodeMismatchesIndex1/Index2. These are a large share of all pairs, so every pair of the "
+             "lane is compared: slower on lanes with thousands of samples."
+    )
+
+    workers = st.number_input(
+        "Worker processes:", min_value=1, max_value=64, value=INDEX_WORKERS, step=1,
+        help="Lanes are analysed in parallel on large sheets. 1 = sequential; small sheets are always sequential."
+    )
+
+    # Confronto a coppie calcolato una sola volta per lane: usato dalle coppie e dal report.
+    # Kit e numero di processi non cambiano il risultato: non fanno parte della chiave.
+    analysis_key = content_key(file_bytes, "analysis", engine, i5_orientation, recommend_mismatches)
+    cached = results_cache.get(analysis_key)
+    if cached is not None:
+        lanes, matching_pairs_df = cached
+        complete = True
+    else:
+        # Analisi lane per lane: i risultati parziali restano in session_state se l'utente annulla
+        run = st.session_state.get("index_matching_run")
+        if run is None or run["key"] != analysis_key:
+            run = st.session_state["index_matching_run"] = {"key": analysis_key, "lanes": [], "cancelled": False}
+        total_lanes = len(df["Lane"].unique())
+
+        if run["cancelled"]:
+            st.warning(f"⏹️ Analysis cancelled after {len(run['lanes'])} of {total_lanes} lanes: "
+                       "the results below are partial.")
+            if st.button("▶️ Resume analysis"):
+                run["cancelled"] = False
+                st.rerun()
+        elif total_lanes and st.button("⏹️ Cancel analysis"):
+            run["cancelled"] = True
+            st.rerun()
+
+        # Un foglio con le sole intestazioni non ha lane da confrontare
+        if not run["cancelled"] and total_lanes:
+            progress = st.progress(len(run["lanes"]) / total_lanes, text="Comparing lanes...")
+            live_table = st.empty()
+            streamed = [pairs for pairs in (lane.matching_pairs() for lane in run["lanes"]) if not pairs.empty]
+            with closing(iter_lanes(df, engine=engine, barcode_mismatches=recommend_mismatches,
+                                    i5_orientation=i5_orientation,
+                                    kits=kit_library if kit_library.names else None, workers=int(workers),
+                                    start=len(run["lanes"]))) as stream:
+                for lane_analysis in stream:
+                    run["lanes"].append(lane_analysis)
+                    pairs = lane_analysis.matching_pairs()
+                    if not pairs.empty:
+                        streamed.append(pairs)
+                        live_table.dataframe(pd.concat(streamed, ignore_index=True))
+                    progress.progress(len(run["lanes"]) / total_lanes,
+                                      text=f"Lane {lane_analysis.lane} done ({len(run['lanes'])}/{total_lanes})")
+            progress.empty()
+            live_table.empty()
+
+        lanes = run["lanes"]
+        matching_pairs_df = filter_matching_pairs(df, lanes=lanes)
+        complete = len(lanes) == total_lanes
+        if complete:
+            results_cache.put(analysis_key, (lanes, matching_pairs_df))
+            del st.session_state["index_matching_run"]
 
     if not matching_pairs_df.empty:
         st.dataframe(matching_pairs_df)
@@ -106,7 +227,7 @@ if uploaded_file:
             file_name="matching_pairs.csv",
             mime="text/csv"
         )
-    else:
+    elif complete:
         st.info("✅ No matching pairs found with the given thresholds.")
 
     # -------------------------------
@@ -114,16 +235,19 @@ if uploaded_file:
     # -------------------------------
     st.subheader("🧪 Data Quality Checks")
 
-    duplicated_cgf = df[df["CGF_ID"].duplicated(keep=False)]
-    duplicated_sample = df[df["Sample_ID"].duplicated(keep=False)]
-
-    total_format_issues = sum(df[col].apply(has_space_or_hyphen).sum() for col in df.columns)
+    quality = results_cache.get_or_compute(content_key(file_bytes, "quality"), lambda: quality_checks(df))
+    duplicated_cgf = quality["duplicated_cgf"]
+    duplicated_sample = quality["duplicated_sample"]
+    total_format_issues = quality["total_format_issues"]
+    report = quality["report"]
 
     st.markdown(f"""
     **Summary:**
     - 🧬 ID CGF Duplicati: **{len(duplicated_cgf)}**
     - 🧪 Sample ID Duplicati: **{len(duplicated_sample)}**
     - ⚠️ Celle con spazi o trattini: **{total_format_issues}**
+    - 🔤 Indici con caratteri non validi (solo {NUCLEOTIDES}): **{report.cells("Invalid index characters")}**
+    - 📏 Indici con lunghezza diversa dalla lane: **{report.cells("Index length differs in lane")}**
     """)
 
     if not duplicated_cgf.empty:
@@ -136,54 +260,43 @@ if uploaded_file:
 
     if total_format_issues > 0:
         st.warning("Alcune celle contengono spazi o trattini (vedi DataFrame completo):")
-        format_issues_df = df[df.apply(lambda row: any(has_space_or_hyphen(row[col]) for col in df.columns), axis=1)]
-        st.dataframe(format_issues_df)
+        st.dataframe(quality["format_issues"])
+
+    issue_rows = report.rows()
+    if issue_rows.any():
+        with st.expander(f"🖍️ Rows with issues, cells highlighted ({int(issue_rows.sum())})"):
+            st.dataframe(report.summary(), hide_index=True)
+            # Lo styling è cella per cella: evidenziate solo le prime righe
+            shown = issue_rows & (issue_rows.cumsum() <= MAX_HIGHLIGHTED_ROWS)
+            if issue_rows.sum() > MAX_HIGHLIGHTED_ROWS:
+                st.caption(f"First {MAX_HIGHLIGHTED_ROWS} rows with issues shown.")
+            st.dataframe(report.highlighted(shown))
 
     # -------------------------------
     # Lane-specific demultiplexing report
     # -------------------------------
     st.subheader("🧾 Demultiplexing Recommendations by Lane")
+    if not complete:
+        st.caption("Partial report: only the lanes analysed before cancelling.")
 
-    for lane in df["Lane"].unique():
-        lane_data = df[df["Lane"] == lane].reset_index(drop=True)
-
-        # Lunghezze indici index7/index5
-        index7_lengths = lane_data["index7"].astype(str).str.len()
-        index5_lengths = lane_data["index5"].astype(str).str.len() if "index5" in lane_data.columns else pd.Series(dtype=int)
-
-        length_summary_dict = {}
-        all_lengths = sorted(set(index7_lengths.tolist() + index5_lengths.tolist()))
-        for length in all_lengths:
-            in_index7 = sum(index7_lengths == length)
-            in_index5 = sum(index5_lengths == length)
-            if in_index5 > 0:
-                length_summary_dict[length] = f"2x{length}"
-            else:
-                length_summary_dict[length] = f"1x{length}"
-
-        length_summary = ", ".join(length_summary_dict.values())
-
-        status = "✅ Demultiplexing non stringente"
-        note = []
-
-        for i in range(len(lane_data)):
-            for j in range(i + 1, len(lane_data)):
-                str1 = str(lane_data.loc[i, "index7"])
-                str2 = str(lane_data.loc[j, "index7"])
-                matches = char_matches(str1, str2)
-                mismatches = abs(len(str1) - matches)
-
-                if str1 == str2:
-                    status = "❌ Errore: stessi indici presenti"
-                    note.append(f"Samples {lane_data.loc[i,'Sample_ID']} and {lane_data.loc[j,'Sample_ID']} hanno lo stesso indice.")
-                elif mismatches == 1 and status != "❌ Errore: stessi indici presenti":
-                    status = "⚠️ Demultiplexing stringente"
-                    note.append(f"Samples {lane_data.loc[i,'Sample_ID']} and {lane_data.loc[j,'Sample_ID']} hanno 1 mismatch.")
-
-        st.markdown(f"**Lane {lane}:** {status}  |  **Index lengths:** {length_summary}")
+    for lane_analysis in lanes:
+        status, note = lane_analysis.demux_status()
+
+        st.markdown(f"**Lane {lane_analysis.lane}:** {status}  |  **Index lengths:** {length_summary(lane_analysis.data)}")
         if note:
             for n in note:
                 st.markdown(f"- {n}")
 
+    # -------------------------------
+    # Dual-index BarcodeMismatches recommendation
+    # -------------------------------
+    if recommend_mismatches:
+        st.subheader("🧬 Dual-Index Collisions & BarcodeMismatches")
+        if not complete:
+            st.caption("Partial report: only the lanes analysed before cancelling.")
+        st.caption("Largest BarcodeMismatchesIndex1/Index2 per lane such that no read can match two samples "
+                   "(i7 and i5 distances combined). ❌ = samples with the same i7+i5 in the lane.")
+        st.dataframe(pd.DataFrame([lane_analysis.barcode_mismatches() for lane_analysis in lanes]), hide_index=True)
+
 else:
     st.info("👆 Upload an Excel file to start the analysis.")
@@ -1,26 +1,92 @@
+import io
+import os
+
 import streamlit as st
-import pandas as pd
-import numpy as np
+
+from ddlab.cache import LRUCache, content_key
+from ddlab.history import RecapHistory, run_problems
+from ddlab.recap import LIBRARY_COLUMNS, RECAP_LOADER_VERSION, SORT_KEYS, StatsCube, library_stats, missing_stat_columns, read_recap
 
 st.set_page_config(layout="wide", page_title="NovaSeqX - Statistiche Librerie")
 
+default_path = "NovaSeqX_Sequenziamento_Riassunto_Totale.xlsx"
+history = RecapHistory(default_path)
+
+# File caricati da confrontare affiancati, e limiti della cache dei file caricati
+MAX_COMPARED_UPLOADS = 3
+UPLOAD_CACHE_ENTRIES = 16
+UPLOAD_CACHE_BYTES = 512 * 1024 ** 2
+
+# Storico = workbook (dal sidecar Arrow) + run aggiunti; la versione cambia con entrambi
 @st.cache_data
-def load_data(path):
-    return pd.read_excel(path)
+def load_data(version):
+    return history.frame()
+
+# Statistiche materializzate una volta per versione: tipo di libreria e ordinamento sono solo viste
+@st.cache_resource(max_entries=4)
+def load_stats_cube(version, library_col):
+    return StatsCube(history.stats(library_col))
+
+# Fogli caricati e loro statistiche per hash del contenuto: un click non rilegge l'xlsx
+@st.cache_resource
+def load_upload_cache():
+    return LRUCache(max_entries=UPLOAD_CACHE_ENTRIES, max_bytes=UPLOAD_CACHE_BYTES)
+
+upload_cache = load_upload_cache()
+
+def load_upload(file_bytes):
+    return upload_cache.get_or_compute(content_key(file_bytes, "recap", RECAP_LOADER_VERSION),
+                                       lambda: read_recap(io.BytesIO(file_bytes)))
+
+def upload_stats_cube(file_bytes, df, library_col):
+    return upload_cache.get_or_compute(content_key(file_bytes, "stats cube", RECAP_LOADER_VERSION, library_col),
+                                       lambda: StatsCube(library_stats(df, library_col)))
 
 # --- Caricamento dati ---
 st.title("NovaSeqX Riassunto Totale")
-uploaded = st.file_uploader("Carica il file Excel (predefinito incluso)", type=["xlsx", "xls"])
-default_path = "NovaSeqX_Sequenziamento_Riassunto_Totale.xlsx"
-df = pd.read_excel(uploaded) if uploaded else load_data(default_path)
-df.columns = df.columns.str.strip()
-
-if df.empty:
-    st.error("Il file caricato è vuoto o non contiene dati validi.")
-    st.stop()
+uploads = st.file_uploader("Carica il file Excel (predefinito incluso); più file vengono confrontati affiancati",
+                           type=["xlsx", "xls"], accept_multiple_files=True)
+if len(uploads) > MAX_COMPARED_UPLOADS:
+    st.warning(f"Si possono confrontare al massimo {MAX_COMPARED_UPLOADS} file: vengono usati i primi {MAX_COMPARED_UPLOADS}.")
+    uploads = uploads[:MAX_COMPARED_UPLOADS]
+
+# --- Aggiunta di un nuovo run allo storico ---
+with st.expander("➕ Aggiungi un run allo storico"):
+    st.caption(f"Run già aggiunti: {', '.join(history.runs()) or 'nessuno'}")
+    run_file = st.file_uploader("Export del nuovo run (xlsx)", type=["xlsx", "xls"], key="run_export")
+    replace_run = st.checkbox("Sostituisci un run già aggiunto con la stessa FlowCell")
+    if run_file and st.button("Aggiungi allo storico"):
+        run = read_recap(run_file)
+        problems = run_problems(run)
+        if problems:
+            st.error("Il run non può essere aggiunto: " + "; ".join(problems))
+        else:
+            try:
+                groups = history.add_run(run, replace=replace_run)
+                st.success(f"Aggiunte {len(run)} righe ({', '.join(sorted(run['FlowCell'].astype(str).unique()))}); "
+                           f"statistiche ricalcolate per {groups} gruppi Pool/Lane.")
+            except ValueError as e:
+                st.error(str(e))
+
+# Dati da mostrare: lo storico oppure i file caricati, {nome: (bytes, DataFrame)}
+history_version = None if uploads else history.version()
+if uploads:
+    datasets = {}
+    for upload in uploads:
+        file_bytes = upload.getvalue()
+        name = upload.name if upload.name not in datasets else f"{upload.name} ({len(datasets) + 1})"
+        datasets[name] = (file_bytes, load_upload(file_bytes))
+else:
+    datasets = {"Storico": (None, load_data(history_version))}
+
+for name, (_, df) in datasets.items():
+    if df.empty:
+        st.error(f"Il file caricato è vuoto o non contiene dati validi ({name}).")
+        st.stop()
 
 # --- Selezione colonna libreria + ordinamento ---
-allowed_library_cols = [c for c in df.columns if c in ['Type', 'Library_Kit']]
+frames = [df for _, df in datasets.values()]
+allowed_library_cols = [c for c in frames[0].columns if c in LIBRARY_COLUMNS and all(c in df.columns for df in frames)]
 if not allowed_library_cols:
     st.error("Nessuna delle colonne 'Type', 'Library_Kit' è presente nel file.")
     st.stop()
@@ -28,78 +94,31 @@ if not allowed_library_cols:
 col_filt, col_sort = st.columns([1, 1])
 with col_filt:
     library_col = st.selectbox("Colonna che contiene il tipo di libreria", allowed_library_cols)
-    library_values = sorted(df[library_col].dropna().unique().tolist())
+    library_values = sorted(set().union(*(df[library_col].dropna().unique().tolist() for df in frames)))
     chosen_library = st.selectbox("Scegli il tipo di libreria da analizzare", library_values)
 
 with col_sort:
-    sort_options = ["Pool", "Pool (numerico)", "Lane", "Conc_caricamento_1x (pM) (median)"]
-    sort_by = st.selectbox("Ordina la tabella per", sort_options)
+    sort_by = st.selectbox("Ordina la tabella per", list(SORT_KEYS))
     sort_ascending = st.radio("Ordine", ["Crescente", "Decrescente"]) == "Crescente"
     aggiorna = st.button("🔄 Applica ordinamento")
 
 # --- Colonne statistiche ---
-def safe_median(series):
-    vals = pd.to_numeric(series, errors='coerce').dropna()
-    return float(np.nanmedian(vals)) if not vals.empty else np.nan
-
-columns_map = {
-    'RT/Tape': 'RT/Tape_Ratio',
-    'RT/Qubit': 'RT/Qubit_Ratio',
-    'Conc 1x': 'Conc_caricamento_1x (pM)',
-    '% Library Lane': '%_Library_Lane',
-    'Fragments Produced': '#fragments Produced sample',
-    'Fragments Assigned': '#fragments Assigned_sample'
-}
-missing = [label for label, col in columns_map.items() if col not in df.columns]
-if missing:
-    st.warning(f"Mancano alcune colonne: {missing}. Le statistiche correlate non saranno calcolate.")
+for name, (_, df) in datasets.items():
+    missing = missing_stat_columns(df)
+    if missing:
+        source = f" in {name}" if len(datasets) > 1 else ""
+        st.warning(f"Mancano alcune colonne{source}: {missing}. Le statistiche correlate non saranno calcolate.")
 
 # --- Costruzione tabella dettagliata ---
-groups = []
-by = df.groupby(['Pool', 'Lane'])
-for (pool, lane), grp in by:
-    for libtype, subgrp in grp.groupby(library_col):
-        entry = {
-            "Pool": pool,
-            "Lane": lane,
-            "Library_Type": libtype,
-            "%_Library_Lane (median)": safe_median(subgrp.get(columns_map['% Library Lane'], np.nan)),
-            "Conc_caricamento_1x (pM)": safe_median(subgrp.get(columns_map['Conc 1x'], np.nan))
-        }
-
-        # Altri tipi nella stessa Lane
-        other_libs = grp[grp[library_col] != libtype]
-        if not other_libs.empty and columns_map['% Library Lane'] in df.columns:
-            lib_summaries = []
-            for other_type, other_grp in other_libs.groupby(library_col):
-                median_pct = safe_median(other_grp[columns_map['% Library Lane']])
-                lib_summaries.append(f"{other_type}: {median_pct:.2f}%")
-            entry["Altri tipi nella stessa Lane (%_Library_Lane)"] = "; ".join(lib_summaries)
-        else:
-            entry["Altri tipi nella stessa Lane (%_Library_Lane)"] = ""
-
-        # Fragments ratio
-        if columns_map['Fragments Produced'] in df.columns and columns_map['Fragments Assigned'] in df.columns:
-            produced = pd.to_numeric(subgrp[columns_map['Fragments Produced']], errors='coerce').fillna(0).sum()
-            assigned = pd.to_numeric(subgrp[columns_map['Fragments Assigned']], errors='coerce').fillna(0).sum()
-            entry['% Production'] = (produced / assigned * 100.0) if assigned > 0 else np.nan
-        else:
-            entry['% Production'] = np.nan
-
-        groups.append(entry)
-
-result_df = pd.DataFrame(groups)
+# Conversione numerica una sola volta e un solo groupby per (Pool, Lane, tipo di libreria)
+# (per lo storico: statistiche salvate, aggiornate solo per i gruppi dei run aggiunti)
+stats_cubes = {
+    name: upload_stats_cube(file_bytes, df, library_col) if uploads else load_stats_cube(history_version, library_col)
+    for name, (file_bytes, df) in datasets.items()
+}
 
 # --- Filtro e visualizzazione tabella filtrata ---
 if aggiorna:
-    result_df_filtered = result_df[result_df["Library_Type"] == chosen_library].copy()
-
-    if sort_by == "Pool (numerico)":
-        result_df_filtered['Pool_num'] = result_df_filtered['Pool'].str.extract(r'(\d+)').astype(float)
-        result_df_filtered = result_df_filtered.sort_values(by='Pool_num', ascending=sort_ascending)
-    else:
-        result_df_filtered = result_df_filtered.sort_values(by=sort_by, ascending=sort_ascending)
-
     st.markdown("### Statistiche dettagliate per Pool + Lane per il tipo selezionato")
     st.markdown("""
         <style>
@@ -114,13 +133,20 @@ if aggiorna:
         </style>
     """, unsafe_allow_html=True)
 
-    st.markdown(result_df_filtered.to_html(classes='compact-table', index=False), unsafe_allow_html=True)
-
-    st.download_button(
-        "Scarica le statistiche filtrate (CSV)",
-        data=result_df_filtered.to_csv(index=False).encode('utf-8'),
-        file_name='library_stats_filtrate.csv'
-    )
+    for column, (name, stats_cube) in zip(st.columns(len(stats_cubes)), stats_cubes.items()):
+        result_df_filtered = stats_cube.view(chosen_library, sort_by, sort_ascending)
+        with column:
+            if len(stats_cubes) > 1:
+                st.markdown(f"**{name}**")
+            st.markdown(result_df_filtered.to_html(classes='compact-table', index=False), unsafe_allow_html=True)
+
+            suffix = f"_{os.path.splitext(name)[0]}" if len(stats_cubes) > 1 else ""
+            st.download_button(
+                "Scarica le statistiche filtrate (CSV)",
+                data=result_df_filtered.to_csv(index=False).encode('utf-8'),
+                file_name=f'library_stats_filtrate{suffix}.csv',
+                key=f"download_{name}"
+            )
 
 st.markdown("---")
 st.caption("Script generato automaticamente — adattalo se le intestazioni delle colonne nel tuo file differiscono da quelle usate qui.")
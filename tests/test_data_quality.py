@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from ddlab.data_quality import IndexAlphabet, run_rules
+
+
+def test_index_alphabet_skips_missing_cells():
+    df = pd.DataFrame({
+        "index7": ["ACGTACGT", "ACGTACGA", "ACGT-CGT", "ACGTNCGT"],
+        "index5": [None, np.nan, "TTGGCCAA", "TTGGXCAA"],
+    })
+    mask = IndexAlphabet().mask(df)
+    assert mask["index7"].tolist() == [False, False, True, False]
+    assert mask["index5"].tolist() == [False, False, False, True]
+
+
+def test_single_index_samples_are_not_reported():
+    df = pd.DataFrame({"Lane": [1, 1], "index7": ["ACGTACGT", "TTGGCCAA"], "index5": [None, None]})
+    report = run_rules(df)
+    assert report.cells("Invalid index characters") == 0
+    assert not report.rows().any()
@@ -0,0 +1,50 @@
+import os
+
+import pandas as pd
+import pytest
+
+from ddlab import history as history_module
+from ddlab.history import RecapHistory
+from ddlab.recap import COLUMNS_MAP, typed_recap
+
+
+def _rows(flowcell, pools, types):
+    df = pd.DataFrame({"FlowCell": flowcell, "Pool": pools, "Lane": 1, "Type": types})
+    for i, col in enumerate(COLUMNS_MAP.values()):
+        df[col] = float(i + 1)
+    return df
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _rows("FC1", ["X1", "X1"], ["WGS", "RNA"]).to_excel("recap.xlsx", index=False)
+    return RecapHistory("recap.xlsx", "history")
+
+
+def test_add_run_with_numeric_pool(history):
+    run = typed_recap(_rows("FC2", [7, 7], ["WGS", "RNA"]))
+    assert run["Pool"].dtype == "int64"
+    assert history.add_run(run) == 1
+    assert history.runs() == ["FC2"]
+    stats = history.stats("Type")
+    assert sorted(stats["Pool"].unique()) == ["7", "X1"]
+    assert len(stats) == 4
+
+
+def test_failed_add_run_leaves_no_partition(history, monkeypatch):
+    history.stats("Type")
+    write_arrow = history_module._write_arrow
+
+    def fail_on_stats(df, path):
+        # The run partition is written, then saving its statistics fails
+        if path.startswith(history.stats_dir):
+            raise OSError("disk full")
+        write_arrow(df, path)
+
+    with monkeypatch.context() as patch, pytest.raises(OSError):
+        patch.setattr(history_module, "_write_arrow", fail_on_stats)
+        history.add_run(typed_recap(_rows("FC2", ["X2"], ["WGS"])))
+    assert history.runs() == []
+    assert not os.listdir(history.runs_dir)
+    assert len(history.stats("Type")) == 2
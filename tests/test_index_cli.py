@@ -0,0 +1,23 @@
+import pandas as pd
+
+from ddlab.index_cli import main
+
+
+def _sheet(path, indexes):
+    pd.DataFrame({"Lane": 1, "index7": indexes, "index5": indexes, "CGF_ID": range(len(indexes)),
+                  "Sample_ID": [f"S{i}" for i in range(len(indexes))], "Pool_Cattura": "P",
+                  "CGF_Pool_ID": "X"}).to_excel(path, index=False)
+
+
+def test_failed_sheet_is_reported_and_the_batch_goes_on(tmp_path):
+    _sheet(tmp_path / "a.xlsx", ["ACGTACGT", "ACGTACGA", "TTTTCCCC"])
+    # More than 255 distinct index characters: the analysis itself fails
+    _sheet(tmp_path / "b.xlsx", ["".join(chr(0x400 + 4 * i + k) for k in range(4)) for i in range(80)])
+    assert main([str(tmp_path), "--workers", "1"]) == 1
+
+    reports = tmp_path / "index_matching_reports"
+    summary = pd.read_csv(reports / "summary.csv").set_index("Sheet")
+    assert summary.loc["a.xlsx", "Matching pairs"] == 1
+    assert pd.isna(summary.loc["a.xlsx", "Error"])
+    assert "255" in summary.loc["b.xlsx", "Error"]
+    assert sorted(p.name for p in reports.iterdir()) == ["a.matching_pairs.csv", "a.report.json", "summary.csv"]
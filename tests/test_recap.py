@@ -0,0 +1,10 @@
+import numpy as np
+import pandas as pd
+
+from ddlab.recap import typed_recap
+
+
+def test_typed_recap_keeps_empty_cells_missing():
+    df = typed_recap(pd.DataFrame({" Pool ": ["P1", None, 3, np.nan], "Lane": [1, 2, 3, 4]}))
+    assert df["Pool"].isna().tolist() == [False, True, False, True]
+    assert df["Pool"].dropna().tolist() == ["P1", "3"]
@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from ddlab import sidecar
+from ddlab.sidecar import cached_frame
+
+
+def test_new_loader_version_replaces_the_old_sidecars(tmp_path):
+    workbook = tmp_path / "recap.xlsx"
+    pd.DataFrame({"Pool": ["P1"]}).to_excel(workbook, index=False)
+    other = tmp_path / "other.xlsx"
+    pd.DataFrame({"Pool": ["P2"]}).to_excel(other, index=False)
+    cache = str(tmp_path / "cache")
+
+    cached_frame(str(workbook), pd.read_excel, tag="v1", cache_dir=cache)
+    cached_frame(str(other), pd.read_excel, tag="v1", cache_dir=cache)
+    df = cached_frame(str(workbook), pd.read_excel, tag="v2", cache_dir=cache)
+
+    assert df["Pool"].tolist() == ["P1"]
+    sidecars = sorted(file for file in os.listdir(cache) if file.endswith(".arrow"))
+    assert [file.rsplit(".", 2)[0] for file in sidecars] == ["other.xlsx.v1", "recap.xlsx.v2"]
+
+
+def test_sidecars_left_by_an_old_loader_version_are_removed_on_read(tmp_path, monkeypatch):
+    workbook = tmp_path / "recap.xlsx"
+    pd.DataFrame({"Pool": ["P1"]}).to_excel(workbook, index=False)
+    cache = tmp_path / "cache"
+    cached_frame(str(workbook), pd.read_excel, tag="v2", cache_dir=str(cache))
+    current = next(cache.glob("*.arrow"))
+    # Left by an older release, which already wrote the v2 sidecar without removing it
+    stale = cache / current.name.replace(".v2.", ".v1.")
+    stale.write_bytes(current.read_bytes())
+    monkeypatch.setattr(sidecar, "_cleaned", set())
+
+    assert cached_frame(str(workbook), pd.read_excel, tag="v2", cache_dir=str(cache))["Pool"].tolist() == ["P1"]
+    assert sorted(cache.glob("*.arrow")) == [current]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from ddlab.storage import DATABASES, REVISION, ConflictError, ExcelStorage, JournalExcelStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = ExcelStorage("plastics", str(tmp_path / "plastics.xlsx"), "Template", DATABASES["plastics"]["columns"])
+    for i in range(3):
+        storage.insert({"Plastic Type": f"T{i}", "Size": str(i)})
+    return storage
+
+
+def test_excel_rejects_changes_to_a_shifted_row(storage):
+    seen = storage.load()
+    storage.delete([0])  # T2 is now at position 1
+    with pytest.raises(ConflictError):
+        storage.update(1, {"Size": "9"}, expected_rev=seen.at[1, REVISION])
+    with pytest.raises(ConflictError):
+        storage.delete([1], expected_revs={1: seen.at[1, REVISION]})
+    assert storage.load()["Plastic Type"].tolist() == ["T1", "T2"]
+
+
+def test_excel_accepts_changes_to_an_unchanged_row(storage):
+    seen = storage.load()
+    storage.update(1, {"Size": "9"}, expected_rev=seen.at[1, REVISION])
+    assert storage.load().at[1, "Size"] == 9
+
+
+def _journal(tmp_path):
+    return JournalExcelStorage("plastics", str(tmp_path / "plastics.xlsx"), "Template",
+                               DATABASES["plastics"]["columns"])
+
+
+@pytest.mark.parametrize("replaced", [0, 1])
+def test_journal_recovers_an_interrupted_compaction(tmp_path, monkeypatch, replaced):
+    storage = _journal(tmp_path)
+    ids = [storage.insert({"Plastic Type": f"T{i}"}) for i in range(3)]
+    storage.update(ids[1], {"Supplier": "S1"})
+    os_replace = os.replace
+    calls = []
+
+    def crash(src, dst):
+        # The process dies after `replaced` of the two file replaces
+        if len(calls) == replaced:
+            raise KeyboardInterrupt
+        calls.append(dst)
+        os_replace(src, dst)
+
+    with monkeypatch.context() as patch, pytest.raises(KeyboardInterrupt):
+        patch.setattr(os, "replace", crash)
+        storage.compact()
+
+    df = _journal(tmp_path).load()
+    assert df.index.tolist() == ids
+    assert df["Plastic Type"].tolist() == ["T0", "T1", "T2"]
+    assert df.at[ids[1], "Supplier"] == "S1"
+    assert not os.path.exists(storage.journal + ".tmp")